@@ -21,9 +21,15 @@
 # THE SOFTWARE.
 # 
 ##############################
+# Renders the event report of a stats file written by evolver_evo or
+# evolver_merge_evostats. The records are grouped by event in one pass, so
+# the report can also be made in process from already merged stats:
+#
+#   Stats = evolver_evostats_report.StatsFromTable(Table)
+#   evolver_evostats_report.WriteReport(Stats, File)
+import os
 import sys
-
-FileName = sys.argv[1]
+import evolverSimControl.lib.evolver_merge_evostats as mes
 
 Events = [
   "Substitute", \
@@ -119,318 +125,242 @@ def Die(s):
 	print >> sys.stderr, "**ERROR**", s, sys.argv
 	sys.exit(1)
 
-Fails = {}
-Rejects = {}
-Accepts = {}
-Details = {}
-RangeFails = {}
-RangeRejects = {}
-RangeAccepts = {}
-AccBases = {}
-RejBases = {}
-
-def Cmp(Ev1, Ev2):
-	global Accepts
-	N1 = 0
-	N2 = 0
-	if Ev1 in Accepts.keys():
-		N1 = Accepts[Ev1]
-	if Ev2 in Accepts.keys():
-		N2 = Accepts[Ev2]
-
-	if N1 > N2:
-		return 1
-	if N1 < N2:
-		return -1
-	return 0
-
-def Cmp2(b1, b2):
-	b1 = b1.replace("-", "")
-	b1 = b1.replace(",", "")
-	b1 = b1.replace(" ", "")
-	b2 = b2.replace("-", "")
-	b2 = b2.replace(",", "")
-	b2 = b2.replace(" ", "")
-	i1 = int(b1)
-	i2 = int(b2)
-	if i1 > i2:
-		return 1
-	if i1 < i2:
-		return -1
-	return 0
+# The Detail types reported, in order.
+DetailTypes = [ "Accept", "Reject", "Fail", "" ]
+
+# Counts of a stats file grouped by event. Ranges[Ev][Bin] is the list
+# [ Fails, Rejects, Accepts ] and RangeBins[Ev] the bins of Ev in order of
+# appearance. Details[Ev][Type][Subtype] is a count.
+class EvoStats(object):
+	def __init__(self):
+		self.Events = list(Events)
+		self.EventSet = set(Events)
+		self.Fails = {}
+		self.Rejects = {}
+		self.Accepts = {}
+		self.Ranges = {}
+		self.RangeBins = {}
+		self.Details = {}
+		self.AccBases = {}
+		self.RejBases = {}
 
 def Add(Dict, Key, N):
-	if Key in Dict.keys():
-		Dict[Key] += int(N)
-	else:
-		Dict[Key] = int(N)
-
-File = open(sys.argv[1])
-while 1:
-	Line = File.readline()
-	if len(Line) == 0:
-		break
-	Line = Line.strip()
-	if len(Line) == 0:
-		continue
-	if Line[0] == "#":
-		continue
-	
-	Fields = Line.split(";")
-	Rec = Fields[0]
-	Ev = Fields[1]
-	if Ev not in Events:
-		Events.append(Ev)
-
-	if Rec == "EV_FAILS":
-		Add(Fails, Ev, Fields[2])
-
-	elif Rec == "EV_REJECTS":
-		Add(Rejects, Ev, Fields[2])
-
-	elif Rec == "EV_ACCEPTS":
-		Add(Accepts, Ev, Fields[2])
-
-	elif Rec == "EV_DETAIL":
-		Key = Ev + ";" + Fields[2] + ";" + Fields[3]
-		Add(Details, Key, Fields[4])
-
-	elif Rec == "EV_RANGE_FAIL":
-		Key = Ev + ";" + Fields[2]
-		Add(RangeFails, Key, Fields[3])
-
-	elif Rec == "EV_RANGE_REJECT":
-		Key = Ev + ";" + Fields[2]
-		Add(RangeRejects, Key, Fields[3])
-
-	elif Rec == "EV_RANGE_ACCEPT":
-		Key = Ev + ";" + Fields[2]
-		Add(RangeAccepts, Key, Fields[3])
-
-	elif Rec == "EV_ACC_BASES":
-		Add(AccBases, Ev, Fields[2])
-
-	elif Rec == "EV_REJ_BASES":
-		Add(RejBases, Ev, Fields[2])
-
-	else:
-		Die("Unknown record type: " + Rec)
-
-Total = 0
-EvTotals = {}
-for Ev in Accepts.keys():
-	R = 0
-	if Ev in Rejects.keys():
-		R = Rejects[Ev]
-	N = Accepts[Ev] + R
-	EvTotals[Ev] = N
-	Total += N
-if Total == 0:
-	Total = 1
-
-SortedEvents = Accepts.keys()
-SortedEvents.sort(Cmp)
-
-print r"               Event       Fails     Rejects     Accepts        Acc%      Event%"
-print r"--------------------  ----------  ----------  ----------  ----------  ----------"
-for Ev in Events:
-	s = "%20.20s" % Ev
-
-	T = 0
-	if Ev in Fails.keys():
-		N = Fails[Ev]
-		T += N
-		s += "  %10u" % N
-	else:
-		s += "            "
-
-	RejectCount = 0
-	if Ev in Rejects.keys():
-		RejectCount = Rejects[Ev]
-		T += RejectCount
-		s += "  %10u" % RejectCount
-	else:
-		s += "            "
-
-	AcceptCount = 0
-	if Ev in Accepts.keys():
-		AcceptCount = Accepts[Ev]
-		T += AcceptCount
-		s += "  %10u" % AcceptCount
-	else:
-		s += "            "
-	
-	AcceptPct = 0
-	N = AcceptCount + RejectCount
-	if N > 0:
-		AcceptPct = float(AcceptCount)*100.0/float(N)
-	s += "  %9.1f%%" % AcceptPct
-
-	EventPct = float(N)*100.0/float(Total)
-	s += "  %9.3g%%" % EventPct
-
-	if T > 0:
-		print s
-
-print ""
-print r"               Event       Range       Fails     Rejects     Accepts       Total     Acc%"
-print "--------------------  ----------  ----------  ----------  ----------  ----------  -------"
-
-for Ev in Events:
-	Any = 0	
-
-	Bins = []
-	BinFails = {}
-	BinRejects = {}
-	BinAccepts = {}
-
-	for Key in RangeFails.keys():
+	Dict[Key] = Dict.get(Key, 0) + N
+
+def AddRange(Stats, Ev, Bin, i, N):
+	Bins = Stats.Ranges.get(Ev)
+	if Bins == None:
+		Bins = Stats.Ranges[Ev] = {}
+		Stats.RangeBins[Ev] = []
+	Counts = Bins.get(Bin)
+	if Counts == None:
+		Counts = Bins[Bin] = [ 0, 0, 0 ]
+		Stats.RangeBins[Ev].append(Bin)
+	Counts[i] += N
+
+RangeRecs = { "EV_RANGE_FAIL" : 0, "EV_RANGE_REJECT" : 1, "EV_RANGE_ACCEPT" : 2 }
+
+# Adds (key, count) pairs, keys as in evolver_merge_evostats, to Stats.
+def AddPairs(Stats, Pairs):
+	for Key, N in Pairs:
 		Fields = Key.split(";")
-		if Fields[0] != Ev:
-			continue
-		Bin = Fields[1]
-		if Bin not in Bins:
-			Bins.append(Bin)
-		BinFails[Bin] = RangeFails[Key]
+		Rec = Fields[0]
+		Ev = Fields[1]
+		if Ev not in Stats.EventSet:
+			Stats.Events.append(Ev)
+			Stats.EventSet.add(Ev)
 
-	for Key in RangeRejects.keys():
-		Fields = Key.split(";")
-		if Fields[0] != Ev:
-			continue
-		Bin = Fields[1]
-		if Bin not in Bins:
-			Bins.append(Bin)
-		BinRejects[Bin] = RangeRejects[Key]
+		if Rec == "EV_FAILS":
+			Add(Stats.Fails, Ev, N)
+
+		elif Rec == "EV_REJECTS":
+			Add(Stats.Rejects, Ev, N)
+
+		elif Rec == "EV_ACCEPTS":
+			Add(Stats.Accepts, Ev, N)
+
+		elif Rec == "EV_DETAIL":
+			Types = Stats.Details.setdefault(Ev, {})
+			Add(Types.setdefault(Fields[2], {}), Fields[3], N)
+
+		elif Rec in RangeRecs:
+			AddRange(Stats, Ev, Fields[2], RangeRecs[Rec], N)
+
+		elif Rec == "EV_ACC_BASES":
+			Add(Stats.AccBases, Ev, N)
+
+		elif Rec == "EV_REJ_BASES":
+			Add(Stats.RejBases, Ev, N)
 
-	for Key in RangeAccepts.keys():
-		Fields = Key.split(";")
-		if Fields[0] != Ev:
-			continue
-		Bin = Fields[1]
-		if Bin not in Bins:
-			Bins.append(Bin)
-		BinAccepts[Bin] = RangeAccepts[Key]
-
-	Bins.sort(Cmp2)
-	for Bin in Bins:
-		Fails = 0
-		Rejects = 0
-		Accepts = 0
-		
-		if Bin in BinFails.keys():
-			Fails = BinFails[Bin]
-		if Bin in BinRejects.keys():
-			Rejects = BinRejects[Bin]
-		if Bin in BinAccepts.keys():
-			Accepts = BinAccepts[Bin]
-
-		Total = Fails + Rejects + Accepts
-		if Total == 0:
-			continue
-		
-		s = "%20.20s  %10.10s" % (Ev, Bin)
-		
-		if Fails > 0:
-			s += "  %10u" % Fails
+		else:
+			Die("Unknown record type: " + Rec)
+	return Stats
+
+def StatsFromPairs(Pairs):
+	return AddPairs(EvoStats(), Pairs)
+
+# Stats of a dict of merged counts, as made by evolver_merge_evostats.
+def StatsFromValues(Values):
+	return StatsFromPairs(Values.iteritems())
+
+# Stats of an evolver_merge_evostats.StatsTable.
+def StatsFromTable(Table):
+	return StatsFromPairs(Table.Pairs())
+
+def ReadStats(FileName):
+	Table = mes.LoadStatsTable(FileName)
+	if Table == None:
+		return StatsFromPairs(mes.IterStatsPairs(FileName))
+	return StatsFromTable(Table)
+
+def BinValue(Bin):
+	return int(Bin.replace("-", "").replace(",", "").replace(" ", ""))
+
+def WriteEventTable(Stats, File):
+	Total = 0
+	for Ev, AcceptCount in Stats.Accepts.iteritems():
+		Total += AcceptCount + Stats.Rejects.get(Ev, 0)
+	if Total == 0:
+		Total = 1
+
+	print >> File, r"               Event       Fails     Rejects     Accepts        Acc%      Event%"
+	print >> File, r"--------------------  ----------  ----------  ----------  ----------  ----------"
+	for Ev in Stats.Events:
+		s = "%20.20s" % Ev
+
+		T = 0
+		if Ev in Stats.Fails:
+			N = Stats.Fails[Ev]
+			T += N
+			s += "  %10u" % N
 		else:
 			s += "            "
 
-		if Rejects > 0:
-			s += "  %10u" % Rejects
+		RejectCount = 0
+		if Ev in Stats.Rejects:
+			RejectCount = Stats.Rejects[Ev]
+			T += RejectCount
+			s += "  %10u" % RejectCount
 		else:
 			s += "            "
 
-		if Accepts > 0:
-			s += "  %10u" % Accepts
+		AcceptCount = 0
+		if Ev in Stats.Accepts:
+			AcceptCount = Stats.Accepts[Ev]
+			T += AcceptCount
+			s += "  %10u" % AcceptCount
 		else:
 			s += "            "
-		
-		s += "  %10u" % Total
-		
-		if Total > 0:
+
+		AcceptPct = 0
+		N = AcceptCount + RejectCount
+		if N > 0:
+			AcceptPct = float(AcceptCount)*100.0/float(N)
+		s += "  %9.1f%%" % AcceptPct
+
+		EventPct = float(N)*100.0/float(Total)
+		s += "  %9.3g%%" % EventPct
+
+		if T > 0:
+			print >> File, s
+
+def WriteRangeTable(Stats, File):
+	print >> File, r"               Event       Range       Fails     Rejects     Accepts       Total     Acc%"
+	print >> File, "--------------------  ----------  ----------  ----------  ----------  ----------  -------"
+
+	for Ev in Stats.Events:
+		if Ev not in Stats.Ranges:
+			continue
+		Any = 0
+		Bins = Stats.Ranges[Ev]
+		for Bin in sorted(Stats.RangeBins[Ev], key=BinValue):
+			Fails, Rejects, Accepts = Bins[Bin]
+			Total = Fails + Rejects + Accepts
+			if Total == 0:
+				continue
+
+			s = "%20.20s  %10.10s" % (Ev, Bin)
+
+			if Fails > 0:
+				s += "  %10u" % Fails
+			else:
+				s += "            "
+
+			if Rejects > 0:
+				s += "  %10u" % Rejects
+			else:
+				s += "            "
+
+			if Accepts > 0:
+				s += "  %10u" % Accepts
+			else:
+				s += "            "
+
+			s += "  %10u" % Total
+
 			AccPct = (100.0*Accepts)/Total
 			s += "  %6.1f%%" % AccPct
-		
-		print s
-		Any = 1
-	if Any:
-		print ""
-
-def GetSubtype(s):
-	Fields = s.split(";")
-	return Fields[2]
-	
-def CmpSTS(x, y):
-	sx = GetSubtype(x)
-	sy = GetSubtype(y)
-	if sx > sy:
-		return 1
-	elif sx < sy:
-		return -1
-	else:
-		return 0
-
-print ""
-print "               Event        Type           Subtype       Total      Pct"
-print "--------------------  ----------  ----------------  ----------  -------"
-
-for Ev in Events:
-	if Ev == "sub_ins":
-		print ""
-	Any = 0
-	Keys = Details.keys()
-	Types = [ "Accept", "Reject", "Fail", "" ]
-	for Type in Types:
+
+			print >> File, s
+			Any = 1
+		if Any:
+			print >> File, ""
+
+def WriteDetailTable(Stats, File):
+	print >> File, "               Event        Type           Subtype       Total      Pct"
+	print >> File, "--------------------  ----------  ----------------  ----------  -------"
+
+	for Ev in Stats.Events:
+		if Ev == "sub_ins":
+			print >> File, ""
+		Any = 0
+		Types = Stats.Details.get(Ev, {})
 		Total = 0
-		SubtypeStrings = []
-		for Key in Keys:
-			Fields = Key.split(";")
-			if Fields[0] != Ev:
-				continue
-			SubtypeStrings.append(Key)
-			Count = Details[Key]
-			Total += Count
+		for Subtypes in Types.itervalues():
+			Total += sum(Subtypes.itervalues())
 		if Total == 0:
 			Total = 1
-
-		SubtypeStrings.sort(CmpSTS)
-		for Key in SubtypeStrings:
-			Fields = Key.split(";")
-			Type2 = Fields[1]
-			if Type2 != Type:
-				# print "Type=%s Type2=%s" % (Type, Type2)
+		for Type in DetailTypes:
+			if Type not in Types:
 				continue
+			for Subtype, Count in sorted(Types[Type].iteritems()):
+				if Count == 0:
+					continue
+				print >> File, "%20.20s  %10.10s  %16.16s  %10u  %6.1f%%" % (Ev, Type, Subtype, Count, 100.0*float(Count)/Total)
+				Any = 1
+		if Any and not Ev in ConstraintChangeEvents:
+			print >> File, ""
+
+def WriteBasesTable(Stats, File):
+	print >> File, "               Event   Acc.Bases   Rej.Bases"
+	print >> File, "--------------------  ----------  ----------"
 
-		for Key in SubtypeStrings:
-			Fields = Key.split(";")
-			Type2 = Fields[1]
-			if Type2 != Type:
-				# print "Type=%s Type2=%s" % (Type, Type2)
-				continue
-			Count = Details[Key]
-			if Count == 0:
-				continue
-			Subtype = Fields[2]
-			print "%20.20s  %10.10s  %16.16s  %10u  %6.1f%%" % (Ev, Type2, Subtype, Count, 100.0*float(Count)/Total)
-			Any = 1
-	if Any and not Ev in ConstraintChangeEvents:
-		print ""
-
-print ""
-print "               Event   Acc.Bases   Rej.Bases"
-print "--------------------  ----------  ----------"
-
-Any = 0
-for Ev in Events:
-	Acc = 0
-	Rej = 0
-	if Ev in AccBases.keys():
-		Acc = AccBases[Ev]
-	if Ev in RejBases.keys():
-		Rej = RejBases[Ev]
-	if Acc == 0 and Rej == 0:
-		continue
-	Any = 1
-	print "%20.20s  %10u  %10u" % (Ev, Acc, Rej)
-if Any:
-	print ""
+	Any = 0
+	for Ev in Stats.Events:
+		Acc = Stats.AccBases.get(Ev, 0)
+		Rej = Stats.RejBases.get(Ev, 0)
+		if Acc == 0 and Rej == 0:
+			continue
+		Any = 1
+		print >> File, "%20.20s  %10u  %10u" % (Ev, Acc, Rej)
+	if Any:
+		print >> File, ""
+
+def WriteReport(Stats, File):
+	WriteEventTable(Stats, File)
+	print >> File, ""
+	WriteRangeTable(Stats, File)
+	print >> File, ""
+	WriteDetailTable(Stats, File)
+	print >> File, ""
+	WriteBasesTable(Stats, File)
+
+# Atomically writes the report of Stats to FileName.
+def WriteReportFile(Stats, FileName):
+	File = open(FileName + ".tmp", "w")
+	WriteReport(Stats, File)
+	File.close()
+	os.rename(FileName + ".tmp", FileName)
+
+if __name__ == "__main__":
+	WriteReport(ReadStats(sys.argv[1]), sys.stdout)
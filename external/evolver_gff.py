@@ -20,8 +20,15 @@
 # THE SOFTWARE.
 # 
 ##############################
+import array
+import cPickle
+import os
 import re
 import sys
+try:
+	import numpy
+except ImportError:
+	numpy = None
 
 MaxError = -1
 TargetLabel = ""
@@ -110,57 +117,24 @@ def HasDeletedMerged():
 def HasCRCC():
 	return Attrs.find("CRCC") >= 0
 	
-def GetAttrDict():
-	AttrDict = {}
-	a = Attrs
-	while 1:
-		Match = re.match("[ \t;]*([A-Za-z_][A-Za-z_0-9]*)[ \t]+([^;]*);", a)
-		if Match == None:
-			break
-		AttrName = Match.groups()[0]
-		AttrValue = Match.groups()[1]
-		if AttrValue[0] == '"':
-			AttrValue = AttrValue[1:-1]
-		AttrDict[AttrName] = AttrValue
-		Match = re.match("([ \t;]*[A-Za-z_][A-Za-z_0-9]*[ \t]+([^;]*);)", a)
-		if Match == None:
-			print "ERROR"
-			break			
-		x = Match.groups()[0]
-		n = len(x)
-		a = a[n:]
-		#print ""
-		#print "x=%s" % x
-		#print "n=%d" % n
-		#print "a=%s" % a
-		#print ""
+# <name> <value>; pairs of the attributes field, compiled once
+AttrPatt = re.compile("[ \t;]*([A-Za-z_][A-Za-z_0-9]*)[ \t]+([^;]*);")
 
-	return AttrDict
+def GetAttrDict():
+	return GetAttrDictFromStr(Attrs)
 
 def GetAttrDictFromStr(a):
 	AttrDict = {}
+	Pos = 0
 	while 1:
-		Match = re.match("[ \t;]*([A-Za-z_][A-Za-z_0-9]*)[ \t]+([^;]*);", a)
+		Match = AttrPatt.match(a, Pos)
 		if Match == None:
 			break
-		AttrName = Match.groups()[0]
-		AttrValue = Match.groups()[1]
-		if AttrValue[0] == '"':
+		AttrName, AttrValue = Match.groups()
+		if AttrValue[0:1] == '"':
 			AttrValue = AttrValue[1:-1]
 		AttrDict[AttrName] = AttrValue
-		Match = re.match("([ \t;]*[A-Za-z_][A-Za-z_0-9]*[ \t]+([^;]*);)", a)
-		if Match == None:
-			print "ERROR"
-			break			
-		x = Match.groups()[0]
-		n = len(x)
-		a = a[n:]
-		#print ""
-		#print "x=%s" % x
-		#print "n=%d" % n
-		#print "a=%s" % a
-		#print ""
-
+		Pos = Match.end()
 	return AttrDict
 
 def GetStrAttr(Name, DefaultValue):
@@ -567,7 +541,100 @@ def ParseRepeatAttrs():
 # Repeat <RepeatName> <RepeatFamily> <RepeatFrom> <RepeatTo> <RepeatLeft>
 #             0             1            2             3            4
 
-def ParseRec(Line):
+# One GFF record. Unlike the module level ParseRec() state records are
+# independent of each other, so they may be kept, sorted and used from
+# several threads. The attributes field is parsed on first use only.
+class GFFRec(object):
+	__slots__ = ("Label", "Source", "Feature", "Start", "End", "Score", "Strand",
+	  "Frame", "Attrs", "AttrDict")
+
+	def __init__(self, Label, Source, Feature, Start, End, Score = 0,
+	  Strand = ".", Frame = ".", Attrs = ""):
+		self.Label = Label
+		self.Source = Source
+		self.Feature = Feature
+		self.Start = Start
+		self.End = End
+		self.Score = Score
+		self.Strand = Strand
+		self.Frame = Frame
+		self.Attrs = Attrs
+		self.AttrDict = None
+
+	def GetAttrDict(self):
+		if self.AttrDict == None:
+			self.AttrDict = GetAttrDictFromStr(self.Attrs)
+		return self.AttrDict
+
+	def GetStrAttr(self, Name, DefaultValue = None):
+		return self.GetAttrDict().get(Name, DefaultValue)
+
+	def GetIntAttr(self, Name, DefaultValue = None):
+		Value = self.GetAttrDict().get(Name)
+		if Value == None:
+			return DefaultValue
+		return int(Value)
+
+	def GetRequiredStrAttr(self, Name):
+		Value = self.GetStrAttr(Name)
+		if Value == None:
+			Quit("Required attr '%s' not found" % Name)
+		return Value
+
+	def GetRequiredIntAttr(self, Name):
+		return int(self.GetRequiredStrAttr(Name))
+
+	def HitLength(self):
+		return self.End - self.Start + 1
+
+	def Key(self):
+		return (self.Label, self.Start, self.End)
+
+	def ToStr(self):
+		return "%s\t%s\t%s\t%d\t%d\t%.5g\t%s\t%s\t%s" % (self.Label, self.Source,
+		  self.Feature, self.Start, self.End, self.Score, self.Strand, self.Frame, self.Attrs)
+
+	def Write(self, File):
+		print >> File, self.ToStr()
+
+def RecFromLine(Line):
+	Fields = Line.split("\t")
+	if len(Fields) < 8:
+		Quit("Expected 8 fields in GFF record, got: " + Line)
+	if Fields[5] == ".":
+		Score = 0
+	else:
+		Score = float(Fields[5])
+	Attrs = ""
+	if len(Fields) > 8:
+		Attrs = Fields[8]
+	return GFFRec(Fields[0], Fields[1], Fields[2], int(Fields[3]), int(Fields[4]),
+	  Score, Fields[6], Fields[7], Attrs)
+
+# Generator over the records of a GFF file, blank lines are skipped.
+def IterRecs(FileName):
+	File = open(FileName)
+	for Line in File:
+		Line = Line.strip()
+		if len(Line) == 0:
+			continue
+		yield RecFromLine(Line)
+	File.close()
+
+# Records of a GFF file in the order of GetSortedLines(), each line is
+# parsed once.
+def GetSortedRecList(FileName):
+	Recs = list(IterRecs(FileName))
+	Recs.sort(key=GFFRec.Key)
+	return Recs
+
+def IterSortedRecs(FileName):
+	for Rec in GetSortedRecList(FileName):
+		yield Rec
+
+# Compatibility with the module level state used by the older scripts:
+# the current record is copied into the globals below.
+def SetRec(Rec):
 	global Label
 	global Source
 	global Feature
@@ -578,25 +645,18 @@ def ParseRec(Line):
 	global Frame
 	global Attrs
 
-	Fields = Line.split("\t")
-	if len(Fields) < 8:
-		Quit("Expected 8 fields in GFF record, got: " + Line)
-	
-	Label = Fields[0]
-	Source = Fields[1]
-	Feature = Fields[2]
-	Start = int(Fields[3])
-	End = int(Fields[4])
-	if Fields[5] == ".":
-		Score = 0
-	else:
-		Score = float(Fields[5])
-	Strand = Fields[6]
-	Frame = Fields[7]
+	Label = Rec.Label
+	Source = Rec.Source
+	Feature = Rec.Feature
+	Start = Rec.Start
+	End = Rec.End
+	Score = Rec.Score
+	Strand = Rec.Strand
+	Frame = Rec.Frame
+	Attrs = Rec.Attrs
 
-	Attrs = ""
-	if len(Fields) > 8:
-		Attrs = Fields[8]
+def ParseRec(Line):
+	SetRec(RecFromLine(Line))
 		
 def GetRec(File, OnRecord):
 	global Line
@@ -653,6 +713,14 @@ def CompareGFFLines(Line1, Line2):
 	else:
 		return 1
 
+# Sort key giving the same order as CompareGFFLines, each line is
+# parsed once rather than twice per comparison.
+def GFFLineKey(Line):
+	Fields = Line.split("\t")
+	if len(Fields) < 8:
+		Quit("Expected 8 fields in GFF record, got: " + Line)
+	return (Fields[0], int(Fields[3]), int(Fields[4]))
+
 def GetSortedLines(FileName):
 	SortedLines = []
 	File = open(FileName)
@@ -672,7 +740,7 @@ def GetSortedLines(FileName):
 		sys.stderr.write("100.0%\n")
 
 	print >> sys.stderr, "Sorting %d recs" % len(SortedLines)
-	SortedLines.sort(CompareGFFLines)
+	SortedLines.sort(key=GFFLineKey)
 	return SortedLines
 
 def GetSortedRecs(FileName, OnRecord):
@@ -762,3 +830,194 @@ def PutRecAsDict(r):
 	Strand = r["Strand"]
 	Frame = r["Frame"]
 	Attrs = r["Attrs"]
+
+# Columnar loading for bulk statistics. Label, Source, Feature and Strand
+# are stored as integer codes into lists of their distinct values, which
+# are in order of first appearance. Columns are numpy arrays when numpy is
+# installed, otherwise array.array, and the Group* functions below compute
+# per code aggregates over either.
+class GFFColumns(object):
+	__slots__ = ("Labels", "Sources", "Features", "Strands", "LabelCodes",
+	  "SourceCodes", "FeatureCodes", "StrandCodes", "Starts", "Ends", "GeneIndexes")
+
+	def __len__(self):
+		return len(self.Starts)
+
+	def Lengths(self):
+		if numpy != None:
+			return self.Ends - self.Starts + 1
+		return array.array("l", [e - s + 1 for s, e in zip(self.Starts, self.Ends)])
+
+	def FeatureCode(self, Feature):
+		if Feature in self.Features:
+			return self.Features.index(Feature)
+		return -1
+
+GeneIndexPatt = re.compile("(?:^|[ \t;])gene_index[ \t]+([^;]*);")
+
+# With GeneIndex=True the gene_index attribute of every record is read
+# into GeneIndexes, -1 where it is missing.
+def LoadColumns(FileName, GeneIndex = False):
+	Cols = GFFColumns()
+	Names = [ [], [], [], [] ]
+	Dicts = [ {}, {}, {}, {} ]
+	Codes = [ array.array("i") for i in range(0, 4) ]
+	Starts = array.array("l")
+	Ends = array.array("l")
+	GeneIndexes = array.array("l")
+	File = open(FileName)
+	for Line in File:
+		Line = Line.strip()
+		if len(Line) == 0:
+			continue
+		Fields = Line.split("\t")
+		if len(Fields) < 8:
+			Quit("Expected 8 fields in GFF record, got: " + Line)
+		# label, source, feature, strand
+		for i, j in ((0, 0), (1, 1), (2, 2), (3, 6)):
+			Code = Dicts[i].get(Fields[j])
+			if Code == None:
+				Code = len(Names[i])
+				Dicts[i][Fields[j]] = Code
+				Names[i].append(Fields[j])
+			Codes[i].append(Code)
+		Starts.append(int(Fields[3]))
+		Ends.append(int(Fields[4]))
+		if GeneIndex:
+			Values = []
+			if len(Fields) > 8:
+				Values = GeneIndexPatt.findall(Fields[8])
+			if Values == []:
+				GeneIndexes.append(-1)
+			else:
+				GeneIndexes.append(int(Values[-1].strip('"')))
+	File.close()
+	Cols.Labels, Cols.Sources, Cols.Features, Cols.Strands = Names
+	Columns = Codes + [ Starts, Ends, GeneIndexes ]
+	if numpy != None:
+		Columns = [ numpy.frombuffer(c, dtype=c.typecode).copy() for c in Columns ]
+	(Cols.LabelCodes, Cols.SourceCodes, Cols.FeatureCodes, Cols.StrandCodes,
+	  Cols.Starts, Cols.Ends, Cols.GeneIndexes) = Columns
+	return Cols
+
+# Number of records of each of the N codes.
+def GroupCount(Codes, N):
+	if numpy != None:
+		return [ int(x) for x in numpy.bincount(Codes, minlength=N)[0:N] ]
+	Counts = [0]*N
+	for c in Codes:
+		Counts[c] += 1
+	return Counts
+
+# Sum of Values for each of the N codes.
+def GroupSum(Codes, Values, N):
+	if numpy != None:
+		Sums = numpy.zeros(N, dtype=numpy.int64)
+		numpy.add.at(Sums, Codes, Values)
+		return [ int(x) for x in Sums ]
+	Sums = [0]*N
+	for c, v in zip(Codes, Values):
+		Sums[c] += v
+	return Sums
+
+# Minimum and maximum of Values for each of the N codes, None for
+# codes that do not occur.
+def GroupMinMax(Codes, Values, N):
+	if numpy != None:
+		Counts = numpy.bincount(Codes, minlength=N)[0:N]
+		Mins = numpy.empty(N, dtype=numpy.int64)
+		Maxs = numpy.empty(N, dtype=numpy.int64)
+		Mins.fill(numpy.iinfo(numpy.int64).max)
+		Maxs.fill(numpy.iinfo(numpy.int64).min)
+		numpy.minimum.at(Mins, Codes, Values)
+		numpy.maximum.at(Maxs, Codes, Values)
+		Mins = [ int(x) for x in Mins ]
+		Maxs = [ int(x) for x in Maxs ]
+		for i in range(0, N):
+			if Counts[i] == 0:
+				Mins[i] = None
+				Maxs[i] = None
+		return Mins, Maxs
+	Mins = [None]*N
+	Maxs = [None]*N
+	for c, v in zip(Codes, Values):
+		if Mins[c] == None or v < Mins[c]:
+			Mins[c] = v
+		if Maxs[c] == None or v > Maxs[c]:
+			Maxs[c] = v
+	return Mins, Maxs
+
+# Distinct values of Codes in order of first appearance.
+def FirstAppearance(Codes):
+	return Recode(Codes)[0]
+
+# Renumbers Codes 0, 1, ... in order of first appearance, returns the
+# list of distinct values and the new codes.
+def Recode(Codes):
+	if numpy != None:
+		Values, Index, Inverse = numpy.unique(Codes, return_index=True, return_inverse=True)
+		Order = numpy.argsort(Index, kind="mergesort")
+		Rank = numpy.empty(len(Order), dtype=numpy.int64)
+		Rank[Order] = numpy.arange(len(Order))
+		return [ int(Values[i]) for i in Order ], Rank[Inverse]
+	Seen = {}
+	Order = []
+	NewCodes = array.array("l")
+	for c in Codes:
+		if c not in Seen:
+			Seen[c] = len(Order)
+			Order.append(c)
+		NewCodes.append(Seen[c])
+	return Order, NewCodes
+
+# Selects the records where Mask is true from each of the Arrays.
+def Select(Mask, *Arrays):
+	if numpy != None:
+		Mask = numpy.asarray(Mask, dtype=bool)
+		return [ a[Mask] for a in Arrays ]
+	return [ array.array(a.typecode, [ x for x, m in zip(a, Mask) if m ]) for a in Arrays ]
+
+# Mask of the records whose code is one of Codes.
+def CodeMask(CodeColumn, Codes):
+	if numpy != None:
+		return numpy.in1d(CodeColumn, list(Codes))
+	Codes = set(Codes)
+	return [ c in Codes for c in CodeColumn ]
+
+# Sidecar files cache data derived from a file in FileName + Suffix, as a
+# cPickle of the data and the stamp of FileName it was made from: Version,
+# which is bumped when the layout of the data changes, and the size and
+# mtime of the file. Take the stamp before reading the file, so that a file
+# changed meanwhile leaves a stale sidecar.
+def SidecarStamp(FileName, Version):
+	st = os.stat(FileName)
+	return (Version, st.st_size, st.st_mtime)
+
+# The data of a sidecar, or None if it is missing, stale, truncated or can
+# not be unpickled, in which case the caller rebuilds it.
+def LoadSidecar(FileName, Suffix, Stamp):
+	if not os.path.exists(FileName + Suffix):
+		return None
+	try:
+		File = open(FileName + Suffix, "rb")
+		try:
+			SavedStamp, Data = cPickle.load(File)
+		finally:
+			File.close()
+	except (IOError, EOFError, ValueError, TypeError, KeyError, IndexError,
+	  AttributeError, ImportError, cPickle.UnpicklingError):
+		return None
+	if SavedStamp != Stamp:
+		return None
+	return Data
+
+def SaveSidecar(FileName, Suffix, Stamp, Data):
+	# directories that can not be written to just go without a sidecar
+	try:
+		TmpName = FileName + Suffix + ".tmp.%d" % os.getpid()
+		File = open(TmpName, "wb")
+		cPickle.dump((Stamp, Data), File, 2)
+		File.close()
+		os.rename(TmpName, FileName + Suffix)
+	except (IOError, OSError):
+		pass
@@ -32,29 +32,29 @@ def Die(s):
 	print >> sys.stderr, sys.argv[0], "***ERROR***", s
 	sys.exit(1)
 
-def DoRec():
-	global RecordCounts, BaseCounts
-	
-	Length = gff.End - gff.Start + 1
-
-	if gff.Feature not in RecordCounts.keys():
-		RecordCounts[gff.Feature] = {}
-		BaseCounts[gff.Feature] = {}
-	
-	if gff.Label not in RecordCounts[gff.Feature].keys():
-#		print >> sys.stderr, "SET", gff.Label, gff.Feature, "keys=", RecordCounts[gff.Feature].keys()
-		RecordCounts[gff.Feature][gff.Label] = 1
-		BaseCounts[gff.Feature][gff.Label] = Length
-	else:
-		RecordCounts[gff.Feature][gff.Label] += 1
-		BaseCounts[gff.Feature][gff.Label] += Length
-	
 FileName = sys.argv[1]
 
 RecordCounts = {}
 BaseCounts = {}
 
-gff.GetRecs(FileName, DoRec)
+Cols = gff.LoadColumns(FileName)
+NL = len(Cols.Labels)
+N = len(Cols.Features)*NL
+if gff.numpy != None:
+	Pairs = Cols.FeatureCodes.astype(gff.numpy.int64)*NL + Cols.LabelCodes
+else:
+	Pairs = [ f*NL + l for f, l in zip(Cols.FeatureCodes, Cols.LabelCodes) ]
+Recs = gff.GroupCount(Pairs, N)
+Bases = gff.GroupSum(Pairs, Cols.Lengths(), N)
+# keys are added in order of first appearance, as records are read
+for Pair in gff.FirstAppearance(Pairs):
+	Feature = Cols.Features[Pair/NL]
+	Label = Cols.Labels[Pair%NL]
+	if Feature not in RecordCounts.keys():
+		RecordCounts[Feature] = {}
+		BaseCounts[Feature] = {}
+	RecordCounts[Feature][Label] = Recs[Pair]
+	BaseCounts[Feature][Label] = Bases[Pair]
 
 print "             Seq     Feature        Recs       Bases"
 print "================  ==========  ==========  =========="
@@ -21,23 +21,19 @@
 # THE SOFTWARE.
 # 
 ##############################
+# Compares the feature counts and bases of two GFF files, optionally with
+# the genome lengths of both to report neutral and total bases:
+#
+#   evolver_gff_featurestats2.py 1.gff 2.gff [Name1 Name2 [Length1 Length2]]
+#
+# The counts of a GFF are saved in a <file>.featurecounts sidecar, so that
+# a file compared more than once, as a cycle is against its parent and its
+# children, is aggregated once. WriteDiff() runs the comparison in process.
+import os
 import sys
 import evolverSimControl.lib.evolver_gff as gff
-	
-FileName1 = sys.argv[1]
-FileName2 = sys.argv[2]
-Name1 = FileName1
-Name2 = FileName2
-GenomeLength1 = -1
-GenomeLength2 = -1
-if len(sys.argv) > 3:
-	Name1 = sys.argv[3]
-if len(sys.argv) > 4:
-	Name2 = sys.argv[4]
-if len(sys.argv) > 6:
-	GenomeLength1 = int(sys.argv[5])
-	GenomeLength2 = int(sys.argv[6])
-	
+
+CountsVersion = 1
 
 ConstrainedFeatures = [ "CDS", "UTR", "NXE", "NGE" ]
 
@@ -45,25 +41,8 @@ def Die(s):
 	print >> sys.stderr, sys.argv[0], "***ERROR***", s
 	sys.exit(1)
 
-def DoRec():
-	global Counts, Bases
-
-	Length = gff.End - gff.Start + 1
-	Feature = gff.Feature
-
-	if Feature not in Bases.keys():
-		Bases[Feature] = Length
-		Counts[Feature] = 1
-	else:
-		Bases[Feature] += Length
-		Counts[Feature] += 1
-	
-	if Feature in ConstrainedFeatures:
-		Bases["Constrained"] += Length
-		Counts["Constrained"] += 1
-
 def Get(L, k):
-	if k in L.keys():
+	if k in L:
 		return L[k]
 	return 0
 
@@ -76,56 +55,106 @@ def PctChg(x, y):
 	else:
 		return str(100*(y-x)/x)
 
-def GetCounts(FileName):
-	global Bases, Counts
+# (Feature, Count, Bases) of each feature of a GFF file, in order of first
+# appearance.
+def AggregateFeatures(FileName):
+	Cols = gff.LoadColumns(FileName)
+	N = len(Cols.Features)
+	RecCounts = gff.GroupCount(Cols.FeatureCodes, N)
+	BaseSums = gff.GroupSum(Cols.FeatureCodes, Cols.Lengths(), N)
+	return [ (Feature, RecCounts[i], BaseSums[i]) for i, Feature in enumerate(Cols.Features) ]
+
+# The feature counts of a GFF file. With Cache they come from its sidecar,
+# or are aggregated and saved there, otherwise no file is written.
+def GetFeatureCounts(FileName, Cache=False):
+	if not Cache:
+		return AggregateFeatures(FileName)
+	S = gff.SidecarStamp(FileName, CountsVersion)
+	FeatureCounts = gff.LoadSidecar(FileName, ".featurecounts", S)
+	if FeatureCounts == None:
+		FeatureCounts = AggregateFeatures(FileName)
+		gff.SaveSidecar(FileName, ".featurecounts", S, FeatureCounts)
+	return FeatureCounts
+
+def GetCounts(FileName, Cache=False):
 	Bases = {}
 	Counts = {}
 	Bases["Constrained"] = 0
 	Counts["Constrained"] = 0
-	gff.GetRecs(FileName, DoRec)
+	# features are added in order of first appearance, as records are read
+	for Feature, RecCount, BaseSum in GetFeatureCounts(FileName, Cache):
+		Bases[Feature] = BaseSum
+		Counts[Feature] = RecCount
+		if Feature in ConstrainedFeatures:
+			Bases["Constrained"] += BaseSum
+			Counts["Constrained"] += RecCount
 	return Counts, Bases
 
-Counts1, Bases1 = GetCounts(FileName1)
-Counts2, Bases2 = GetCounts(FileName2)
+def WriteDiff(FileName1, FileName2, Name1, Name2, GenomeLength1, GenomeLength2, File, Cache=False):
+	Counts1, Bases1 = GetCounts(FileName1, Cache)
+	Counts2, Bases2 = GetCounts(FileName2, Cache)
+
+	Features = [ "CDS", "UTR", "NXE", "NGE", "island", "tandem", "Constrained" ]
+	Keys = Counts1.keys()
+	Keys.extend(Counts2.keys())
+	for Feature in Keys:
+		if Feature not in Features:
+			Features.append(Feature)
+
+	if GenomeLength1 != -1:
+		Features.append("Neutral")
+		Features.append("Total")
+		Counts1["Neutral"] = 0
+		Counts2["Neutral"] = 0
+		Counts1["Total"] = 0
+		Counts2["Total"] = 0
+		Bases1["Neutral"] = GenomeLength1 -  Bases1["Constrained"]
+		Bases2["Neutral"] = GenomeLength2 -  Bases2["Constrained"]
+		Bases1["Total"] = GenomeLength1
+		Bases2["Total"] = GenomeLength2
 
-Features = [ "CDS", "UTR", "NXE", "NGE", "island", "tandem", "Constrained" ]
-Keys = Counts1.keys()
-Keys.extend(Counts2.keys())
-for Feature in Keys:
-	if Feature not in Features:
-		Features.append(Feature)
+	print >> File, "         Feature  1=%8.8s  2=%8.8s       Nr2-1   2-1 Pct      Bases1      Bases2    Bases2-1   2-1 Pct" % (Name1, Name2)
+	print >> File, "================  ==========  ==========  ==========  ========  ==========  ==========  ==========  ========"
+	for Feature in Features:
+		n1 = Get(Counts1, Feature)
+		n2 = Get(Counts2, Feature)
+		b1 = Get(Bases1, Feature)
+		b2 = Get(Bases2, Feature)
+		pn = PctChg(n1, n2)
+		pb = PctChg(b1, b2)
+		s = ""
+		s += "%16.16s" % Feature
+		s += "  %10u" % n1
+		s += "  %10u" % n2
+		s += "  %+10d" % (n2 - n1)
+		s += "  %7.7s%%" % pn
+		s += "  %10u" % b1
+		s += "  %10u" % b2
+		s += "  %+10d" % (b2-b1)
+		s += "  %7.7s%%" % pb
+		print >> File, s
 
-if GenomeLength1 != -1:
-	Features.append("Neutral")
-	Features.append("Total")
-	Counts1["Neutral"] = 0
-	Counts2["Neutral"] = 0
-	Counts1["Total"] = 0
-	Counts2["Total"] = 0
-	Bases1["Neutral"] = GenomeLength1 -  Bases1["Constrained"]
-	Bases2["Neutral"] = GenomeLength2 -  Bases2["Constrained"]
-	Bases1["Total"] = GenomeLength1
-	Bases2["Total"] = GenomeLength2
+# Atomically writes the comparison to FileName. The simulation compares each
+# GFF several times, so the feature counts are cached in .featurecounts
+# sidecars.
+def WriteDiffFile(FileName1, FileName2, Name1, Name2, GenomeLength1, GenomeLength2, FileName):
+	File = open(FileName + ".tmp", "w")
+	WriteDiff(FileName1, FileName2, Name1, Name2, GenomeLength1, GenomeLength2, File, True)
+	File.close()
+	os.rename(FileName + ".tmp", FileName)
 
-print "         Feature  1=%8.8s  2=%8.8s       Nr2-1   2-1 Pct      Bases1      Bases2    Bases2-1   2-1 Pct" % (Name1, Name2)
-print "================  ==========  ==========  ==========  ========  ==========  ==========  ==========  ========"
-for Feature in Features:
-	n1 = Get(Counts1, Feature)
-	n2 = Get(Counts2, Feature)
-	dn = n2 - n1
-	b1 = Get(Bases1, Feature)
-	b2 = Get(Bases2, Feature)
-	db = b2 - b1
-	pn = PctChg(n1, n2)
-	pb = PctChg(b1, b2)
-	s = ""
-	s += "%16.16s" % Feature
-	s += "  %10u" % n1
-	s += "  %10u" % n2
-	s += "  %+10d" % (n2 - n1)
-	s += "  %7.7s%%" % pn
-	s += "  %10u" % b1
-	s += "  %10u" % b2
-	s += "  %+10d" % (b2-b1)
-	s += "  %7.7s%%" % pb
-	print s
+if __name__ == "__main__":
+	FileName1 = sys.argv[1]
+	FileName2 = sys.argv[2]
+	Name1 = FileName1
+	Name2 = FileName2
+	GenomeLength1 = -1
+	GenomeLength2 = -1
+	if len(sys.argv) > 3:
+		Name1 = sys.argv[3]
+	if len(sys.argv) > 4:
+		Name2 = sys.argv[4]
+	if len(sys.argv) > 6:
+		GenomeLength1 = int(sys.argv[5])
+		GenomeLength2 = int(sys.argv[6])
+	WriteDiff(FileName1, FileName2, Name1, Name2, GenomeLength1, GenomeLength2, sys.stdout)
@@ -31,44 +31,37 @@ def Die(s):
 	print >> sys.stderr, "**ERROR**", s, sys.argv
 	sys.exit(1)
 
-def DoRec():
-	global GeneLos, GeneHis, GeneStrands, Label, Lo, Hi
-	
-	if gff.Feature != "CDS" and gff.Feature != "UTR" and gff.Feature != "exon":
-		return
-		
-	if Label == "":
-		Label = gff.Label
-	elif Label != gff.Label:
-		Die("More than one label in EVOLVER_GFF")
-	
-	if Hi == -1:
-		Hi = gff.End
-	else:
-		if gff.End > Hi:
-			Hi = gff.End
-	
-	GeneIndex = gff.GetRequiredIntAttr("gene_index")
-	if GeneIndex in GeneLos.keys():
-		if gff.Start < GeneLos[GeneIndex]:
-			GeneLos[GeneIndex] = gff.Start
-		if gff.End > GeneHis[GeneIndex]:
-			GeneHis[GeneIndex] = gff.End
-		if GeneStrands[GeneIndex] != gff.Strand:
-			Die("Gene on both strands")
-	else:
-		GeneLos[GeneIndex] = gff.Start
-		GeneHis[GeneIndex] = gff.End
-		GeneStrands[GeneIndex] = gff.Strand
+Cols = gff.LoadColumns(FileName, GeneIndex = True)
+Codes = [ Cols.FeatureCode(f) for f in [ "CDS", "UTR", "exon" ] ]
+Labels, GeneIndexes, Starts, Ends, Strands = gff.Select(gff.CodeMask(Cols.FeatureCodes, Codes),
+  Cols.LabelCodes, Cols.GeneIndexes, Cols.Starts, Cols.Ends, Cols.StrandCodes)
 
 Hi = -1
+if len(Labels) > 0:
+	if len(gff.FirstAppearance(Labels)) > 1:
+		Die("More than one label in EVOLVER_GFF")
+	if min(GeneIndexes) < 0:
+		gff.Quit("Required attr 'gene_index' not found")
+	Hi = int(max(Ends))
+
+# genes are added in order of first appearance, as records are read
+Genes, GeneCodes = gff.Recode(GeneIndexes)
+Los, x = gff.GroupMinMax(GeneCodes, Starts, len(Genes))
+x, His = gff.GroupMinMax(GeneCodes, Ends, len(Genes))
+StrandLos, StrandHis = gff.GroupMinMax(GeneCodes, Strands, len(Genes))
 GeneLos = {}
 GeneHis = {}
 GeneStrands = {}
+for i, GeneIndex in enumerate(Genes):
+	if StrandLos[i] != StrandHis[i]:
+		Die("Gene on both strands")
+	GeneLos[GeneIndex] = Los[i]
+	GeneHis[GeneIndex] = His[i]
+	GeneStrands[GeneIndex] = Cols.Strands[StrandLos[i]]
 
-Label = ""
-gff.GetRecs(FileName, DoRec)
-
+# the genes carry the label of the last record read
+if len(Cols) > 0:
+	gff.Label = Cols.Labels[Cols.LabelCodes[-1]]
 gff.Source = "gene_lengths"
 gff.Feature = "gene"
 gff.Score = 0
@@ -0,0 +1,265 @@
+# Copyright (C) 2008-2011 by
+# George Asimenos, Robert C. Edgar, Serafim Batzoglou and Arend Sidow.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+##############################
+# Interval index over the records of a GFF file, for overlap, nearest and
+# coverage queries by label and position.
+#
+# Per label the records are kept sorted by start as an implicit augmented
+# interval tree (the layout of Heng Li's cgranges): record i of the sorted
+# array is a tree node whose MaxEnds[i] is the largest end in its subtree,
+# so an overlap query visits O(log n + k) records. The arrays and the byte
+# offset of each record in the GFF are saved in a <file>.idx sidecar, which
+# is rebuilt when the GFF changes. Records are read from the GFF on demand.
+#
+#   Index = evolver_gff_index.GetIndex("annots.gff")
+#   for Rec in Index.Overlap("chrS3", 1200000, 1300000):
+#       print Rec.ToStr()
+#
+# Positions are 1-based and inclusive, as in GFF.
+import array
+import bisect
+import os
+import evolverSimControl.lib.evolver_gff as gff
+
+IndexVersion = 1
+
+class LabelIndex(object):
+	__slots__ = ("Starts", "Ends", "MaxEnds", "Offsets", "RootLevel", "PrefixMaxEnds")
+
+def Stamp(FileName):
+	return gff.SidecarStamp(FileName, IndexVersion)
+
+# Builds the MaxEnds array of the implicit tree over the sorted Starts
+# and Ends, returns the level of the root.
+def BuildTree(Ends, MaxEnds):
+	n = len(Ends)
+	if n == 0:
+		return -1
+	LastI = 0
+	Last = 0
+	for i in xrange(0, n, 2):
+		LastI = i
+		Last = MaxEnds[i] = Ends[i]
+	k = 1
+	while (1 << k) <= n:
+		x = 1 << (k - 1)
+		Step = x << 2
+		for i in xrange((x << 1) - 1, n, Step):
+			e = max(Ends[i], MaxEnds[i - x])
+			if i + x < n:
+				e = max(e, MaxEnds[i + x])
+			else:
+				e = max(e, Last)
+			MaxEnds[i] = e
+		if (LastI >> k) & 1:
+			LastI -= x
+		else:
+			LastI += x
+		if LastI < n and MaxEnds[LastI] > Last:
+			Last = MaxEnds[LastI]
+		k += 1
+	return k - 1
+
+class GFFIndex(object):
+	def __init__(self, FileName, Labels):
+		self.FileName = FileName
+		self.Labels = Labels
+		self.File = None
+
+	def GetLabels(self):
+		return self.Labels.keys()
+
+	def Close(self):
+		if self.File != None:
+			self.File.close()
+			self.File = None
+
+	def GetRecAt(self, Offset):
+		if self.File == None:
+			self.File = open(self.FileName)
+		self.File.seek(Offset)
+		return gff.RecFromLine(self.File.readline().strip())
+
+	# Positions in the sorted arrays of Label of the records overlapping
+	# Start..End, in order of start.
+	def OverlapIndexes(self, Label, Start, End):
+		L = self.Labels.get(Label)
+		Hits = []
+		if L == None or L.RootLevel < 0:
+			return Hits
+		# half open [St, En) as in the tree
+		St = Start - 1
+		En = End
+		n = len(L.Starts)
+		Stack = [ (L.RootLevel, (1 << L.RootLevel) - 1, 0) ]
+		while Stack != []:
+			k, x, w = Stack.pop()
+			if k <= 3:
+				# small subtree, scan it
+				i = x >> k << k
+				i1 = min(i + (1 << (k + 1)) - 1, n)
+				while i < i1 and L.Starts[i] - 1 < En:
+					if St < L.Ends[i]:
+						Hits.append(i)
+					i += 1
+			elif w == 0:
+				Stack.append((k, x, 1))
+				y = x - (1 << (k - 1))
+				if y >= n or L.MaxEnds[y] > St:
+					Stack.append((k - 1, y, 0))
+			elif x < n and L.Starts[x] - 1 < En:
+				if St < L.Ends[x]:
+					Hits.append(x)
+				Stack.append((k - 1, x + (1 << (k - 1)), 0))
+		return Hits
+
+	# Records of Label overlapping Start..End, optionally only those whose
+	# feature is in Features.
+	def Overlap(self, Label, Start, End, Features = None):
+		L = self.Labels.get(Label)
+		Recs = []
+		for i in self.OverlapIndexes(Label, Start, End):
+			Rec = self.GetRecAt(L.Offsets[i])
+			if Features == None or Rec.Feature in Features:
+				Recs.append(Rec)
+		return Recs
+
+	def OverlapCount(self, Label, Start, End):
+		return len(self.OverlapIndexes(Label, Start, End))
+
+	# The records of Label nearest to Pos: those overlapping it, otherwise
+	# the closest record ending before and starting after it, or [] if the
+	# label has no records. Ties are all returned.
+	def Nearest(self, Label, Pos):
+		L = self.Labels.get(Label)
+		if L == None or len(L.Starts) == 0:
+			return []
+		Recs = self.Overlap(Label, Pos, Pos)
+		if Recs != []:
+			return Recs
+		Candidates = []
+		# the last record ending before Pos, all records starting before
+		# Pos end before it
+		i = bisect.bisect_left(L.Starts, Pos)
+		if i > 0:
+			End = L.PrefixMaxEnds[i - 1]
+			Candidates += [ (Pos - End, j) for j in self.OverlapIndexes(Label, End, End)
+			  if L.Ends[j] == End ]
+		if i < len(L.Starts):
+			Start = L.Starts[i]
+			j = i
+			while j < len(L.Starts) and L.Starts[j] == Start:
+				Candidates.append((Start - Pos, j))
+				j += 1
+		Best = min([ d for d, j in Candidates ])
+		return [ self.GetRecAt(L.Offsets[j]) for d, j in Candidates if d == Best ]
+
+	# Number of bases of Start..End covered by records of Label, optionally
+	# only those whose feature is in Features.
+	def Coverage(self, Label, Start, End, Features = None):
+		L = self.Labels.get(Label)
+		Covered = 0
+		Last = Start - 1
+		for i in self.OverlapIndexes(Label, Start, End):
+			if Features != None and self.GetRecAt(L.Offsets[i]).Feature not in Features:
+				continue
+			s = max(L.Starts[i], Last + 1)
+			e = min(L.Ends[i], End)
+			if e >= s:
+				Covered += e - s + 1
+				Last = e
+		return Covered
+
+def BuildIndex(FileName):
+	Recs = {}
+	File = open(FileName)
+	Offset = 0
+	for Line in File:
+		Length = len(Line)
+		Line = Line.strip()
+		if len(Line) > 0:
+			Fields = Line.split("\t")
+			if len(Fields) < 8:
+				gff.Quit("Expected 8 fields in GFF record, got: " + Line)
+			Recs.setdefault(Fields[0], []).append((int(Fields[3]), int(Fields[4]), Offset))
+		Offset += Length
+	File.close()
+	Labels = {}
+	for Label in Recs.keys():
+		Recs[Label].sort()
+		L = LabelIndex()
+		L.Starts = array.array("l", [ r[0] for r in Recs[Label] ])
+		L.Ends = array.array("l", [ r[1] for r in Recs[Label] ])
+		L.Offsets = array.array("l", [ r[2] for r in Recs[Label] ])
+		L.MaxEnds = array.array("l", L.Ends)
+		L.RootLevel = BuildTree(L.Ends, L.MaxEnds)
+		L.PrefixMaxEnds = array.array("l", L.Ends)
+		for i in xrange(1, len(L.Ends)):
+			L.PrefixMaxEnds[i] = max(L.PrefixMaxEnds[i - 1], L.Ends[i])
+		Labels[Label] = L
+	return Labels
+
+def SaveIndex(FileName, Stamp, Labels):
+	Data = {}
+	for Label, L in Labels.items():
+		Data[Label] = (L.Starts.tostring(), L.Ends.tostring(), L.MaxEnds.tostring(),
+		  L.Offsets.tostring(), L.PrefixMaxEnds.tostring(), L.RootLevel)
+	gff.SaveSidecar(FileName, ".idx", Stamp, Data)
+
+def LoadIndex(FileName, Stamp):
+	Data = gff.LoadSidecar(FileName, ".idx", Stamp)
+	if Data == None:
+		return None
+	Labels = {}
+	for Label, (Starts, Ends, MaxEnds, Offsets, PrefixMaxEnds, RootLevel) in Data.items():
+		L = LabelIndex()
+		L.Starts, L.Ends, L.MaxEnds, L.Offsets, L.PrefixMaxEnds = [ array.array("l")
+		  for i in range(0, 5) ]
+		L.Starts.fromstring(Starts)
+		L.Ends.fromstring(Ends)
+		L.MaxEnds.fromstring(MaxEnds)
+		L.Offsets.fromstring(Offsets)
+		L.PrefixMaxEnds.fromstring(PrefixMaxEnds)
+		L.RootLevel = RootLevel
+		Labels[Label] = L
+	return Labels
+
+Indexes = {}
+
+# Index of a GFF file, loaded from its sidecar or built, and saved, on the
+# first query. Indexes are kept for the life of the process.
+def GetIndex(FileName):
+	FileName = os.path.abspath(FileName)
+	S = Stamp(FileName)
+	if FileName in Indexes and Indexes[FileName][0] == S:
+		return Indexes[FileName][1]
+	Labels = LoadIndex(FileName, S)
+	if Labels == None:
+		Labels = BuildIndex(FileName)
+		SaveIndex(FileName, S, Labels)
+	Index = GFFIndex(FileName, Labels)
+	Indexes[FileName] = (S, Index)
+	return Index
+
+# Index of the annots.gff of a simulation cycle directory.
+def GetCycleIndex(CycleDir):
+	return GetIndex(os.path.join(CycleDir, "annots.gff"))
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# Copyright (C) 2008-2011 by
+# George Asimenos, Robert C. Edgar, Serafim Batzoglou and Arend Sidow.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+##############################
+# Checks evolver_gff_index against brute force scans of random GFF files:
+# the queries of a freshly built index, of one loaded from its sidecar and
+# of one rebuilt over a garbage sidecar must all agree with a scan of the
+# records. Exits with status 1 and a message on the first mismatch.
+#
+#   python evolver_gff_index_test.py [Iterations]
+import os
+import random
+import shutil
+import sys
+import tempfile
+import evolverSimControl.lib.evolver_gff as gff
+import evolverSimControl.lib.evolver_gff_index as gffi
+
+Labels = [ "chrA", "chrB", "chrC" ]
+Features = [ "CDS", "UTR", "NXE" ]
+GenomeLength = 3000
+
+def Fail(s):
+	print >> sys.stderr, sys.argv[0], "***FAILED***", s
+	sys.exit(1)
+
+def RandomRecs(RecCount):
+	Recs = []
+	for i in xrange(0, RecCount):
+		# the last label is left empty
+		Label = random.choice(Labels[:-1])
+		Start = random.randint(1, GenomeLength)
+		if random.random() < 0.2 and Recs != []:
+			# shared starts
+			Start = random.choice(Recs).Start
+		End = min(Start + random.randint(0, random.choice([ 10, 100, 1000 ])), GenomeLength)
+		Recs.append(gff.GFFRec(Label, "test", random.choice(Features), Start, End))
+	return Recs
+
+def WriteRecs(Recs, FileName):
+	File = open(FileName, "w")
+	for Rec in Recs:
+		Rec.Write(File)
+	File.close()
+
+def Strs(Recs):
+	return sorted([ Rec.ToStr() for Rec in Recs ])
+
+def BruteOverlap(Recs, Label, Start, End, Fs = None):
+	return [ Rec for Rec in Recs if Rec.Label == Label and Rec.Start <= End and
+	  Rec.End >= Start and (Fs == None or Rec.Feature in Fs) ]
+
+def BruteNearest(Recs, Label, Pos):
+	Hits = BruteOverlap(Recs, Label, Pos, Pos)
+	if Hits != []:
+		return Hits
+	Dists = []
+	for Rec in Recs:
+		if Rec.Label != Label:
+			continue
+		if Rec.End < Pos:
+			Dists.append((Pos - Rec.End, Rec))
+		else:
+			Dists.append((Rec.Start - Pos, Rec))
+	if Dists == []:
+		return []
+	Best = min([ d for d, Rec in Dists ])
+	return [ Rec for d, Rec in Dists if d == Best ]
+
+def BruteCoverage(Recs, Label, Start, End, Fs = None):
+	Covered = set()
+	for Rec in BruteOverlap(Recs, Label, Start, End, Fs):
+		Covered.update(xrange(max(Rec.Start, Start), min(Rec.End, End) + 1))
+	return len(Covered)
+
+def Check(What, Got, Expected):
+	if Got != Expected:
+		Fail("%s: index gave %s, brute force %s" % (What, Got, Expected))
+
+def CheckIndex(Index, Recs, QueryCount):
+	for q in xrange(0, QueryCount):
+		Label = random.choice(Labels)
+		Start = random.randint(-10, GenomeLength + 10)
+		End = Start + random.randint(0, random.choice([ 0, 10, 500 ]))
+		Fs = random.choice([ None, set(Features[:1]), set(Features[1:]) ])
+		Query = "%s:%d-%d %s" % (Label, Start, End, Fs)
+		Check("Overlap " + Query, Strs(Index.Overlap(Label, Start, End, Fs)),
+		  Strs(BruteOverlap(Recs, Label, Start, End, Fs)))
+		Check("OverlapCount " + Query, Index.OverlapCount(Label, Start, End),
+		  len(BruteOverlap(Recs, Label, Start, End)))
+		Check("Coverage " + Query, Index.Coverage(Label, Start, End, Fs),
+		  BruteCoverage(Recs, Label, Start, End, Fs))
+		Check("Nearest %s:%d" % (Label, Start), Strs(Index.Nearest(Label, Start)),
+		  Strs(BruteNearest(Recs, Label, Start)))
+
+def FreshIndex(FileName):
+	# as a new process would see it
+	for Index in gffi.Indexes.values():
+		Index[1].Close()
+	gffi.Indexes.clear()
+	return gffi.GetIndex(FileName)
+
+def RunOnce(Dir, RecCount, QueryCount):
+	Recs = RandomRecs(RecCount)
+	FileName = os.path.join(Dir, "test.gff")
+	for Suffix in [ "", ".idx" ]:
+		if os.path.exists(FileName + Suffix):
+			os.remove(FileName + Suffix)
+	WriteRecs(Recs, FileName)
+	CheckIndex(FreshIndex(FileName), Recs, QueryCount)
+	if not os.path.exists(FileName + ".idx"):
+		Fail("no sidecar was written for " + FileName)
+	CheckIndex(FreshIndex(FileName), Recs, QueryCount)
+	File = open(FileName + ".idx", "wb")
+	File.write("garbage")
+	File.close()
+	CheckIndex(FreshIndex(FileName), Recs, QueryCount)
+
+if __name__ == "__main__":
+	Iterations = 20
+	if len(sys.argv) > 1:
+		Iterations = int(sys.argv[1])
+	random.seed(1)
+	Dir = tempfile.mkdtemp(prefix = "evolver_gff_index_test_")
+	try:
+		for i in xrange(0, Iterations):
+			RunOnce(Dir, random.choice([ 0, 1, 2, 17, 300, 2000 ]), 200)
+	finally:
+		for Index in gffi.Indexes.values():
+			Index[1].Close()
+		shutil.rmtree(Dir, ignore_errors = True)
+	print "evolver_gff_index.................. OK"
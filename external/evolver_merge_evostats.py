@@ -21,37 +21,150 @@
 # THE SOFTWARE.
 # 
 ##############################
+import array
+import os
 import sys
+from itertools import izip
+import evolverSimControl.lib.evolver_gff as gff
 
 def Die(s):
 	print >> sys.stderr, "**ERROR**", s, sys.argv
 	sys.exit(1) 
 
-Values = {}
-for i in range(1, len(sys.argv)):
-	FileName = sys.argv[i]
+# The (key, count) pairs of the lines of the stats file FileName, keyed
+# by everything up to and including the last semi-colon of each line.
+# Lines are read one at a time.
+def IterStatsPairs(FileName):
 	File = open(FileName)
-	while 1:
-		Line = File.readline()
-		if len(Line) == 0:
-			break
+	for Line in File:
 		Line = Line.strip()
 		if len(Line) == 0:
 			continue
 		if Line[0] == "#":
 			continue
-		Fields = Line.split(";")
-		N = len(Fields)
-		if N == 1:
+		i = Line.rfind(";")
+		if i == -1:
 			Die("File '%s', no semi-colons in line: %s"  % (FileName, Line))
-		Value = int(Fields[N-1])
-		Key = ""
-		for i in range(0, N-1):
-			Key += Fields[i] + ";"
-		if Key in Values.keys():
+		yield Line[0:i+1], int(Line[i+1:])
+	File.close()
+
+# Adds the counts of the stats file FileName into the dict Values, from
+# its binary copy when there is an up to date one.
+def MergeStatsFile(FileName, Values):
+	Table = LoadStatsTable(FileName)
+	if Table == None:
+		Pairs = IterStatsPairs(FileName)
+	else:
+		Pairs = Table.Pairs()
+	for Key, Value in Pairs:
+		if Key in Values:
 			Values[Key] += Value
 		else:
 			Values[Key] = Value
+	return Values
+
+# Sums the counts of any number of stats files in a single pass.
+def MergeStatsFiles(FileNames):
+	Values = {}
+	for FileName in FileNames:
+		MergeStatsFile(FileName, Values)
+	return Values
+
+def WriteStats(Values, File):
+	for Key in Values.keys():
+		print >> File, "%s%u" % (Key, Values[Key])
+
+# A StatsTable holds the counts of a stats file as a list of distinct Keys,
+# in the order of its lines, and an array of their Counts. The table of a
+# cumulative stats file extends the table of its parent cycle's, with the
+# keys new in the cycle at the end, so that totals are added along a
+# branch by copying the parent's counts and adding only the cycle's.
+class StatsTable(object):
+	__slots__ = ("Keys", "Counts")
+
+	def __init__(self, Keys, Counts):
+		self.Keys = Keys
+		self.Counts = Counts
+
+	def Pairs(self):
+		return izip(self.Keys, self.Counts)
+
+def TableFromPairs(Pairs):
+	Keys = []
+	Counts = array.array("L")
+	Index = {}
+	for Key, Value in Pairs:
+		i = Index.get(Key)
+		if i == None:
+			Index[Key] = len(Keys)
+			Keys.append(Key)
+			Counts.append(Value)
+		else:
+			Counts[i] += Value
+	return StatsTable(Keys, Counts)
+
+# Table of Base plus Other: the keys of Base, in order, then those only in
+# Other. Copying Base and indexing its keys is still linear in its size, but
+# done by the list, array and dict constructors; only the pairs of Other are
+# added one at a time.
+def AddStatsTables(Base, Other):
+	Keys = list(Base.Keys)
+	Counts = array.array("L", Base.Counts)
+	Index = dict(izip(Base.Keys, xrange(len(Base.Keys))))
+	for Key, Value in Other.Pairs():
+		i = Index.get(Key)
+		if i == None:
+			Index[Key] = len(Keys)
+			Keys.append(Key)
+			Counts.append(Value)
+		else:
+			Counts[i] += Value
+	return StatsTable(Keys, Counts)
+
+def WriteStatsTable(Table, File):
+	for Key, Value in Table.Pairs():
+		print >> File, "%s%u" % (Key, Value)
+
+StatsVersion = 2
+
+# The binary copy of a stats file is a FileName.pickle sidecar holding its
+# StatsTable, the counts as the bytes of the array.
+def SaveStatsBinary(Table, FileName):
+	gff.SaveSidecar(FileName, ".pickle", gff.SidecarStamp(FileName, StatsVersion),
+	  (Table.Keys, Table.Counts.tostring()))
+
+def LoadStatsTable(FileName):
+	Data = gff.LoadSidecar(FileName, ".pickle", gff.SidecarStamp(FileName, StatsVersion))
+	if Data == None:
+		return None
+	Keys, CountsStr = Data
+	Counts = array.array("L")
+	Counts.fromstring(CountsStr)
+	return StatsTable(Keys, Counts)
+
+# Table of the stats file FileName, from its binary copy when there is an
+# up to date one.
+def ReadStatsTable(FileName):
+	Table = LoadStatsTable(FileName)
+	if Table == None:
+		Table = TableFromPairs(IterStatsPairs(FileName))
+	return Table
+
+def WriteAtomically(FileName, Writer, Data):
+	File = open(FileName + ".tmp", "w")
+	Writer(Data, File)
+	File.close()
+	os.rename(FileName + ".tmp", FileName)
+
+# Atomically writes Values to the stats file FileName and its binary copy.
+def WriteStatsFile(Values, FileName):
+	WriteAtomically(FileName, WriteStats, Values)
+	SaveStatsBinary(TableFromPairs(Values.iteritems()), FileName)
+
+# Atomically writes Table to the stats file FileName and its binary copy.
+def WriteStatsTableFile(Table, FileName):
+	WriteAtomically(FileName, WriteStatsTable, Table)
+	SaveStatsBinary(Table, FileName)
 
-for Key in Values.keys():
-	print "%s%u" % (Key, Values[Key])
+if __name__ == "__main__":
+	WriteStats(MergeStatsFiles(sys.argv[1:]), sys.stdout)
@@ -23,6 +23,8 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 ##################################################
+import threading
+
 requiredPrograms = ['cat', 'cp', 'egrep', 'ln', 'mkdir', 
                     'mv', 'sed', 'touch', 'trf',
                     'evolver_codon_report.pl', 
@@ -34,7 +36,6 @@ requiredPrograms = ['cat', 'cp', 'egrep', 'ln', 'mkdir',
                     'evolver_gff_cdsutr2exons.py', 
                     'evolver_gff_exons2introns.py', 
                     'evolver_gff_featurestats2.py', 
-                    'evolver_gff_featurestats2.sh', 
                     'evolver_gff_fixgeneix.py', 
                     'evolver_handle_mobiles.pl', 
                     'evolver_merge_evostats.py', 
@@ -105,14 +106,19 @@ def verifyFileExists(filename):
     if not os.path.exists(filename):
         raise RuntimeError('Unable to locate file %s' % filename)
 
+toolTable = {}
 def which(program):
     """which() acts like the unix utility which, but is portable between os.
     If the program does not exist in the PATH then 'None' is returned. 
+    Programs are looked up in toolTable first and the results of PATH searches
+    are stored there, so the PATH is only searched once per program per process.
     """
     import os
     def is_exe(fpath):
         return os.path.exists(fpath) and os.access(fpath, os.X_OK)
 
+    if program in toolTable:
+        return toolTable[program]
     fpath, fname = os.path.split(program)
     if fpath != '':
         if is_exe(program):
@@ -121,9 +127,26 @@ def which(program):
         for path in os.environ["PATH"].split(os.pathsep):
             exe_file = os.path.join(path, program)
             if is_exe(exe_file):
+                toolTable[program] = exe_file
                 return exe_file
     return None
 
+def setTool(program, path):
+    """ setTool() pins the executable used for program to path, overriding
+    the PATH search in which().
+    """
+    import os
+    if not (os.path.exists(path) and os.access(path, os.X_OK)):
+        raise RuntimeError('setTool(): %s for "%s" is not an executable.' % (path, program))
+    toolTable[program] = path
+
+def loadToolTable(options):
+    """ loadToolTable() installs the tool table resolved at the start of the 
+    simulation, options.toolTable, so that which() does not search the PATH.
+    Called by libSimControlClasses.SimTarget.run() before each target runs.
+    """
+    toolTable.update(options.toolTable)
+
 def discritizeTree(nt, ss):
     """discritizeTree() takes a newickTree (binaryTree object) and a step size
     and translates the tree branch distances into discrete steps using a ceiling
@@ -232,12 +255,85 @@ def createTimestamp(filename, extra = {}):
     info.write(filename + '.tmp')
     shutil.move(filename + '.tmp', filename)
 
+chrLengthsCache = {}
+chrLengthsVersion = 1
+def getChromosomeLengths(revFile):
+    """ getChromosomeLengths returns a dict keyed on chromosome name valued
+    with the chromosome length in bp for the .rev file revFile. The lengths are
+    memoized for the life of the process and in a revFile.chrlengths sidecar file
+    so that evolver_cvt only needs to be run once for each .rev file.
+    """
+    from libSimControl import verifyFileExists, dumpChromosomeLengths
+    import evolverSimControl.lib.evolver_gff as gff
+    import os
+    verifyFileExists(revFile)
+    # a rewritten .rev file invalidates the sidecar
+    stamp = gff.SidecarStamp(revFile, chrLengthsVersion)
+    key = (os.path.abspath(revFile), stamp)
+    if key not in chrLengthsCache:
+        lengths = gff.LoadSidecar(revFile, '.chrlengths', stamp)
+        if lengths is None:
+            lengths = dumpChromosomeLengths(revFile)
+            gff.SaveSidecar(revFile, '.chrlengths', stamp, lengths)
+        chrLengthsCache[key] = lengths
+    return dict(chrLengthsCache[key])
+
+def getGenomeSize(revFile):
+    """ getGenomeSize returns the total length in bp of the genome in the .rev 
+    file revFile.
+    """
+    from libSimControl import getChromosomeLengths
+    return sum(getChromosomeLengths(revFile).values())
+
+def dumpChromosomeLengths(revFile):
+    """ dumpChromosomeLengths returns the chromosome lengths of revFile as 
+    reported by evolver_cvt -dumpchrids.
+    """
+    from libSimControl import which, handleReturnCode
+    import subprocess
+    cmd = [which('evolver_cvt')]
+    cmd.append('-dumpchrids')
+    cmd.append(revFile)
+    p = subprocess.Popen(cmd, stdout = subprocess.PIPE)
+    lengths = {}
+    isChroms = False
+    for line in p.stdout:
+        data = line.split()
+        if data == []:
+            continue
+        if not isChroms:
+            if len(data) == 4 and data[0].startswith('='):
+                isChroms = True
+            continue
+        if data[3] in lengths:
+            raise RuntimeError('%s has identically named chromosomes "%s"' % (revFile, data[3]))
+        lengths[data[3]] = int(data[2])
+    p.wait()
+    handleReturnCode(p.returncode, cmd)
+    return lengths
+
+def chrMemory(length, options):
+    """ chrMemory returns the memory, in bytes, that an intra step job should 
+    request for a chromosome of the given length, using the linear model
+    chrMemoryBase + chrMemoryPerBase * length. Returns the jobTree default
+    when no model has been set or the length is unknown.
+    """
+    import sys
+    if options.chrMemoryPerBase is None or length is None:
+        return sys.maxint
+    return int(options.chrMemoryBase + options.chrMemoryPerBase * length)
+
+chrNamesCache = {}
 def extractChrNamesDict(cycleDir):
     """ this dict is used to take the excessively long names evolver
     uses internally for chromosomes and maps it to a shorter set of names.
+    inter.chrnames.txt does not change once written so the dicts are only
+    built once per process.
     """
     import os
     
+    if cycleDir in chrNamesCache:
+        return chrNamesCache[cycleDir]
     chrNameDict = {}
     revChrNameDict = {}
     if os.path.exists(os.path.join(cycleDir, 'inter', 'inter.chrnames.txt')):
@@ -247,9 +343,105 @@ def extractChrNamesDict(cycleDir):
             chrNameDict[line] = 'chrS%d' % i # for chromosome Sim 
             revChrNameDict['chrS%d' % i] = line # might as well build this too.
         f.close()
+        chrNamesCache[cycleDir] = (chrNameDict, revChrNameDict)
     return (chrNameDict, revChrNameDict)
 
+lockBackend = None
+heldLocks = {}
+threadLocks = {}
+threadLocksLock = threading.Lock()
+def getLockBackend():
+    """ returns the name of the locking backend used for the xml info files, either
+    'fcntl' (the default, advisory locks on a sidecar .flock file) or 'rename'
+    (the original rename based locking). The backend may be selected with the
+    SIMCTRL_LOCK_BACKEND environment variable.
+    """
+    import os
+    global lockBackend
+    if lockBackend is None:
+        lockBackend = os.environ.get('SIMCTRL_LOCK_BACKEND', 'fcntl').lower()
+        if lockBackend not in ('fcntl', 'rename'):
+            raise RuntimeError('SIMCTRL_LOCK_BACKEND must be either "fcntl" or "rename", not %s' 
+                               % lockBackend)
+    return lockBackend
+
 def lockfile(filename):
+    """ lockfile takes an exclusive lock on an xml info file and returns the name
+    of the file that the caller should read and write until unlockfile() is called.
+    Writers must replace the file atomically (write to a .tmp and move) so that
+    readers, see readXml(), never need to take the lock.
+    lockf() locks are held by the process, so threads of one process are
+    serialized by a per-file threading.Lock before the lockf() is taken.
+    """
+    from libSimControl import getLockBackend
+    import fcntl
+    import os
+    import threading
+    if getLockBackend() == 'rename':
+        return lockfileRename(filename)
+    threadLocksLock.acquire()
+    if filename not in threadLocks:
+        threadLocks[filename] = threading.Lock()
+    tlock = threadLocks[filename]
+    threadLocksLock.release()
+    if filename in heldLocks and heldLocks[filename][1] is threading.current_thread():
+        raise RuntimeError('lockfile: %s is already locked by this thread.' % filename)
+    tlock.acquire()
+    try:
+        f = open(filename + '.flock', 'a')
+        # lockf() locks are fcntl() record locks, which are honored over NFS
+        # while flock() locks may not be.
+        fcntl.lockf(f, fcntl.LOCK_EX)
+        if not os.path.exists(filename):
+            fcntl.lockf(f, fcntl.LOCK_UN)
+            f.close()
+            raise RuntimeError('Unable to lock file %s, it does not exist.' % filename)
+    except:
+        tlock.release()
+        raise
+    heldLocks[filename] = (f, threading.current_thread())
+    return filename
+
+def unlockfile(filename):
+    """ releases a lock obtained with lockfile(). filename must be the value
+    returned by lockfile().
+    """
+    from libSimControl import getLockBackend
+    import fcntl
+    if getLockBackend() == 'rename':
+        return unlockfileRename(filename)
+    if filename not in heldLocks:
+        raise RuntimeError('unlockfile: %s is not locked by this process.' % filename)
+    f, thread = heldLocks.pop(filename)
+    fcntl.lockf(f, fcntl.LOCK_UN)
+    f.close()
+    threadLocks[filename].release()
+
+def readXml(filename):
+    """ readXml returns the parsed ElementTree of an xml info file. With the fcntl
+    backend writers always replace files atomically so the read does not take the
+    lock, with the rename backend the file must be locked to be read at all.
+    """
+    from libSimControl import getLockBackend, lockfile, unlockfile
+    import sys
+    import xml.etree.ElementTree as ET
+    import xml.parsers.expat as expat
+    if getLockBackend() == 'rename':
+        name = lockfile(filename)
+    else:
+        name = filename
+    try:
+        try:
+            infoTree = ET.parse(name)
+        except expat.ExpatError: # broken xml file
+            sys.stderr.write('Bad xml: %s\n' % name)
+            raise
+    finally:
+        if name != filename:
+            unlockfile(name)
+    return infoTree
+
+def lockfileRename(filename):
     """ This is a fragile attempt at avoiding too many collisions on the xml info files
     Many processes will try to lock simultaneously.
     """
@@ -275,7 +467,7 @@ def lockfile(filename):
         raise RuntimeError('Unable to lock file %s after %.1f seconds.' % (filename, float(timeout)/delay))
     return filename + '.lock'
 
-def unlockfile(filename):
+def unlockfileRename(filename):
     """ There will be only one process seeking to unlock a file at a time.
     """
     import os
@@ -481,6 +673,251 @@ def takeNewickStep(thisNewickStr, options):
         nt.distance = 0.0
     return (tree2str(nt), step)
 
+def buildStepPlan(options):
+    """ buildStepPlan takes an options object and walks the newick tree exactly
+    once, returning a StepPlan object that contains every cycle of the simulation.
+    Cycle names are produced by the same takeNewickStep() / nameTree() calls
+    that the Tree and TreeFollow targets used to make, so directory names do not
+    change.
+    """
+    from libSimControl import nameTree, nodeIsLeaf, takeNewickStep, tree2str
+    from libSimControlClasses import StepPlan
+    from sonLib.bioio import newickTreeParser
+
+    plan = StepPlan()
+    addPlanStep(plan, options.rootName, None, None, 0.0)
+    nt = newickTreeParser(options.inputNewick, 0.0)
+    if nt.distance == 0:
+        plan.isBranch[0] = True
+        pending = [(tree2str(nt.left), 0, 'left'), (tree2str(nt.right), 0, 'right')]
+    else:
+        pending = [(tree2str(nt), 0, 'stem')]
+    while pending != []:
+        newickStr, parent, branchStr = pending.pop()
+        thisNewickStr, stepLength = takeNewickStep(newickStr, options)
+        nt = newickTreeParser(thisNewickStr, 0.0)
+        i = addPlanStep(plan, nameTree(nt), parent, branchStr, stepLength)
+        if nt.distance == 0:
+            if nt.internal:
+                # branch point
+                plan.isBranch[i] = True
+                for b, t in [('left', nt.left), ('right', nt.right)]:
+                    branchNewickStr = tree2str(t)
+                    if nodeIsLeaf(branchNewickStr):
+                        # zero length leaf branches are listed as children
+                        # but they are never simulated.
+                        name = nameTree(newickTreeParser(takeNewickStep(branchNewickStr,
+                                                                        options)[0], 0.0))
+                        plan.children[i].append((b, name))
+                    else:
+                        pending.append((branchNewickStr, i, b))
+            else:
+                plan.isLeaf[i] = True
+        else:
+            # stem with distance
+            pending.append((tree2str(nt), i, 'stem'))
+    computeRemainingSteps(plan)
+    return plan
+
+def computeRemainingSteps(plan):
+    """ fills in plan.remainingSteps, the number of cycles on the longest path 
+    from each cycle down to a leaf, counting the cycle itself. This is the 
+    critical path length used to order the launching of cycles.
+    """
+    from libSimControl import stepChildren
+    plan.remainingSteps = [1] * len(plan.names)
+    # children are always added to the plan after their parents
+    for i in xrange(len(plan.names) - 1, -1, -1):
+        for c in stepChildren(plan, i):
+            plan.remainingSteps[i] = max(plan.remainingSteps[i], plan.remainingSteps[c] + 1)
+
+def addPlanStep(plan, name, parent, branchStr, stepLength):
+    """ appends a single cycle to a StepPlan object and returns its index.
+    """
+    if name in plan.index:
+        raise RuntimeError('Step plan already contains a cycle named %s' % name)
+    i = len(plan.names)
+    plan.names.append(name)
+    plan.parents.append(parent)
+    plan.children.append([])
+    plan.stepLengths.append(stepLength)
+    plan.branchStrs.append(branchStr)
+    plan.isBranch.append(False)
+    plan.isLeaf.append(False)
+    plan.index[name] = i
+    if parent is not None:
+        plan.children[parent].append((branchStr, name))
+    return i
+
+def writeStepPlan(plan, simDir):
+    """ stores the StepPlan object in the simulation directory so that
+    all targets may share it.
+    """
+    import cPickle
+    import os
+    filename = os.path.join(simDir, '.stepPlan.pickle')
+    f = open(filename + '.tmp', 'wb')
+    cPickle.dump(plan, f, 2) # 2 is the format protocol, 2 = binary
+    f.close()
+    os.rename(filename + '.tmp', filename)
+    stepPlanCache[simDir] = plan
+
+stepPlanCache = {}
+def getStepPlan(simDir):
+    """ returns the StepPlan object for the simulation in simDir. The plan is
+    only read from disk once per process.
+    """
+    from libSimControl import verifyFileExists
+    import cPickle
+    import os
+    if simDir not in stepPlanCache:
+        filename = os.path.join(simDir, '.stepPlan.pickle')
+        verifyFileExists(filename)
+        f = open(filename, 'rb')
+        stepPlanCache[simDir] = cPickle.load(f)
+        f.close()
+    return stepPlanCache[simDir]
+
+def stepDir(plan, i, simDir):
+    """ returns the directory path of the cycle at index i of the plan.
+    """
+    import os
+    return os.path.join(simDir, plan.names[i])
+
+def stepChildren(plan, i):
+    """ returns a list of the indices of the cycles that are to be simulated
+    as children of the cycle at index i of the plan, longest remaining 
+    critical path first.
+    """
+    children = []
+    for branchStr, name in plan.children[i]:
+        if name in plan.index:
+            children.append(plan.index[name])
+    if plan.remainingSteps != []:
+        children.sort(key = lambda c: plan.remainingSteps[c], reverse = True)
+    return children
+
+def targetCpu(options):
+    """ returns the number of cpus a target should declare to jobTree,
+    options.jobCpus if it has been set, otherwise the jobTree default.
+    """
+    import sys
+    if options.jobCpus is None:
+        return sys.maxint
+    return options.jobCpus
+
+def runLocalExecutor(rootTarget, cores, options):
+    """ runLocalExecutor runs a tree of jobTree targets on this machine with a 
+    pool of cores worker processes, without a jobTree directory. Targets are run
+    with the jobTree semantics: a target's follow-on is run once all of the 
+    target's children, and their follow-ons, have completed. Ready targets are
+    started in order of the longest remaining critical path of their cycle.
+    Raises RuntimeError if any target fails, once the running targets finish.
+    """
+    from libSimControl import runLocalTarget, localTargetPriority
+    import heapq
+    import multiprocessing
+    import time
+
+    pool = multiprocessing.Pool(cores)
+    ready = []
+    running = []
+    failures = []
+    seq = [0]
+    # a record is [followOn, pendingChildren, ownerRecord], the root target's
+    # record has no owner.
+    def push(target, owner):
+        heapq.heappush(ready, (localTargetPriority(target, options), seq[0], target, owner))
+        seq[0] += 1
+    def finish(record):
+        while record is not None:
+            followOn, pending, owner = record
+            if followOn is not None:
+                # the follow-on takes the place of the finished target
+                push(followOn, owner)
+                return
+            if owner is None:
+                return
+            owner[1] -= 1
+            if owner[1] > 0:
+                return
+            record = owner
+    
+    push(rootTarget, None)
+    try:
+        while ready != [] or running != []:
+            while ready != [] and len(running) < cores and failures == []:
+                priority, n, target, owner = heapq.heappop(ready)
+                running.append((pool.apply_async(runLocalTarget, (target,)), owner))
+            if failures != [] and running == []:
+                break
+            done = [r for r in running if r[0].ready()]
+            if done == []:
+                time.sleep(0.05)
+                continue
+            for r in done:
+                running.remove(r)
+                result, owner = r
+                try:
+                    children, followOn, error = result.get()
+                except Exception, e:
+                    children, followOn, error = [], None, str(e)
+                if error is not None:
+                    failures.append(error)
+                    continue
+                record = [followOn, len(children), owner]
+                for c in children:
+                    push(c, record)
+                if children == []:
+                    finish(record)
+    finally:
+        pool.close()
+        pool.join()
+    if failures != []:
+        raise RuntimeError('The local executor had %d failed targets:\n%s' % 
+                           (len(failures), '\n'.join(failures)))
+
+def runLocalTarget(target):
+    """ runLocalTarget is run in a local executor worker process. It runs a single
+    target and returns a tuple of the target's children, its follow-on and either
+    None or the formatted traceback if the target failed.
+    """
+    import shutil
+    import tempfile
+    import traceback
+    children = []
+    followOn = [None]
+    localTempDir = tempfile.mkdtemp(prefix = 'simCtrl_')
+    # stand in for the jobTree Target methods the targets use
+    target.addChildTarget = children.append
+    target.setFollowOnTarget = lambda t: followOn.__setitem__(0, t)
+    target.getLocalTempDir = lambda: localTempDir
+    try:
+        try:
+            target.run()
+        except:
+            return ([], None, '%s: %s' % (target.__class__.__name__, traceback.format_exc()))
+    finally:
+        shutil.rmtree(localTempDir, ignore_errors = True)
+    return (children, followOn[0], None)
+
+def localTargetPriority(target, options):
+    """ returns the local executor priority of a target, lower is run first.
+    Targets that belong to a cycle, either by stepIndex or by thisDir as for
+    the Stats and Transalign targets, are ordered by the cycle's remaining
+    critical path, all others come after them.
+    """
+    from libSimControl import getStepPlan
+    import os
+    plan = getStepPlan(options.simDir)
+    if hasattr(target, 'stepIndex'):
+        return -plan.remainingSteps[target.stepIndex]
+    if hasattr(target, 'thisDir'):
+        name = os.path.basename(target.thisDir)
+        if name in plan.index:
+            return -plan.remainingSteps[plan.index[name]]
+    return 0
+
 def myLog(s):
     import os
     if os.path.exists('sc_log.log'):
@@ -490,9 +927,11 @@ def myLog(s):
         f.write(s)
     f.close()
 
-def runCommands(cmds, localTempDir, inPipes = [], outPipes = [], mode = 's', debug = False):
+def runCommands(cmds, localTempDir, inPipes = [], outPipes = [], mode = 's', debug = False,
+                maxParallel = None):
     """ runCommands is a wrapper function for the parallel and serial
-    versions of runCommands. mode may either be s or p.
+    versions of runCommands. mode may either be s or p. maxParallel limits the
+    number of commands run at once in mode p, None is unbounded.
     """
     from libSimControl import runCommandsP, runCommandsS
     import os
@@ -522,80 +961,276 @@ def runCommands(cmds, localTempDir, inPipes = [], outPipes = [], mode = 's', deb
         runCommandsS(cmds, localTempDir, inPipes = inPipes, outPipes = outPipes, debug = debug)
     else:
         logger.info('Issuing parallel commands %s %s %s.' % (str(cmds), str(inPipes), str(outPipes)))
-        runCommandsP(cmds, localTempDir, inPipes = inPipes, outPipes = outPipes, debug = debug)
-
-def runCommandsP(cmds, localTempDir, inPipes = [], outPipes = [], debug = False):
+        runCommandsP(cmds, localTempDir, inPipes = inPipes, outPipes = outPipes, debug = debug, 
+                     maxParallel = maxParallel)
+
+def runThreadPool(count, run, maxParallel = None, deps = None, abort = None):
+    """ runThreadPool calls run(i) for each i in range(count) using a pool of
+    at most maxParallel threads (None is unbounded). deps, if given, is a list
+    of sets, item i is started only once every item in deps[i] has finished.
+    Ready items are started in index order. If a call raises no further items
+    are started, abort() is called (if given) so that the caller may stop the
+    running items, and the first exception is raised once the running calls
+    have returned.
+    """
+    import sys
+    import threading
+    
+    if maxParallel is None or maxParallel > count:
+        maxParallel = count
+    if maxParallel < 1 and count > 0:
+        raise ValueError('runThreadPool "maxParallel" must be positive, not %d.' % maxParallel)
+    if deps is None:
+        deps = [set()] * count
+    cond = threading.Condition()
+    started = set()
+    done = set()
+    failures = []
+    
+    def worker():
+        while True:
+            cond.acquire()
+            try:
+                while True:
+                    if failures != [] or len(started) == count:
+                        return
+                    ready = [i for i in xrange(0, count) 
+                             if i not in started and deps[i] <= done]
+                    if ready != []:
+                        break
+                    cond.wait()
+                i = ready[0]
+                started.add(i)
+            finally:
+                cond.release()
+            try:
+                run(i)
+            except:
+                cond.acquire()
+                isFirst = failures == []
+                failures.append(sys.exc_info())
+                cond.notifyAll()
+                cond.release()
+                if isFirst and abort is not None:
+                    abort()
+                return
+            cond.acquire()
+            done.add(i)
+            cond.notifyAll()
+            cond.release()
+    
+    threads = []
+    for t in xrange(0, maxParallel):
+        threads.append(threading.Thread(target = worker))
+        threads[-1].start()
+    for t in threads:
+        t.join()
+    if failures != []:
+        raise failures[0][0], failures[0][1], failures[0][2]
+
+def runCommandsP(cmds, localTempDir, inPipes = [], outPipes = [], debug = False, 
+                 maxParallel = None):
     """ runCommandsP uses the subprocess module
     to issue parallel processes from the cmds list.
-    """
-    from libSimControl import handleReturnCode
-    import os
+    inPipes and outPipes are handed to the processes as open files so that
+    data never passes through python.
+    At most maxParallel commands run at once (None is unbounded). Commands are 
+    started in the order given so callers should list the longest running 
+    commands first. If a command fails no further commands are started, the
+    running commands are terminated and the error is raised.
+    """
+    from libSimControl import (handleReturnCode, openPipes, isBuiltinCommand, 
+                               runBuiltinCommand, runThreadPool)
     from sonLib.bioio import logger
     import subprocess
+    import threading
     
-    procs = []
-    for i, c in enumerate(cmds, 0):
-        if inPipes[i] is None:
-            sin = None
-        else:
-            sin = subprocess.PIPE
-        if outPipes[i] is None:
-            sout = None
-        else:
-            sout = subprocess.PIPE
-        logger.info('Executing parallel %s < %s > %s' % (' '.join(c), inPipes[i], outPipes[i]))
-        procs.append(subprocess.Popen(c, cwd = localTempDir, stdin = sin, stdout = sout))
-    for i, p in enumerate(procs, 0):
-        if inPipes[i] is None:
-            sin = None
-        else:
-            if not os.path.exists(inPipes[i]):
-                raise IOError('Unable to locate inPipe file: %s for command %s' % (inPipes[i], cmds[i]))
-            sin = open(inPipes[i], 'r').read()
-        if outPipes[i] is None:
-            pout, perr = p.communicate(sin)
-            handleReturnCode(p.returncode, cmds[i])
-        else:
-            f = open(outPipes[i], 'w')
-            f.write(p.communicate(sin)[0])
-            f.close()
-            handleReturnCode(p.returncode, cmds[i])
+    lock = threading.Lock()
+    running = {}
+    aborted = []
+    
+    def run(i):
+        if isBuiltinCommand(cmds[i]):
+            runBuiltinCommand(cmds[i], localTempDir, inPipes[i], outPipes[i])
+            return
+        lock.acquire()
+        try:
+            if aborted != []:
+                return
+            sin, sout = openPipes(inPipes[i], outPipes[i], cmds[i])
+            logger.info('Executing parallel %s < %s > %s' % 
+                        (' '.join(cmds[i]), inPipes[i], outPipes[i]))
+            p = subprocess.Popen(cmds[i], cwd = localTempDir, stdin = sin, stdout = sout)
+            running[i] = p
+        finally:
+            lock.release()
+        p.wait()
+        for f in [sin, sout]:
+            if f is not None:
+                f.close()
+        lock.acquire()
+        del running[i]
+        lock.release()
+        handleReturnCode(p.returncode, cmds[i])
+    
+    def abort():
+        # fail fast
+        lock.acquire()
+        aborted.append(True)
+        for p in running.values():
+            p.terminate()
+        lock.release()
+    
+    runThreadPool(len(cmds), run, maxParallel = maxParallel, abort = abort)
 
 def runCommandsS(cmds, localTempDir, inPipes=[], outPipes=[], debug = False):
     """ runCommandsS uses the subprocess module
     to issue serial processes from the cmds list.
+    inPipes and outPipes are handed to the processes as open files so that
+    data never passes through python.
     """
-    from libSimControl import handleReturnCode
-    import os
+    from libSimControl import handleReturnCode, openPipes, isBuiltinCommand, runBuiltinCommand
     from sonLib.bioio import logger
     import subprocess
     
     for i, c in enumerate(cmds, 0):
-        if inPipes[i] is None:
-            sin = None
-        else:
-            sin = subprocess.PIPE
-        if outPipes[i] is None:
-            sout = None
-        else:
-            sout = subprocess.PIPE
+        if isBuiltinCommand(c):
+            runBuiltinCommand(c, localTempDir, inPipes[i], outPipes[i])
+            continue
+        sin, sout = openPipes(inPipes[i], outPipes[i], c)
         logger.info('Executing serial %s < %s > %s' % (' '.join(c), inPipes[i], outPipes[i]))
         p = subprocess.Popen(c, cwd = localTempDir, stdin = sin, stdout = sout)
-            
-        if inPipes[i] is None:
-            sin = None
-        else:
-            if not os.path.exists(inPipes[i]):
-                raise IOError('Unable to locate inPipe file: %s for command %s' % (inPipes[i], c))
-            sin = open(inPipes[i], 'r').read()
-        if outPipes[i] is None:
-            pout, perr = p.communicate(sin)
-            handleReturnCode(p.returncode, cmds[i])
-        else:
-            f = open(outPipes[i], 'w')
-            f.write(p.communicate(sin)[0])
-            f.close()
-            handleReturnCode(p.returncode, cmds[i])
+        p.wait()
+        for f in [sin, sout]:
+            if f is not None:
+                f.close()
+        handleReturnCode(p.returncode, c)
+
+def openPipes(inPipe, outPipe, cmd):
+    """ openPipes returns a tuple of file objects (or None) to be used as the
+    stdin and stdout of a process.
+    """
+    import os
+    if inPipe is None:
+        sin = None
+    else:
+        if not os.path.exists(inPipe):
+            raise IOError('Unable to locate inPipe file: %s for command %s' % (inPipe, cmd))
+        sin = open(inPipe, 'r')
+    if outPipe is None:
+        sout = None
+    else:
+        sout = open(outPipe, 'w')
+    return (sin, sout)
+
+def runFunctionsP(function, argsList, maxParallel = None):
+    """ runFunctionsP calls function once for each tuple of arguments in argsList
+    using a pool of at most maxParallel threads (None is unbounded). Calls are
+    started in the order given. If a call raises no further calls are started
+    and the first exception is raised once the running calls have finished.
+    """
+    from libSimControl import runThreadPool
+    runThreadPool(len(argsList), lambda i: function(*argsList[i]), 
+                  maxParallel = maxParallel)
+
+builtinCommands = ['cat', 'cp', 'ln', 'mv', 'touch']
+def isBuiltinCommand(cmd):
+    """ isBuiltinCommand returns True if the command list is one of the simple
+    file operations (see builtinCommands) in a form that runBuiltinCommand() can
+    perform in-process, without a fork and exec.
+    """
+    import os
+    if cmd == [] or os.path.basename(cmd[0]) not in builtinCommands:
+        return False
+    name = os.path.basename(cmd[0])
+    args = cmd[1:]
+    if name == 'ln' and args[:1] == ['-s']:
+        args = args[1:]
+    for a in args:
+        if a.startswith('-'):
+            # options are left to the real programs
+            return False
+    if name == 'mv':
+        return len(args) >= 2
+    if name in ('cp', 'ln'):
+        return len(args) == 2
+    if name == 'touch':
+        return len(args) >= 1
+    return True
+
+def runBuiltinCommand(cmd, cwd, inPipe = None, outPipe = None):
+    """ runBuiltinCommand performs a command accepted by isBuiltinCommand() 
+    in-process. Relative paths are taken relative to cwd, as they would be
+    for the subprocess. Raises RuntimeError if the operation fails.
+    """
+    from libSimControl import openPipes
+    import errno
+    import os
+    import shutil
+    from sonLib.bioio import logger
+    import sys
+    
+    name = os.path.basename(cmd[0])
+    args = cmd[1:]
+    logger.info('Executing builtin %s < %s > %s' % (' '.join(cmd), inPipe, outPipe))
+    sin, sout = openPipes(inPipe, outPipe, cmd)
+    try:
+        try:
+            if name == 'mv':
+                dest = os.path.join(cwd, args[-1])
+                if len(args) > 2 and not os.path.isdir(dest):
+                    raise OSError(errno.ENOTDIR, 'target is not a directory', dest)
+                for a in args[:-1]:
+                    src = os.path.join(cwd, a)
+                    if os.path.isdir(dest):
+                        d = os.path.join(dest, os.path.basename(src))
+                    else:
+                        d = dest
+                    try:
+                        # atomic when src and d are on the same filesystem
+                        os.rename(src, d)
+                    except OSError, e:
+                        if e.errno != errno.EXDEV:
+                            raise
+                        shutil.move(src, d)
+            elif name == 'cp':
+                shutil.copy(os.path.join(cwd, args[0]), os.path.join(cwd, args[1]))
+            elif name == 'ln':
+                if args[0] == '-s':
+                    args = args[1:]
+                dest = os.path.join(cwd, args[1])
+                if os.path.isdir(dest):
+                    dest = os.path.join(dest, os.path.basename(args[0]))
+                if cmd[1] == '-s':
+                    # the link text is kept exactly as given
+                    os.symlink(args[0], dest)
+                else:
+                    os.link(os.path.join(cwd, args[0]), dest)
+            elif name == 'touch':
+                for a in args:
+                    f = open(os.path.join(cwd, a), 'a')
+                    f.close()
+                    os.utime(os.path.join(cwd, a), None)
+            elif name == 'cat':
+                if sout is None:
+                    out = sys.stdout
+                else:
+                    out = sout
+                if args == []:
+                    if sin is not None:
+                        shutil.copyfileobj(sin, out)
+                for a in args:
+                    f = open(os.path.join(cwd, a), 'rb')
+                    shutil.copyfileobj(f, out)
+                    f.close()
+                out.flush()
+        except (IOError, OSError), e:
+            raise RuntimeError('Experienced an error while trying to execute: '
+                               '%s (%s)' % (' '.join(cmd), str(e)))
+    finally:
+        for f in [sin, sout]:
+            if f is not None:
+                f.close()
 
 def handleReturnCode(retcode, cmd):
     if not isinstance(retcode, int):
@@ -612,14 +1247,16 @@ def handleReturnCode(retcode, cmd):
             raise RuntimeError('Experienced an error while trying to execute: '
                                '%s retcode:%d' %(' '.join(cmd), retcode))
 
-def createNewCycleXmls(directory, parentDir, stepLength, newickStr, options):
-    """
+def createNewCycleXmls(stepIndex, options):
+    """ creates the summary.xml file for the cycle at index stepIndex of the
+    simulation's StepPlan.
     """
-    from libSimControl import newInfoXml, tree2str, takeNewickStep
+    from libSimControl import addTimestampsTag, getStepPlan, stepDir
     import os
     import shutil
-    from sonLib.bioio import newickTreeParser
     import xml.etree.ElementTree as ET
+    plan = getStepPlan(options.simDir)
+    directory = stepDir(plan, stepIndex, options.simDir)
     if not os.path.exists(directory):
         raise RuntimeError('cycleNewCycleInfoXml: directory: %s does not exist.' % directory)
     if not os.path.isdir(directory):
@@ -627,36 +1264,24 @@ def createNewCycleXmls(directory, parentDir, stepLength, newickStr, options):
     if not os.path.exists(os.path.join(directory, 'xml', 'summary.xml')):
         root = ET.Element('info')
         e = ET.SubElement(root, 'parentDir')  
-        e.text = parentDir
+        e.text = stepDir(plan, plan.parents[stepIndex], options.simDir)
         e = ET.SubElement(root, 'thisDir')
         e.text = directory
         e = ET.SubElement(root, 'stepLength')
-        e.text = str(stepLength).rstrip('0')
-        nt = newickTreeParser(newickStr, 0.0)
-        children = {}
-        if nt.distance == 0:
-            if nt.internal:
-                branches = {'left' : tree2str(nt.left),
-                            'right': tree2str(nt.right)}
-                for b in branches:
-                    children[b] = nameTree(newickTreeParser(takeNewickStep(branches[b], options)[0], 0.0))
-        else:
-            children['stem'] = nameTree(newickTreeParser(takeNewickStep(tree2str(nt), options)[0], 0.0))
+        e.text = str(plan.stepLengths[stepIndex]).rstrip('0')
+        children = plan.children[stepIndex]
         e = ET.SubElement(root, 'numberChildren')
         e.text = str(len(children))
-        for c in children:
+        for branchStr, name in children:
             e = ET.SubElement(root, 'child')
-            e.text = children[c]
-            e.attrib['type'] = c # left, right, stem
+            e.text = name
+            e.attrib['type'] = branchStr # left, right, stem
 
         info = ET.ElementTree(root)
         info.write(os.path.join(directory, 'xml', 'summary.xml.tmp'))
         shutil.move(os.path.join(directory, 'xml', 'summary.xml.tmp'), 
                     os.path.join(directory, 'xml', 'summary.xml'))
         addTimestampsTag(os.path.join(directory, 'xml', 'summary.xml'))
-    # if not os.path.exists(os.path.join(directory, 'xml', 'cycle.xml')):
-        # newInfoXml(os.path.join(directory, 'xml', 'cycle.xml'))
-        # typeTimestamp(directory, 'cycle', 'start')
 
 def newInfoXml(filename):
     """
@@ -774,7 +1399,7 @@ def evolverInterStepCmd(thisDir, thisParentDir, theChild, thisStepLength, seed,
         cmd.append('-logevents')
         cmd.append('-log')
         cmd.append(os.path.join(thisDir, 'logs', 'inter.log'))
-        followCmd = [which('mv')]
+        followCmd = ['mv']
         followCmd.append(outname + '.tmp')
         followCmd.append(outname)
     return cmd, followCmd
@@ -836,13 +1461,13 @@ def evolverInterStepMobilesMoveCmd(thisLocalTempDir, thisDir):
         verifyFileExists(f)
 
     cmds = []
-    cmds.append([which('mv'), os.path.join(thisLocalTempDir, 'mes.fa'),
+    cmds.append(['mv', os.path.join(thisLocalTempDir, 'mes.fa'),
                   os.path.join(thisDir, 'mobiles', 'mes.fa')])
-    cmds.append([which('mv'), os.path.join(thisLocalTempDir, 'ME_output.fa'),
+    cmds.append(['mv', os.path.join(thisLocalTempDir, 'ME_output.fa'),
                   os.path.join(thisDir, 'mobiles', 'ME.fa')])
-    cmds.append([which('mv'), os.path.join(thisLocalTempDir, 'ME_output.gff'),
+    cmds.append(['mv', os.path.join(thisLocalTempDir, 'ME_output.gff'),
                   os.path.join(thisDir, 'mobiles', 'ME.gff')])
-    cmds.append([which('mv'), os.path.join(thisLocalTempDir, 'ME_output_ltrs.fa'),
+    cmds.append(['mv', os.path.join(thisLocalTempDir, 'ME_output_ltrs.fa'),
                   os.path.join(thisDir, 'mobiles', 'LTR.fa')])
     return cmds
 
@@ -896,7 +1521,7 @@ def evolverIntraStepCmd(thisDir, theChild, thisStepLength, thisChr,
         cmd.append('-log')
         cmd.append(os.path.join(thisDir, 'logs', 'intra.'+chrNameDict[thisChr]+'.log'))
         cmds.append(cmd)
-        cmd = [which('mv')]
+        cmd = ['mv']
         cmd.append(outname + '.tmp')
         cmd.append(outname)
         cmds.append(cmd)
@@ -925,25 +1550,38 @@ def evolverIntraStepToFastaCmd(thisDir, thisStepLength, thisChr, paramsDir, loca
         cmd.append('-log')
         cmd.append(os.path.join(thisDir, 'intra', 'intra.' + chrNameDict[thisChr] + '.tofasta.log'))
         cmds = [cmd]
-        cmd = [which('mv')]
+        cmd = ['mv']
         cmd.append(outname + '.tmp')
         cmd.append(outname)
         cmds.append(cmd)
     return cmds
 
-def callEvolverIntraStepTRFCmd(thisDir, thisChr, localTempDir):
+TRF_MAX_PERIOD_SIZE = 2000
+TRF_PARAMETERS = ['2', '7', '7', '80', '10', '50', str(TRF_MAX_PERIOD_SIZE)]
+# windows overlap by enough sequence to hold this many copies of the
+# longest period on either side of a window boundary.
+TRF_WINDOW_COPIES = 10
+# incremental trf falls back to a full scan when the windows to be
+# rescanned cover more than this fraction of the chromosome.
+TRF_INCREMENTAL_MAX_RESCAN = 0.5
+
+def callEvolverIntraStepTRFCmd(thisDir, thisChr, localTempDir, options, maxParallel = None):
     """ calls tandem repeats finder (trf) on the per chromosome .fa files.
+    With options.trfWindowSize the chromosome is cut into overlapping windows
+    that are run through trf, at most maxParallel at a time (None is 
+    options.jobCpus or 1), and merged back into one .dat file.
+    With options.trfIncremental the parent's hits are carried over the regions
+    the cycle left unchanged and only the rest is rescanned.
     Called by CycleStep2Chromosome.
     """
-    from libSimControl import which, verifyDirExists, verifyFileExists, runCommands, extractChrNamesDict
+    from libSimControl import (verifyDirExists, verifyFileExists, extractChrNamesDict, 
+                               runFullTRF, runIncrementalTRF)
     import os
-    import subprocess
     chrNameDict, revChrNameDict = extractChrNamesDict(thisDir)
     for d in [thisDir, localTempDir]:
         verifyDirExists(d)
     for f in [os.path.join(localTempDir, chrNameDict[thisChr] + '.outseq.fa')]:
         verifyFileExists(f)
-    MAX_PERIOD_SIZE = 2000
     
     # trfBig
     # cmd = []
@@ -956,7 +1594,7 @@ def callEvolverIntraStepTRFCmd(thisDir, thisChr, localTempDir):
     #     cmd.append(os.path.join(localTempDir, thisChr+'.outseq.fa'))
     #     cmd.append(os.path.join(localTempDir, thisChr+'.outseq.trf.fa'))
     #     cmds = [cmd]
-    #     cmd = [which('mv')]
+    #     cmd = ['mv']
     #     cmd.append(outname + '.tmp')
     #     cmd.append(outname)
     #     cmds.append(cmd)
@@ -965,22 +1603,489 @@ def callEvolverIntraStepTRFCmd(thisDir, thisChr, localTempDir):
     # trf
     outname = os.path.join(thisDir, 'logs', 'trf.' + chrNameDict[thisChr] + '.log')
     if not os.path.exists(outname):
-        cmd = [which('trf')]
-        cmd.append(os.path.join(localTempDir, chrNameDict[thisChr] + '.outseq.fa'))
-        cmd += ['2', '7', '7', '80', '10', '50', str(MAX_PERIOD_SIZE), '-d', '-h']
-        returncode = subprocess.call(cmd, cwd = localTempDir)
-        # note that TRF's returncode is the number of successfully processed
-        # sequences special wrapper.
-        if returncode != 1:
-            if returncode < 0:
-                raise RuntimeError('callEvolverIntraStepTRFCmd: Experienced an error while trying to execute: '
-                                   '%s SIGNAL:%d' %(' '.join(cmd), -returncode))
-            else:
-                raise RuntimeError('callEvolverIntraStepTRFCmd: Experienced an error while trying to execute: '
-                                   '%s retcode:%d' %(' '.join(cmd), returncode))
+        fasta = os.path.join(localTempDir, chrNameDict[thisChr] + '.outseq.fa')
+        if options.trfIncremental:
+            runIncrementalTRF(thisDir, thisChr, fasta, localTempDir, options, maxParallel)
+        else:
+            runFullTRF(fasta, localTempDir, options, maxParallel)
         f=open(outname, 'w')
         f.close()
 
+def trfDatName(fastaFile):
+    """ returns the basename of the .dat file trf writes for fastaFile.
+    """
+    import os
+    return os.path.basename(fastaFile) + '.' + '.'.join(TRF_PARAMETERS) + '.dat'
+
+def runTRF(fastaFile, cwd):
+    """ runs trf on fastaFile, the .dat file is written to cwd.
+    """
+    from libSimControl import which
+    import subprocess
+    cmd = [which('trf')]
+    cmd.append(fastaFile)
+    cmd += TRF_PARAMETERS + ['-d', '-h']
+    returncode = subprocess.call(cmd, cwd = cwd)
+    # note that TRF's returncode is the number of successfully processed
+    # sequences special wrapper.
+    if returncode != 1:
+        if returncode < 0:
+            raise RuntimeError('callEvolverIntraStepTRFCmd: Experienced an error while trying to execute: '
+                               '%s SIGNAL:%d' %(' '.join(cmd), -returncode))
+        else:
+            raise RuntimeError('callEvolverIntraStepTRFCmd: Experienced an error while trying to execute: '
+                               '%s retcode:%d' %(' '.join(cmd), returncode))
+
+def runFullTRF(fastaFile, cwd, options, maxParallel = None):
+    """ scans all of fastaFile with trf, in windows when options.trfWindowSize
+    is set, the .dat file is written to cwd. At most maxParallel windows are 
+    run at once, by default options.jobCpus or 1 so that a job never runs more
+    trf processes than the cpus it declared to jobTree.
+    """
+    from libSimControl import runTRF, runWindowedTRF
+    if maxParallel is None:
+        maxParallel = options.jobCpus or 1
+    if options.trfWindowSize is None:
+        runTRF(fastaFile, cwd)
+    else:
+        runWindowedTRF(fastaFile, cwd, options.trfWindowSize, maxParallel)
+
+def readTRFDat(filename):
+    """ returns (header, hits) for a trf .dat file holding a single sequence.
+    header is the list of lines before the first hit, each hit is the list
+    of the 15 fields of its line.
+    """
+    header = []
+    hits = []
+    f = open(filename, 'r')
+    for line in f:
+        fields = line.split()
+        if len(fields) != 15 or not fields[0].isdigit():
+            if hits == []:
+                header.append(line)
+            continue
+        hits.append(fields)
+    f.close()
+    return header, hits
+
+def trfDatLabel(header):
+    """ returns the sequence label named in a trf .dat header.
+    """
+    for line in header:
+        if line.startswith('Sequence: '):
+            return line[10:].strip()
+    return None
+
+def writeTRFDat(filename, header, hits):
+    """ atomically writes a trf .dat file. hits is a dict keyed by 
+    (start, end, period, motif) so that duplicate hits are written once,
+    in order of position.
+    """
+    import os
+    f = open(filename + '.tmp', 'w')
+    f.write(''.join(header))
+    for k in sorted(hits):
+        f.write('%s\n' % ' '.join(hits[k]))
+    f.close()
+    os.rename(filename + '.tmp', filename)
+
+def trfHitKey(fields):
+    return (int(fields[0]), int(fields[1]), int(fields[2]), fields[13])
+
+def trfWindows(length, windowSize):
+    """ returns a list of (start, end, ownStart, ownEnd) 0-based half open
+    windows covering a sequence of the given length. Windows are windowSize
+    apart and overlap by trfWindowOverlap() bp. A hit belongs to the window
+    whose [ownStart, ownEnd) holds its start, the own ranges tile the sequence.
+    """
+    overlap = trfWindowOverlap()
+    windows = []
+    start = 0
+    while True:
+        end = min(start + windowSize + overlap, length)
+        if start == 0:
+            ownStart = 0
+        else:
+            ownStart = start + overlap / 2
+        if end == length:
+            windows.append((start, end, ownStart, length))
+            break
+        windows.append((start, end, ownStart, start + windowSize + overlap / 2))
+        start += windowSize
+    return windows
+
+def trfWindowOverlap():
+    """ bp shared by neighbouring trf windows. Repeats up to half of this
+    long are reported exactly as by a single trf run.
+    """
+    return 2 * TRF_MAX_PERIOD_SIZE * TRF_WINDOW_COPIES
+
+def readSingleFasta(fastaFile):
+    """ returns (label, sequence) of a fasta file holding a single record.
+    """
+    label = None
+    seq = []
+    f = open(fastaFile, 'r')
+    for line in f:
+        if line.startswith('>'):
+            if label is not None:
+                f.close()
+                raise RuntimeError('readSingleFasta: %s holds more than one sequence' 
+                                   % fastaFile)
+            label = line[1:].strip()
+        else:
+            seq.append(line.strip())
+    f.close()
+    if label is None:
+        raise RuntimeError('readSingleFasta: %s holds no sequence' % fastaFile)
+    return label, ''.join(seq)
+
+def runTRFOnRegions(fastaFile, label, seq, regions, workDir, maxParallel):
+    """ writes each (start, end) region of seq to its own fasta file below 
+    workDir and runs trf on them, at most maxParallel at a time (None is one
+    at a time, as a job declares a single cpu unless --jobCpus is set).
+    Returns the list of (header, hits) of the regions' .dat files, hits are
+    in the coordinates of the region.
+    """
+    from libSimControl import runFunctionsP, trfDatName, readTRFDat
+    import os
+    args = []
+    for i, r in enumerate(regions):
+        wDir = os.path.join(workDir, 'trfWindow.%d' % i)
+        if not os.path.exists(wDir):
+            os.mkdir(wDir)
+        wFasta = os.path.join(wDir, os.path.basename(fastaFile))
+        f = open(wFasta, 'w')
+        f.write('>%s\n' % label)
+        for j in xrange(r[0], r[1], 60):
+            f.write('%s\n' % seq[j:min(j + 60, r[1])])
+        f.close()
+        args.append((wFasta, wDir))
+    if maxParallel is None:
+        maxParallel = 1
+    runFunctionsP(runTRF, args, maxParallel = maxParallel)
+    return [readTRFDat(os.path.join(a[1], trfDatName(fastaFile))) for a in args]
+
+def runWindowedTRF(fastaFile, cwd, windowSize, maxParallel = None):
+    """ runs trf over overlapping windows of the single sequence in fastaFile,
+    at most maxParallel at a time (None is one at a time), and merges the hits
+    into the .dat file a single trf run would have written to cwd.
+    """
+    from libSimControl import (trfWindows, readSingleFasta, trfDatName, runTRFOnRegions,
+                               writeTRFDat, trfHitKey)
+    import os
+    label, seq = readSingleFasta(fastaFile)
+    windows = trfWindows(len(seq), windowSize)
+    if len(windows) == 1:
+        runTRF(fastaFile, cwd)
+        return
+    results = runTRFOnRegions(fastaFile, label, seq, windows, cwd, maxParallel)
+    del seq
+    hits = {}
+    for w, (header, windowHits) in zip(windows, results):
+        for fields in windowHits:
+            # trf coordinates are 1-based, relative to the window
+            start = int(fields[0]) + w[0]
+            if not w[2] <= start - 1 < w[3]:
+                continue
+            fields[0] = str(start)
+            fields[1] = str(int(fields[1]) + w[0])
+            hits[trfHitKey(fields)] = fields
+    # the header of the first window stands for the whole sequence
+    writeTRFDat(os.path.join(cwd, trfDatName(fastaFile)), results[0][0], hits)
+
+def runIncrementalTRF(thisDir, thisChr, fastaFile, localTempDir, options, maxParallel = None):
+    """ writes the .dat file for fastaFile to localTempDir using incrementalTRFHits(),
+    falling back to a full scan when it can not be used. At most maxParallel trf
+    runs go at once (None is options.jobCpus or 1). With 
+    options.trfIncrementalValidate a full scan is run as well, its hits are
+    compared in logs/trf.chrSn.validate.log and the full scan's .dat is kept.
+    """
+    from libSimControl import (extractChrNamesDict, readSingleFasta, incrementalTRFHits,
+                               runFullTRF, trfDatName, readTRFDat, writeTRFDat, trfHitKey)
+    from sonLib.bioio import logger
+    import os
+    if maxParallel is None:
+        maxParallel = options.jobCpus or 1
+    chrNameDict, revChrNameDict = extractChrNamesDict(thisDir)
+    outname = os.path.join(localTempDir, trfDatName(fastaFile))
+    workDir = os.path.join(localTempDir, 'trfIncremental')
+    if not os.path.exists(workDir):
+        os.mkdir(workDir)
+    label, seq = readSingleFasta(fastaFile)
+    result = incrementalTRFHits(thisDir, thisChr, label, seq, fastaFile, 
+                                localTempDir, workDir, options, maxParallel)
+    del seq
+    if result is None:
+        runFullTRF(fastaFile, localTempDir, options, maxParallel)
+        return
+    header, hits = result
+    if not options.trfIncrementalValidate:
+        writeTRFDat(outname, header, hits)
+        return
+    fullDir = os.path.join(localTempDir, 'trfFull')
+    if not os.path.exists(fullDir):
+        os.mkdir(fullDir)
+    runFullTRF(fastaFile, fullDir, options, maxParallel)
+    fullHeader, fullHits = readTRFDat(os.path.join(fullDir, trfDatName(fastaFile)))
+    full = {}
+    for fields in fullHits:
+        full[trfHitKey(fields)] = fields
+    missing = sorted(set(full) - set(hits))
+    extra = sorted(set(hits) - set(full))
+    f = open(os.path.join(thisDir, 'logs', 'trf.%s.validate.log' % chrNameDict[thisChr]), 'w')
+    f.write('full %d incremental %d missing %d extra %d\n' 
+            % (len(full), len(hits), len(missing), len(extra)))
+    for k in missing:
+        f.write('missing %s\n' % ' '.join(full[k][:14]))
+    for k in extra:
+        f.write('extra %s\n' % ' '.join(hits[k][:14]))
+    f.close()
+    if missing != [] or extra != []:
+        logger.warning('incremental trf differs from the full scan on %s %s: '
+                       '%d missing %d extra' % (thisDir, chrNameDict[thisChr], 
+                                                len(missing), len(extra)))
+    writeTRFDat(outname, fullHeader, full)
+
+def incrementalTRFHits(thisDir, thisChr, label, seq, fastaFile, localTempDir, workDir, options,
+                       maxParallel = None):
+    """ returns (header, hits) for the chromosome seq of the cycle in thisDir, hits
+    keyed as for writeTRFDat(), or None when a full scan should be used instead.
+    Rescanned regions go through trf at most maxParallel at a time (None is 
+    options.jobCpus or 1).
+    The cycle's alignment from the parent genome to the chromosome is used to find 
+    the runs of bases copied unchanged from the parent. Parent hits lying at least
+    options.trfIncrementalPadding bp inside a run are carried over, everything else 
+    is rescanned with padding on either side.
+    """
+    from libSimControl import (which, runCommands, getParentDir, extractChrNamesDict, 
+                               readTRFDat, trfDatLabel, parseMafIdenticalRuns, 
+                               mergeIntervals, subtractIntervals, intervalsContain,
+                               runTRFOnRegions, trfHitKey)
+    from sonLib.bioio import logger
+    import bisect
+    import glob
+    import os
+    if maxParallel is None:
+        maxParallel = options.jobCpus or 1
+    chrNameDict, revChrNameDict = extractChrNamesDict(thisDir)
+    pad = options.trfIncrementalPadding
+    length = len(seq)
+    
+    # the parent's hits, by parent chromosome label
+    parentDir = getParentDir(thisDir)
+    parentHits = {}
+    parentHeader = None
+    for f in glob.glob(os.path.join(parentDir, 'intra', 'chr*.outseq.fa*.dat')):
+        header, hits = readTRFDat(f)
+        hits.sort(key = lambda h: int(h[0]))
+        parentHits[trfDatLabel(header)] = ([int(h[0]) for h in hits], hits)
+        parentHeader = header
+    if parentHeader is None:
+        logger.info('incremental trf: no parent trf output in %s, running a full scan' 
+                    % parentDir)
+        return None
+    
+    # alignment of the parent genome to this chromosome
+    aln = os.path.join(workDir, 'parent.aln.rev')
+    maf = os.path.join(workDir, 'parent.maf')
+    cmds = []
+    cmds.append([which('evolver_transalign'), 
+                 '-in1', os.path.join(thisDir, 'inter', 'inter.aln.rev'),
+                 '-in2', os.path.join(localTempDir, chrNameDict[thisChr] + '.aln.rev'),
+                 '-out', aln, '-log', os.path.join(workDir, 'transalign.log')])
+    cmds.append([which('evolver_cvt'), '-fromrev', aln, '-tomaf', maf])
+    runCommands(cmds, workDir)
+    runs = parseMafIdenticalRuns(maf, label, length, parentHits.keys())
+    if runs is None:
+        logger.info('incremental trf: %s does not align %s to the parent trf output, '
+                    'running a full scan' % (maf, label))
+        return None
+    
+    # carry the parent's hits over the interior of each unchanged run
+    safe = []
+    unsafe = []
+    carried = []
+    for parentLabel, pStart, cStart, runLength in runs:
+        if runLength <= 2 * pad:
+            continue
+        safe.append((cStart + pad, cStart + runLength - pad))
+        starts, hits = parentHits[parentLabel]
+        i = bisect.bisect_left(starts, pStart + pad + 1)
+        while i < len(hits) and starts[i] - 1 < pStart + runLength - pad:
+            fields = hits[i]
+            i += 1
+            if int(fields[1]) > pStart + runLength - pad:
+                continue
+            start = int(fields[0]) - pStart + cStart
+            end = int(fields[1]) - pStart + cStart
+            if fields[14].upper() != seq[start - 1:end].upper():
+                unsafe.append((start - 1, end))
+                continue
+            fields = list(fields)
+            fields[0] = str(start)
+            fields[1] = str(end)
+            carried.append(fields)
+    safe = subtractIntervals(mergeIntervals(safe), mergeIntervals(unsafe))
+    
+    # rescan what is left, with padding
+    rescan = subtractIntervals([(0, length)], safe)
+    windows = mergeIntervals([(max(0, s - pad), min(length, e + pad)) for s, e in rescan])
+    covered = sum([e - s for s, e in windows])
+    if covered > TRF_INCREMENTAL_MAX_RESCAN * length:
+        logger.info('incremental trf: %d of %d bp of %s need rescanning, running a full scan'
+                    % (covered, length, label))
+        return None
+    logger.info('incremental trf: rescanning %d of %d bp of %s' % (covered, length, label))
+    hits = {}
+    for fields in carried:
+        if intervalsContain(safe, int(fields[0]) - 1, int(fields[1])):
+            hits[trfHitKey(fields)] = fields
+    if windows != []:
+        results = runTRFOnRegions(fastaFile, label, seq, windows, workDir, maxParallel)
+        for w, (header, windowHits) in zip(windows, results):
+            for fields in windowHits:
+                start = int(fields[0]) + w[0]
+                end = int(fields[1]) + w[0]
+                if intervalsContain(safe, start - 1, end):
+                    continue
+                if (start - 1 == w[0] and w[0] > 0) or (end == w[1] and w[1] < length):
+                    # the hit may run on past the window
+                    logger.info('incremental trf: hit at %d-%d of %s reaches the edge of '
+                                'its window, running a full scan' % (start, end, label))
+                    return None
+                fields[0] = str(start)
+                fields[1] = str(end)
+                hits[trfHitKey(fields)] = fields
+    header = []
+    for line in parentHeader:
+        if line.startswith('Sequence: '):
+            line = 'Sequence: %s\n' % label
+        header.append(line)
+    return header, hits
+
+def mafBreakColumns(pText, cText):
+    """ returns the sorted columns of a pairwise alignment where the parent row pText 
+    has a gap or differs from the child row cText. Equal stretches are found with
+    string comparisons, halving the stretch around each difference, so that only
+    the columns near a difference are looked at one at a time.
+    """
+    breaks = []
+    stack = [(0, len(cText))]
+    while stack != []:
+        lo, hi = stack.pop()
+        if pText[lo:hi] == cText[lo:hi]:
+            j = pText.find('-', lo, hi)
+            while j != -1:
+                breaks.append(j)
+                j = pText.find('-', j + 1, hi)
+        elif hi - lo <= 64:
+            for j in xrange(lo, hi):
+                if pText[j] == '-' or pText[j] != cText[j]:
+                    breaks.append(j)
+        else:
+            mid = (lo + hi) // 2
+            stack.append((mid, hi))
+            stack.append((lo, mid))
+    return breaks
+
+def parseMafIdenticalRuns(mafFile, childLabel, childLength, parentLabels):
+    """ reads the pairwise alignment blocks of mafFile and returns a list of 
+    (parentLabel, parentStart, childStart, length) 0-based runs of ungapped columns 
+    with identical bases, where both rows are on the + strand. The child row is the
+    one named childLabel of size childLength, the parent row must be named by one
+    of parentLabels. Returns None if a block can not be matched to the labels.
+    """
+    def findLabel(src, labels):
+        for l in labels:
+            if src == l or src.endswith('.' + l) or l.endswith('.' + src):
+                return l
+        return None
+    runs = []
+    def addBlock(rows):
+        if len(rows) != 2:
+            return True
+        child = None
+        for i in [0, 1]:
+            if (findLabel(rows[i][0], [childLabel]) is not None and 
+                int(rows[i][3]) == childLength):
+                child = i
+        if child is None:
+            return False
+        parent = rows[1 - child]
+        parentLabel = findLabel(parent[0], parentLabels)
+        if parentLabel is None:
+            return False
+        if parent[2] != '+' or rows[child][2] != '+':
+            return True
+        pText, cText = parent[4].upper(), rows[child][4].upper()
+        # runs are the stretches of columns between the breaks, gaps and mismatches
+        pPos, cPos = int(parent[1]), int(rows[child][1])
+        col = 0
+        start = 0
+        for b in mafBreakColumns(pText, cText) + [len(cText)]:
+            if b > start:
+                pPos += (start - col) - pText.count('-', col, start)
+                cPos += (start - col) - cText.count('-', col, start)
+                runs.append((parentLabel, pPos, cPos, b - start))
+                col = start
+            start = b + 1
+        return True
+    rows = []
+    f = open(mafFile, 'r')
+    for line in f:
+        if line.startswith('s '):
+            # s src start size strand srcSize text
+            fields = line.split()
+            rows.append((fields[1], fields[2], fields[4], fields[5], fields[6]))
+        elif line.strip() == '' or line.startswith('a'):
+            if not addBlock(rows):
+                f.close()
+                return None
+            rows = []
+    f.close()
+    if not addBlock(rows):
+        return None
+    return runs
+
+def mergeIntervals(intervals):
+    """ returns the sorted union of a list of 0-based half open (start, end) intervals.
+    """
+    merged = []
+    for s, e in sorted(intervals):
+        if s >= e:
+            continue
+        if merged != [] and s <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+        else:
+            merged.append((s, e))
+    return merged
+
+def subtractIntervals(intervals, remove):
+    """ returns the sorted, merged intervals minus the sorted, merged remove intervals.
+    """
+    result = []
+    j = 0
+    for s, e in intervals:
+        while j < len(remove) and remove[j][1] <= s:
+            j += 1
+        k = j
+        while k < len(remove) and remove[k][0] < e:
+            if remove[k][0] > s:
+                result.append((s, remove[k][0]))
+            s = max(s, remove[k][1])
+            k += 1
+        if s < e:
+            result.append((s, e))
+    return result
+
+def intervalsContain(intervals, start, end):
+    """ True if [start, end) lies within one of the sorted, merged intervals.
+    """
+    import bisect
+    i = bisect.bisect_right(intervals, (start, float('inf'))) - 1
+    return i >= 0 and intervals[i][0] <= start and end <= intervals[i][1]
+
 def evolverIntraStepMoveTRFCmd(thisDir, thisChr, localTempDir):
     """ calls tandem repeats finder (trf) on the per chromosome .fa files.
     Called by CycleStep2Chromosome.
@@ -997,16 +2102,16 @@ def evolverIntraStepMoveTRFCmd(thisDir, thisChr, localTempDir):
         verifyFileExists(f)
     
     cmds = []
-    cmd = [which('mv')]
+    cmd = ['mv']
     cmd.append(os.path.join(localTempDir, chrNameDict[thisChr] + '.outseq.rev'))
     cmd.append(os.path.join(thisDir, 'intra', chrNameDict[thisChr] + '.outseq.rev'))
     cmds.append(cmd)
-    cmd = [which('mv')]
+    cmd = ['mv']
     cmd.append(os.path.join(localTempDir, chrNameDict[thisChr] + '.aln.rev'))
     cmd.append(os.path.join(thisDir, 'intra', chrNameDict[thisChr] + '.aln.rev'))
     cmds.append(cmd)
     # trfBig
-    # cmd = [which('mv')]
+    # cmd = ['mv']
     # cmd.append(os.path.join(localTempDir, thisChr+'.trf.bed'))
     # cmd.append(os.path.join(thisDir, 'intra', thisChr+'.trf.bed'))
     # cmds.append(cmd)
@@ -1014,7 +2119,7 @@ def evolverIntraStepMoveTRFCmd(thisDir, thisChr, localTempDir):
     # trf
     files = glob.glob(os.path.join(localTempDir, chrNameDict[thisChr] + '.*.dat'))
     for f in files:
-        cmd = [which('mv')]
+        cmd = ['mv']
         cmd.append(f)
         cmd.append(os.path.join(thisDir, 'intra', os.path.basename(f)))
         cmds.append(cmd)
@@ -1086,14 +2191,14 @@ def runEvolverInterCmds(thisDir, thisParentDir, theChild, theParent, thisStepLen
         outname = os.path.join(thisDir, 'logs', 'mobiles.log')
         if not os.path.exists(outname):
             cmd2 = evolverInterStepMobilesCmd(thisDir, thisParentDir, theParent, thisStepLength, paramsDir)
-            p2 = subprocess.Popen(cmd2, cwd = localTempDir, stdout = subprocess.PIPE)
             f = open(outname + '.tmp', 'w')
-            f.write(p2.communicate()[0])
+            p2 = subprocess.Popen(cmd2, cwd = localTempDir, stdout = f)
+            p2.wait()
             f.close()
             handleReturnCode(p2.returncode, cmd2)
             os.rename(outname + '.tmp', outname)
             mvCmds = evolverInterStepMobilesMoveCmd(localTempDir, thisDir)
-            runCommands(mvCmds, localTempDir, mode = 'p')
+            runCommands(mvCmds, localTempDir, mode = 'p', maxParallel = options.jobCpus)
     if p1 is not None:
         p1.wait()
         handleReturnCode(p1.returncode, cmd1)
@@ -1127,7 +2232,7 @@ def evolverIntraMergeCmds(thisDir, theChild):
         verifyDirExists(d)
     for f in [os.path.join(thisDir, 'inter', 'inter.chrnames.txt')]:
         verifyFileExists(f)
-    catCmd = [which('cat')]
+    catCmd = ['cat']
     evoCmd = [which('evolver_evo')]
     cvtCmd = [which('evolver_cvt')]
     followCmds = [] # make things atomic
@@ -1155,7 +2260,7 @@ def evolverIntraMergeCmds(thisDir, theChild):
     f.close()
     
     # this filename comes from a pipe in the CycleStep3() code
-    followCmds.append([which('mv'), 
+    followCmds.append(['mv', 
                        os.path.join(thisDir, 'intra', 'evannots.gff.tmp'), 
                        os.path.join(thisDir, 'intra', 'evannots.gff')])
     
@@ -1166,14 +2271,14 @@ def evolverIntraMergeCmds(thisDir, theChild):
     evoCmd.append(theChild)
     evoCmd.append('-out')
     evoCmd.append(outname + '.tmp')
-    followCmds.append([which('mv'), outname + '.tmp', outname])
+    followCmds.append(['mv', outname + '.tmp', outname])
     
     outname = os.path.join(thisDir, 'seq.rev')
     cvtCmd.append('-mergerevseqs')
     cvtCmd.append(cvtChrStr)
     cvtCmd.append('-out')
     cvtCmd.append(outname + '.tmp')
-    followCmds.append([which('mv'), outname + '.tmp', outname])
+    followCmds.append(['mv', outname + '.tmp', outname])
     
     return (catCmd, evoCmd, cvtCmd, followCmds)
 
@@ -1222,7 +2327,7 @@ def statsStep1CmdsP(thisDir, thisParentDir):
         cmd.append(outname + '.tmp')
         cmds.append(cmd)
         outPipes.append(None)
-        cmd = [which('mv')]
+        cmd = ['mv']
         cmd.append(outname + '.tmp')
         cmd.append(outname)
         followCmds.append(cmd)
@@ -1236,175 +2341,286 @@ def statsStep1CmdsP(thisDir, thisParentDir):
         cmd.append(outname + '.tmp')
         cmds.append(cmd)
         outPipes.append(None)
-        cmd = [which('mv')]
+        cmd = ['mv']
         cmd.append(outname + '.tmp')
         cmd.append(outname)
         followCmds.append(cmd)
 
     return cmds, followCmds, outPipes
 
-def statsStep1CmdsS(thisDir, thisParentDir):
-    """ Produces a list of commands to run the first stats step.
+def expandAnnotations(thisDir):
+    """ expandAnnotations writes the stats/cds_annots.gff, exons.gff, introns.gff
+    and expanded_annots.gff files of the cycle in thisDir from its annots.gff in
+    a single in process pass. The files are identical to those of the egrep CDS|UTR,
+    evolver_gff_cdsutr2exons.py, evolver_gff_exons2introns.py, cat chain.
+    Called by StatsStep1.
+    """
+    from libSimControl import verifyDirExists, verifyFileExists, cdsToExons, exonsToIntrons
+    import os
+    for d in [thisDir, os.path.join(thisDir, 'stats')]:
+        verifyDirExists(d)
+    verifyFileExists(os.path.join(thisDir, 'annots.gff'))
+    names = ['cds_annots.gff', 'exons.gff', 'introns.gff', 'expanded_annots.gff']
+    outnames = [os.path.join(thisDir, 'stats', n) for n in names]
+    if all([os.path.exists(o) for o in outnames]):
+        return
+    f = open(os.path.join(thisDir, 'annots.gff'), 'r')
+    annots = f.readlines()
+    f.close()
+    cds = [l for l in annots if 'CDS' in l or 'UTR' in l]
+    exons = cdsToExons(cds)
+    introns = exonsToIntrons(exons)
+    contents = [cds, exons, introns, annots + exons + introns]
+    for outname, lines in zip(outnames, contents):
+        if not os.path.exists(outname):
+            f = open(outname + '.tmp', 'w')
+            f.writelines(lines)
+            f.close()
+            os.rename(outname + '.tmp', outname)
+
+def gffGeneIndex(rec):
+    """ returns the gene_index attribute of an evolver_gff.GFFRec.
+    """
+    geneIndex = rec.GetIntAttr('gene_index')
+    if geneIndex is None:
+        raise RuntimeError("Required attr 'gene_index' not found in: %s" % rec.ToStr())
+    return geneIndex
+
+def gffRecLine(label, source, feature, start, end, score, attrs):
+    """ formats a gff line as evolver_gff.WriteRec() does.
+    """
+    import evolverSimControl.lib.evolver_gff as gff
+    return gff.GFFRec(label, source, feature, start, end, score, '.', '.', attrs).ToStr() + '\n'
+
+def sortedGffRecs(lines):
+    """ returns the evolver_gff.GFFRec records of the gff lines in the order of
+    evolver_gff.GetSortedLines().
+    """
+    import evolverSimControl.lib.evolver_gff as gff
+    recs = [gff.RecFromLine(l.strip()) for l in lines]
+    recs.sort(key = gff.GFFRec.Key)
+    return recs
+
+def cdsToExons(lines):
+    """ returns the exon lines evolver_gff_cdsutr2exons.py writes for the 
+    CDS and UTR gff lines, joining abutting pieces of the same gene.
+    """
+    from libSimControl import gffGeneIndex, gffRecLine, sortedGffRecs
+    exons = []
+    exonStart = -1
+    lastGeneIndex = -1
+    lastLabel = ''
+    lastEnd = -1
+    ces = ''
+    for rec in sortedGffRecs(lines):
+        label, feature, start, end, score = rec.Label, rec.Feature, rec.Start, rec.End, rec.Score
+        if feature != 'CDS' and feature != 'UTR':
+            continue
+        geneIndex = gffGeneIndex(rec)
+        if geneIndex != lastGeneIndex or label != lastLabel or start != lastEnd + 1:
+            if exonStart != -1:
+                # the exon takes the score of the record that ends it
+                exons.append(gffRecLine(lastLabel, 'cdsutr2exons', 'exon', exonStart, lastEnd,
+                                        score, 'gene_index %u; ces %s;' % (lastGeneIndex, ces)))
+                ces = ''
+            exonStart = start
+        lastGeneIndex = geneIndex
+        lastLabel = label
+        lastEnd = end
+        s = '%s:%u-%u' % (feature, start, end)
+        if ces == '':
+            ces = s
+        else:
+            ces += ',' + s
+    if exonStart != -1:
+        # as in evolver_gff_cdsutr2exons.py the last exon takes the label
+        # and score of the last record read
+        exons.append(gffRecLine(label, 'cdsutr2exons', 'exon', exonStart, lastEnd,
+                                score, 'gene_index %u; ces %s;' % (lastGeneIndex, ces)))
+    return exons
+
+def exonsToIntrons(lines):
+    """ returns the intron lines evolver_gff_exons2introns.py writes for the
+    exon gff lines, raising a RuntimeError for genes whose exon and intron
+    counts disagree.
+    """
+    from libSimControl import gffGeneIndex, gffRecLine, sortedGffRecs
+    introns = []
+    lastGeneIndex = -1
+    lastExonStart = -1
+    lastExonEnd = -1
+    lastLabel = ''
+    exonCounts = {}
+    intronCounts = {}
+    for rec in sortedGffRecs(lines):
+        label, feature, start, end, score = rec.Label, rec.Feature, rec.Start, rec.End, rec.Score
+        if feature != 'exon':
+            continue
+        geneIndex = gffGeneIndex(rec)
+        key = (label, geneIndex)
+        exonCounts[key] = exonCounts.get(key, 0) + 1
+        if geneIndex == lastGeneIndex and label == lastLabel and lastExonStart != -1:
+            introns.append(gffRecLine(lastLabel, 'exons2introns', 'intron', lastExonEnd + 1, 
+                                      start - 1, score, 'gene_index %u; exons %u-%u,%u-%u;' 
+                                      % (geneIndex, lastExonStart, lastExonEnd, start, end)))
+            intronCounts[key] = intronCounts.get(key, 0) + 1
+        lastGeneIndex = geneIndex
+        lastExonStart = start
+        lastExonEnd = end
+        lastLabel = label
+    for key in exonCounts:
+        if intronCounts.get(key, 0) != exonCounts[key] - 1:
+            raise RuntimeError('%s gene index %u has %u exons and %u introns' 
+                               % (key[0], key[1], exonCounts[key], intronCounts.get(key, 0)))
+    return introns
+
+def annotDiffStats(gff1, gff2, name1, name2, seq1, seq2, outname):
+    """ writes the evolver_gff_featurestats2.py comparison of the annotations gff1
+    and gff2 to outname, in process. The genome sizes come from the cached chromosome
+    lengths of seq1 and seq2 and the feature counts of each gff from its
+    .featurecounts sidecar, so only a gff not compared before is read.
+    """
+    from libSimControl import verifyFileExists, getGenomeSize
+    import evolverSimControl.lib.evolver_gff_featurestats2 as fs2
+    for f in [gff1, gff2, seq1, seq2]:
+        verifyFileExists(f)
+    fs2.WriteDiffFile(gff1, gff2, name1, name2, getGenomeSize(seq1), getGenomeSize(seq2), 
+                      outname)
+
+def cycleAnnotDiff(thisDir, thisParentDir):
+    """ writes the stats/tmpstats.cycle.diffannots.txt comparison of the annotations
+    of the cycle in thisDir with its parent's, after expandAnnotations() has run.
     called by StatsStep1
     """
-    from libSimControl import which, verifyDirExists, verifyFileExists
+    from libSimControl import verifyDirExists, annotDiffStats
     import os
     for d in [thisDir, thisParentDir, os.path.join(thisDir, 'stats')]:
        verifyDirExists(d)
-    for f in [os.path.join(thisDir, 'annots.gff'), 
-               os.path.join(thisParentDir, 'stats', 'expanded_annots.gff'),
-               os.path.join(thisDir, 'seq.rev'), os.path.join(thisParentDir, 'seq.rev')]:
-       verifyFileExists(f)
+    outname = os.path.join(thisDir, 'stats', 'tmpstats.cycle.diffannots.txt')
+    if not os.path.exists(outname):
+        annotDiffStats(os.path.join(thisParentDir, 'stats', 'expanded_annots.gff'),
+                       os.path.join(thisDir, 'stats', 'expanded_annots.gff'),
+                       os.path.basename(thisParentDir), os.path.basename(thisDir),
+                       os.path.join(thisParentDir, 'seq.rev'), os.path.join(thisDir, 'seq.rev'),
+                       outname)
+
+def branchAnnotDiff(thisDir, options):
+    """ writes the stats/tmpstats.branch.diffannots.txt comparison of the annotations
+    of the cycle in thisDir with those of its most recent branch point.
+    called by StatsStep3
+    """
+    from libSimControl import verifyDirExists, annotDiffStats, getBranchDir
+    import os
+    for d in [thisDir, os.path.join(thisDir, 'stats'), options.rootDir]:
+        verifyDirExists(d)
+    outname = os.path.join(thisDir, 'stats', 'tmpstats.branch.diffannots.txt')
+    if not os.path.exists(outname):
+        annotDiffStats(os.path.join(getBranchDir(thisDir), 'stats', 'expanded_annots.gff'),
+                       os.path.join(thisDir, 'stats', 'expanded_annots.gff'),
+                       os.path.basename(options.rootDir), os.path.basename(thisDir),
+                       os.path.join(options.rootDir, 'seq.rev'), os.path.join(thisDir, 'seq.rev'),
+                       outname)
+
+topologyCache = {}
+def getTopology(thisDir):
+    """ getTopology returns a (parentDir, isRoot, numberChildren) tuple for the 
+    cycle in thisDir. The topology of a cycle never changes once the cycle has been
+    created so answers are memoized for the life of the process. The simulation's
+    StepPlan is used when it is present, otherwise the summary.xml file is read once.
+    """
+    from libSimControl import verifyDirExists, readXml, getStepPlan
+    import os
+    if thisDir in topologyCache:
+        return topologyCache[thisDir]
+    verifyDirExists(thisDir)
+    simDir, name = os.path.split(os.path.abspath(thisDir))
+    topo = None
+    if os.path.exists(os.path.join(simDir, '.stepPlan.pickle')):
+        plan = getStepPlan(simDir)
+        if name in plan.index:
+            i = plan.index[name]
+            if plan.parents[i] is None:
+                topo = (None, True, len(plan.children[i]))
+            else:
+                topo = (os.path.join(simDir, plan.names[plan.parents[i]]), False, 
+                        len(plan.children[i]))
+    if topo is None:
+        root = readXml(os.path.join(thisDir, 'xml', 'summary.xml')).getroot()
+        parentDir = None
+        numberChildren = None
+        isRoot = False
+        t = root.find('cycleIsRoot')
+        if t is not None and t.text == 'True':
+            isRoot = True
+        t = root.find('parentDir')
+        if t is not None and not isRoot:
+            parentDir = t.text
+        t = root.find('numberChildren')
+        if t is not None:
+            numberChildren = int(t.text)
+        topo = (parentDir, isRoot, numberChildren)
+    topologyCache[thisDir] = topo
+    return topo
 
-    outPipes = []
-    cmds  = []
+def getParentDir(thisDir):
+    """ getParentDir returns the parent directory of the cycle in thisDir, as
+    recorded in the parentDir tag of its summary.xml file.
+    CAUTION, if thisDir is None, getParentDir() returns None, but if getParentDir() is 
+    a string and is not a valid directory, getParentDir() throws an exception.
+    The None in None out behavior allows us to easily run Cycle (step n) with Stats (n-1) 
+    and Transalign (n-1) in parallel.
+    """
+    from libSimControl import getTopology
+    if thisDir is None:
+       return None
+    return getTopology(thisDir)[0]
+
+def getBranchDir(thisDir):
+    """ Returns the first ancestor that is either the root or a branch point.
+    """
+    from libSimControl import verifyDirExists, isBranchOrRoot, getParentDir
+    verifyDirExists(thisDir)
+    p = getParentDir(thisDir)
+    while not isBranchOrRoot(p):
+        p = getParentDir(p)
+    return p
+
+def dirIsRoot(thisDir):
+    """ dirIsRoot checks to see if the supplied directory is the root directory
+    for the simulation. Returns True or False
+    """
+    from libSimControl import getTopology
+    return getTopology(thisDir)[1]
 
-    outname = os.path.join(thisDir, 'stats', 'cds_annots.gff')
+def cycleStats(thisDir):
+    """ writes the stats/merged_cycle.stats.txt file of the cycle in thisDir, the
+    sum of its *.stats.txt files, and its events_cycle.txt report. Called by
+    StatsStep2.
+    """
+    from libSimControl import verifyDirExists
+    import evolverSimControl.lib.evolver_evostats_report as eer
+    import evolverSimControl.lib.evolver_merge_evostats as mes
+    import glob
+    import os
+    verifyDirExists(os.path.join(thisDir, 'stats'))
+    
+    values = None
+    outname = os.path.join(thisDir, 'stats', 'merged_cycle.stats.txt')
     if not os.path.exists(outname):
-        cmd = [which('egrep')]
-        cmd.append('CDS|UTR')
-        cmd.append(os.path.join(thisDir, 'annots.gff'))
-        cmds.append(cmd)
-        outPipes.append(outname + '.tmp')
-        cmd = [which('mv')]
-        cmd.append(outname + '.tmp')
-        cmd.append(outname)
-        outPipes.append(None)
-        cmds.append(cmd)
-    
-    outname = os.path.join(thisDir, 'stats', 'exons.gff')
-    if not os.path.exists(outname):
-        cmd = [which('evolver_gff_cdsutr2exons.py')]
-        cmd.append(os.path.join(thisDir, 'stats', 'cds_annots.gff'))
-        cmds.append(cmd)
-        outPipes.append(outname + '.tmp')
-        cmd = [which('mv')]
-        cmd.append(outname + '.tmp')
-        cmd.append(outname)
-        outPipes.append(None)
-        cmds.append(cmd)
-    
-    outname = os.path.join(thisDir, 'stats', 'introns.gff')
-    if not os.path.exists(outname):
-        cmd = [which('evolver_gff_exons2introns.py')]
-        cmd.append(os.path.join(thisDir, 'stats', 'exons.gff'))
-        cmds.append(cmd)
-        outPipes.append(outname + '.tmp')
-        cmd = [which('mv')]
-        cmd.append(outname + '.tmp')
-        cmd.append(outname)
-        outPipes.append(None)
-        cmds.append(cmd)
-    
-    outname = os.path.join(thisDir, 'stats', 'expanded_annots.gff')
-    if not os.path.exists(outname):
-        cmd = [which('cat')]
-        cmd.append(os.path.join(thisDir, 'annots.gff'))
-        cmd.append(os.path.join(thisDir, 'stats', 'exons.gff'))
-        cmd.append(os.path.join(thisDir, 'stats', 'introns.gff'))
-        cmds.append(cmd)
-        outPipes.append(outname + '.tmp')
-        cmd = [which('mv')]
-        cmd.append(outname + '.tmp')
-        cmd.append(outname)
-        outPipes.append(None)
-        cmds.append(cmd)
+        values = mes.MergeStatsFiles(glob.glob(os.path.join(thisDir, 'stats', '*.stats.txt')))
+        mes.WriteStatsFile(values, outname)
     
-    outname = os.path.join(thisDir, 'stats', 'tmpstats.cycle.diffannots.txt')
+    outname = os.path.join(thisDir, 'stats', 'events_cycle.txt')
     if not os.path.exists(outname):
-        cmd = [which('evolver_gff_featurestats2.sh')]
-        cmd.append(which('evolver_gff_featurestats2.py'))
-        cmd.append(os.path.join(thisParentDir, 'stats', 'expanded_annots.gff'))
-        cmd.append(os.path.join(thisDir, 'stats', 'expanded_annots.gff'))
-        cmd.append(os.path.basename(thisParentDir))
-        cmd.append(os.path.basename(thisDir))
-        cmd.append(os.path.join(thisParentDir, 'seq.rev'))
-        cmd.append(os.path.join(thisDir, 'seq.rev'))
-        cmd.append(which('evolver_cvt'))
-        cmds.append(cmd)
-        outPipes.append(outname + '.tmp')
-        cmd = [which('mv')]
-        cmd.append(outname + '.tmp')
-        cmd.append(outname)
-        outPipes.append(None)
-        cmds.append(cmd)
-    
-    return cmds, outPipes
-
-def getParentDir(thisDir):
-    """ getParentDir inspects the summary.xml file contained in the supplied directory
-    and returns the text of the parentDir tag.
-    CAUTION, if thisDir is None, getParentDir() returns None, but if getParentDir() is 
-    a string and is not a valid directory, getParentDir() throws an exception.
-    The None in None out behavior allows us to easily run Cycle (step n) with Stats (n-1) 
-    and Transalign (n-1) in parallel.
-    """
-    from libSimControl import verifyDirExists, verifyFileExists, lockfile, unlockfile, dirIsRoot
-    import os
-    import sys
-    import xml.etree.ElementTree as ET
-    import xml.parsers.expat as expat
-
-    if thisDir is None:
-       return None
-    for d in [thisDir]:
-       verifyDirExists(d)
-    if dirIsRoot(thisDir):
-       return None
-    lockname = lockfile(os.path.join(thisDir, 'xml', 'summary.xml'))
-    try:
-        infoTree = ET.parse(lockname)
-    except expat.ExpatError: # broken xml file
-        sys.stderr.write('Bad xml: %s\n' % lockname)
-        raise
-    unlockfile(lockname)
-    root = infoTree.getroot()
-    t = root.find('parentDir')
-    if t is not None:
-       parentDir = t.text
-       return parentDir
-    return None
-
-def getBranchDir(thisDir):
-    """ Returns the first ancestor that is either the root or a branch point.
-    """
-    from libSimControl import verifyDirExists, isBranchOrRoot, getParentDir
-    verifyDirExists(thisDir)
-    p = getParentDir(thisDir)
-    while not isBranchOrRoot(p):
-        p = getParentDir(p)
-    return p
-
-def dirIsRoot(thisDir):
-    """ dirIsRoot checks to see if the supplied directory is the root directory
-    for the simulation. It uses the summary.xml file contained in the supplied
-    directory to make the decision. Returns True or False
-    """
-    from libSimControl import verifyDirExists, lockfile, unlockfile
-    import os
-    import sys
-    import xml.etree.ElementTree as ET
-    import xml.parsers.expat as expat
-
-    for d in [thisDir]:
-       verifyDirExists(d)
-    lockname = lockfile(os.path.join(thisDir, 'xml', 'summary.xml'))
-    try:
-        infoTree = ET.parse(lockname)
-    except expat.ExpatError: # broken xml file
-        sys.stderr.write('Bad xml: %s\n' % lockname)
-        raise
-    unlockfile(lockname)
-    root = infoTree.getroot()
-    t = root.find('cycleIsRoot')
-    if t is not None:
-       if t.text == 'True':
-          return True
-    return False
+        if values is None:
+            stats = eer.ReadStats(os.path.join(thisDir, 'stats', 'merged_cycle.stats.txt'))
+        else:
+            stats = eer.StatsFromValues(values)
+        eer.WriteReportFile(stats, outname)
 
 def statsStep2Cmds(thisDir, thisParentDir, options):
-    """ Produces a list of commands to run the a stats step,
-    called by StatsStep2
+    """ Produces a list of commands to run the a stats step, after cycleStats()
+    has run. called by StatsStep2
     """
     import glob
     from libSimControl import which, verifyDirExists, verifyFileExists
@@ -1417,31 +2633,6 @@ def statsStep2Cmds(thisDir, thisParentDir, options):
     pipes = []
     cmds  = []
 
-    outname = os.path.join(thisDir, 'stats', 'merged_cycle.stats.txt')
-    if not os.path.exists(outname):
-        cmd = [which('evolver_merge_evostats.py')]
-        for f in glob.glob(os.path.join(thisDir, 'stats', '*.stats.txt')):
-            cmd.append(f)
-        cmds.append(cmd)
-        pipes.append(outname + '.tmp')
-        cmd = [which('mv')]
-        cmd.append(outname + '.tmp')
-        cmd.append(outname)
-        pipes.append(None)
-        cmds.append(cmd)
-    
-    outname = os.path.join(thisDir, 'stats', 'events_cycle.txt')
-    if not os.path.exists(outname):
-        cmd = [which('evolver_evostats_report.py')]
-        cmd.append(os.path.join(thisDir, 'stats', 'merged_cycle.stats.txt'))
-        cmds.append(cmd)
-        pipes.append(outname + '.tmp')
-        cmd = [which('mv')]
-        cmd.append(outname + '.tmp')
-        cmd.append(outname)
-        pipes.append(None)
-        cmds.append(cmd)
-    
     if not options.noMEs:
         outname = os.path.join(thisDir, 'stats', 'stats.mobiles.txt')
         if not os.path.exists(outname):
@@ -1452,7 +2643,7 @@ def statsStep2Cmds(thisDir, thisParentDir, options):
             cmd.append(os.path.join(thisDir, 'logs', 'mobiles.log'))
             cmds.append(cmd)
             pipes.append(outname + '.tmp')
-            cmd = [which('mv')]
+            cmd = ['mv']
             cmd.append(outname + '.tmp')
             cmd.append(outname)
             pipes.append(None)
@@ -1470,7 +2661,7 @@ def statsStep2Cmds(thisDir, thisParentDir, options):
         cmd.append(outname + '.tmp')
         cmds.append(cmd)
         pipes.append(None)
-        cmd = [which('mv')]
+        cmd = ['mv']
         cmd.append(outname + '.tmp')
         cmd.append(outname)
         pipes.append(None)
@@ -1504,26 +2695,7 @@ def statsStep3Cmds(thisDir, thisParentDir, options):
         cmd.append(outname + '.tmp')
         cmds.append(cmd)
         pipes.append(None)
-        cmd = [which('mv')]
-        cmd.append(outname + '.tmp')
-        cmd.append(outname)
-        pipes.append(None)
-        cmds.append(cmd)
-
-    outname = os.path.join(thisDir, 'stats', 'tmpstats.branch.diffannots.txt')
-    if not os.path.exists(outname):
-        cmd = [which('evolver_gff_featurestats2.sh')]
-        cmd.append(which('evolver_gff_featurestats2.py'))
-        cmd.append(os.path.join(getBranchDir(thisDir), 'stats', 'expanded_annots.gff'))
-        cmd.append(os.path.join(thisDir, 'stats', 'expanded_annots.gff'))
-        cmd.append(os.path.basename(options.rootDir))
-        cmd.append(os.path.basename(thisDir))
-        cmd.append(os.path.join(options.rootDir, 'seq.rev'))
-        cmd.append(os.path.join(thisDir, 'seq.rev'))
-        cmd.append(which('evolver_cvt'))
-        cmds.append(cmd)
-        pipes.append(outname + '.tmp')
-        cmd = [which('mv')]
+        cmd = ['mv']
         cmd.append(outname + '.tmp')
         cmd.append(outname)
         pipes.append(None)
@@ -1531,141 +2703,76 @@ def statsStep3Cmds(thisDir, thisParentDir, options):
 
     return cmds, pipes
 
-def statsStep4Cmds(thisDir, thisParentDir, options):
-    """ Produces a list of commands to run a stats step,
-    called by StatsStep4
-    """
-    from libSimControl import which, verifyDirExists, verifyFileExists
+def cumulativeStats(thisDir, thisParentDir):
+    """ writes the stats/merged_root.stats.txt and merged_branch.stats.txt files of
+    the cycle in thisDir, its event counts from the root and from the most recent
+    branch point, by adding its merged_cycle.stats.txt to the parent's totals,
+    and their events_root.txt and events_branch.txt reports.
+    Each total is also saved as an evolver_merge_evostats StatsTable that extends
+    the parent's, so that the next cycle copies it whole and adds only its own
+    counts. Called by StatsStep4.
+    """
+    from libSimControl import verifyDirExists, verifyFileExists, isBranchOrRoot
+    import evolverSimControl.lib.evolver_evostats_report as eer
+    import evolverSimControl.lib.evolver_merge_evostats as mes
     import os
-    for d in [thisDir, thisParentDir, os.path.join(thisDir, 'stats'), options.rootDir]:
+    import shutil
+    for d in [thisDir, thisParentDir, os.path.join(thisDir, 'stats')]:
         verifyDirExists(d)
-    for f in [os.path.join(thisDir, 'seq.rev'), os.path.join(options.rootDir, 'seq.rev')]:
-        verifyFileExists(f)
-        
-    pipes = []
-    cmds  = []
+    cycleFile = os.path.join(thisDir, 'stats', 'merged_cycle.stats.txt')
+    verifyFileExists(cycleFile)
     
-    outname = os.path.join(thisDir, 'stats', 'merged_root.stats.txt')
-    if not os.path.exists(outname):
-        cmd = [which('evolver_merge_evostats.py')]
-        cmd.append(os.path.join(thisDir, 'stats', 'merged_cycle.stats.txt'))
-        cmd.append(os.path.join(thisParentDir, 'stats', 'merged_root.stats.txt'))
-        cmds = [cmd]
-        pipes.append(outname + '.tmp')
-        cmd = [which('mv')]
-        cmd.append(outname + '.tmp')
-        cmd.append(outname)
-        pipes.append(None)
-        cmds.append(cmd)
+    cycleTable = mes.ReadStatsTable(cycleFile)
     
-    outname = os.path.join(thisDir, 'stats', 'events_root.txt')
-    if not os.path.exists(outname):
-        cmd = [which('evolver_evostats_report.py')]
-        cmd.append(os.path.join(thisDir, 'stats', 'merged_root.stats.txt'))
-        cmds.append(cmd)
-        pipes.append(outname + '.tmp')
-        cmd = [which('mv')]
-        cmd.append(outname + '.tmp')
-        cmd.append(outname)
-        pipes.append(None)
-        cmds.append(cmd)
+    outname = os.path.join(thisDir, 'stats', 'merged_root.stats.txt')
+    if os.path.exists(outname):
+        table = None
+    else:
+        table = mes.AddStatsTables(
+            mes.ReadStatsTable(os.path.join(thisParentDir, 'stats', 'merged_root.stats.txt')), 
+            cycleTable)
+        mes.WriteStatsTableFile(table, outname)
+    reportname = os.path.join(thisDir, 'stats', 'events_root.txt')
+    if not os.path.exists(reportname):
+        if table is None:
+            table = mes.ReadStatsTable(outname)
+        eer.WriteReportFile(eer.StatsFromTable(table), reportname)
     
     outname = os.path.join(thisDir, 'stats', 'merged_branch.stats.txt')
-    if not os.path.exists(outname):
-        if isBranchOrRoot(thisParentDir):
-            cmd = [which('cp')]
-            cmd.append(os.path.join(thisDir, 'stats', 'merged_cycle.stats.txt'))
-            cmd.append(outname + '.tmp')
-            cmds.append(cmd)
-            pipes.append(None)
-            cmd = [which('mv')]
-            cmd.append(outname + '.tmp')
-            cmd.append(outname)
-            cmds.append(cmd)
-            pipes.append(None)
-        else:
-            cmd = [which('evolver_merge_evostats.py')]
-            cmd.append(os.path.join(thisDir, 'stats', 'merged_cycle.stats.txt'))
-            cmd.append(os.path.join(thisParentDir, 'stats', 'merged_branch.stats.txt'))
-            cmds.append(cmd)
-            pipes.append(outname + '.tmp')
-            cmd = [which('mv')]
-            cmd.append(outname + '.tmp')
-            cmd.append(outname)
-            cmds.append(cmd)
-            pipes.append(None)
-
-    outname = os.path.join(thisDir, 'stats', 'events_branch.txt')
-    if not os.path.exists(outname):
-        cmd = [which('evolver_evostats_report.py')]
-        cmd.append(os.path.join(thisDir, 'stats', 'merged_branch.stats.txt'))
-        cmds.append(cmd)
-        pipes.append(outname + '.tmp')
-        cmd = [which('mv')]
-        cmd.append(outname + '.tmp')
-        cmd.append(outname)
-        pipes.append(None)
-        cmds.append(cmd)
-
-    return cmds, pipes
+    if os.path.exists(outname):
+        table = None
+    elif isBranchOrRoot(thisParentDir):
+        table = cycleTable
+        shutil.copyfile(cycleFile, outname + '.tmp')
+        os.rename(outname + '.tmp', outname)
+        mes.SaveStatsBinary(table, outname)
+    else:
+        table = mes.AddStatsTables(
+            mes.ReadStatsTable(os.path.join(thisParentDir, 'stats', 'merged_branch.stats.txt')), 
+            cycleTable)
+        mes.WriteStatsTableFile(table, outname)
+    reportname = os.path.join(thisDir, 'stats', 'events_branch.txt')
+    if not os.path.exists(reportname):
+        if table is None:
+            table = mes.ReadStatsTable(outname)
+        eer.WriteReportFile(eer.StatsFromTable(table), reportname)
 
 def isBranchOrRoot(thisDir):
-    """ Checks the summary.xml file contained in thisDir
-    for evidence that the directory is either a branch or the root.
+    """ Checks the topology of thisDir for evidence that the directory 
+    is either a branch or the root.
     """
-    from libSimControl import verifyFileExists, verifyDirExists, lockfile, unlockfile, dirIsRoot
-    import os
-    import sys
-    import xml.etree.ElementTree as ET
-    import xml.parsers.expat as expat
-    
-    for d in [thisDir]:
-        verifyDirExists(d)
-    if dirIsRoot(thisDir):
-        return True
-    lockname = lockfile(os.path.join(thisDir, 'xml', 'summary.xml'))
-    try:
-        infoTree = ET.parse(lockname)
-    except expat.ExpatError: # broken xml file
-        sys.stderr.write('Bad xml: %s\n' % lockname)
-        raise
-    unlockfile(lockname)
-    root = infoTree.getroot()
-    nc = root.find('numberChildren')
-    if nc is not None:
-        # branches will have two children
-        if nc.text == '2':
-            return True
-    return False
+    from libSimControl import getTopology
+    parentDir, isRoot, numberChildren = getTopology(thisDir)
+    # branches will have two children
+    return isRoot or numberChildren == 2
 
 def isLeaf(thisDir):
-    """ Checks the summary.xml file contained in thisDir
-    for evidence that the directory is a leaf.
+    """ Checks the topology of thisDir for evidence that the directory is a leaf.
     """
-    from libSimControl import verifyFileExists, verifyDirExists, lockfile, unlockfile, dirIsRoot
-    import os
-    import sys
-    import xml.etree.ElementTree as ET
-    import xml.parsers.expat as expat
-    
-    for d in [thisDir]:
-        verifyDirExists(d)
-    if dirIsRoot(thisDir):
-        return True
-    lockname = lockfile(os.path.join(thisDir, 'xml', 'summary.xml'))
-    try:
-        infoTree = ET.parse(lockname)
-    except expat.ExpatError: # broken xml file
-        sys.stderr.write('Bad xml: %s\n' % lockname)
-        raise
-    unlockfile(lockname)
-    root = infoTree.getroot()
-    nc = root.find('numberChildren')
-    if nc is not None:
-        # leafs will have no children
-        if nc.text == '0':
-            return True
-    return False
+    from libSimControl import getTopology
+    parentDir, isRoot, numberChildren = getTopology(thisDir)
+    # leafs will have no children
+    return isRoot or numberChildren == 0
 
 def nodeIsLeaf(nt):
     """Returns True if the newick tree supplied has 0 distance
@@ -1692,6 +2799,39 @@ def treeStr2Dir(treeStr, simDir):
                                         nameTree(newickTreeParser(treeStr, 0.0))
                                         ))
 
+def statsHandoff(parentDir, childDir, party):
+    """ statsHandoff() is used with --overlapCycles, where the Stats of the cycle in
+    childDir must wait on both that cycle and the Stats (and Transalign) of the cycle
+    in parentDir, whose stats/ outputs it reads. Each of the two parties, 'cycle'
+    (TreeFollow) and 'stats' (TransalignStep of the parent), calls it once it is done
+    and it returns True to the last one to arrive, which then starts the Stats.
+    The markers are kept in parentDir/xml under the lock of its summary.xml. A party
+    that is rerun after having started the Stats gets True again.
+    This is called by TreeFollow and TransalignStep
+    """
+    from libSimControl import lockfile, unlockfile
+    import os
+    if party not in ('cycle', 'stats'):
+        raise RuntimeError('statsHandoff: unknown party %s' % party)
+    other = {'cycle': 'stats', 'stats': 'cycle'}[party]
+    prefix = os.path.join(parentDir, 'xml', 'stats.handoff.%s.' % os.path.basename(childDir))
+    lockname = lockfile(os.path.join(parentDir, 'xml', 'summary.xml'))
+    try:
+        open(prefix + party, 'w').close()
+        if not os.path.exists(prefix + other):
+            return False
+        if os.path.exists(prefix + 'started'):
+            f = open(prefix + 'started')
+            starter = f.read().strip()
+            f.close()
+            return starter == party
+        f = open(prefix + 'started', 'w')
+        f.write(party + '\n')
+        f.close()
+        return True
+    finally:
+        unlockfile(lockname)
+
 def lastOneOutTurnOffTheLightsCycle(thisDir):
     """ lastOneOutTurnOffTheLightsCycle() checks the .xml files in thisDir
     and if (1) both Stats and Transalign are finished and (2) it has not already
@@ -1784,6 +2924,7 @@ def lastOneOutTurnOffTheLightsSimulation(thisDir, options):
         timeTag.attrib['elapsedTime'] = str(now - float(timeTag.attrib['startEpochUTC']))
         endTag = timeTag.find('end')
         if endTag is not None:
+            unlockfile(lockname)
             return
         timeEnd        = ET.SubElement(timeTag, 'end')
         timeLocal      = ET.SubElement(timeEnd, 'humanLocal')
@@ -1801,11 +2942,10 @@ def allLeafsComplete(options):
     """ allLeafsComplete checks all of the leaf directories for a simulation and looks in their
     xml/summary.xml files to see if they are finished running.
     """
-    import os
-    from sonLib.bioio import newickTreeParser
-    leafs = extractLeafNames(newickTreeParser(options.inputNewick, 0.0))
-    for l in leafs:
-        if not statsAndTransAreComplete(os.path.join(options.simDir, l)):
+    from libSimControl import getStepPlan, stepDir
+    plan = getStepPlan(options.simDir)
+    for i, leaf in enumerate(plan.isLeaf):
+        if leaf and not statsAndTransAreComplete(stepDir(plan, i, options.simDir)):
             return False
     return True
 
@@ -1823,10 +2963,13 @@ def extractLeafNames(nt):
     return names
 
 def transalignStepCmds_1(thisDir, thisParentDir, options):
-    """ Produces a list of commands to run a stats step,
-    called by StatsStep4
+    """ Produces a list of CmdTask objects to run the first part of a 
+    transalign step, called by TransalignStep. Each task declares the
+    files it reads and writes so that the tasks may be run with runCommandGraph().
     """
-    from libSimControl import which, getBranchDir, verifyDirExists, verifyFileExists
+    from libSimControl import (which, getBranchDir, verifyDirExists, verifyFileExists, 
+                               isBranchOrRoot, newMoveTask)
+    from libSimControlClasses import CmdTask
     import os
     for d in [thisDir, thisParentDir]:
         verifyDirExists(d)
@@ -1836,8 +2979,7 @@ def transalignStepCmds_1(thisDir, thisParentDir, options):
     DRAW_REV_BLOCK_SIZE = 10**4
     DRAW_REV_NT_PER_PIX = 10**5
     
-    pipes = []
-    cmds  = []
+    tasks = []
     
     outname = os.path.join(thisDir, 'inter-intra.aln.rev')
     if not os.path.exists(outname):
@@ -1850,13 +2992,7 @@ def transalignStepCmds_1(thisDir, thisParentDir, options):
         cmd.append(outname + '.tmp')
         cmd.append('-log')
         cmd.append(os.path.join(thisDir, 'logs', 'transalign1.log'))
-        pipes.append(None)
-        cmds.append(cmd)
-        cmd = [which('mv')]
-        cmd.append(outname + '.tmp')
-        cmd.append(outname)
-        pipes.append(None)
-        cmds.append(cmd)
+        tasks.append(newMoveTask(cmd, outname, cmd[2:5:2]))
     
     outname = os.path.join(thisDir, 'aln.rev')
     if not os.path.exists(outname):
@@ -1866,12 +3002,11 @@ def transalignStepCmds_1(thisDir, thisParentDir, options):
             # In these cases the alignment above the branch point should not be carried
             # into the the descendant genomes. Alignments should only go back to the most
             # recent branch point.
-            cmd = [which('ln')]
+            cmd = ['ln']
             cmd.append('-s')
             cmd.append(os.path.join(thisDir, 'inter-intra.aln.rev'))
             cmd.append(outname)
-            pipes.append(None)
-            cmds.append(cmd)
+            tasks.append(CmdTask([cmd], [cmd[2]], [outname]))
         else:
             cmd = [which('evolver_transalign')]
             cmd.append('-in1')
@@ -1882,13 +3017,7 @@ def transalignStepCmds_1(thisDir, thisParentDir, options):
             cmd.append(outname + '.tmp')
             cmd.append('-log')
             cmd.append(os.path.join(thisDir, 'logs', 'transalign2.log'))
-            pipes.append(None)
-            cmds.append(cmd)
-            cmd = [which('mv')]
-            cmd.append(outname + '.tmp')
-            cmd.append(outname)
-            pipes.append(None)
-            cmds.append(cmd)
+            tasks.append(newMoveTask(cmd, outname, cmd[2:5:2]))
 
     outname = os.path.join(thisDir, 'stats', 'cds_aln.cycle.rev')
     if not os.path.exists(outname):
@@ -1903,13 +3032,7 @@ def transalignStepCmds_1(thisDir, thisParentDir, options):
         cmd.append(os.path.join(thisDir, 'annots.gff'))
         cmd.append('-log')
         cmd.append(os.path.join(thisDir, 'logs', 'cds_aln.cycle.log'))
-        pipes.append(None)
-        cmds.append(cmd)
-        cmd = [which('mv')]
-        cmd.append(outname + '.tmp')
-        cmd.append(outname)
-        pipes.append(None)
-        cmds.append(cmd)
+        tasks.append(newMoveTask(cmd, outname, [cmd[2], cmd[6], cmd[8]]))
 
     # draw the cycle chromosome map
     outname = os.path.join(thisDir, 'stats', 'img.cycle.cmap.pdf')
@@ -1921,13 +3044,7 @@ def transalignStepCmds_1(thisDir, thisParentDir, options):
         cmd.append(outname + '.tmp')
         cmd.append('-blocksize')
         cmd.append(str(DRAW_REV_BLOCK_SIZE))
-        pipes.append(None)
-        cmds.append(cmd)
-        cmd = [which('mv')]
-        cmd.append(outname + '.tmp')
-        cmd.append(outname)
-        pipes.append(None)
-        cmds.append(cmd)
+        tasks.append(newMoveTask(cmd, outname, [cmd[2]]))
 
     # draw the cycle dot plot
     outname = os.path.join(thisDir, 'stats', 'img.cycle.lmap.png')
@@ -1939,13 +3056,7 @@ def transalignStepCmds_1(thisDir, thisParentDir, options):
         cmd.append(outname + '.tmp')
         cmd.append('-npp')
         cmd.append(str(DRAW_REV_NT_PER_PIX))
-        pipes.append(None)
-        cmds.append(cmd)
-        cmd = [which('mv')]
-        cmd.append(outname + '.tmp')
-        cmd.append(outname)
-        pipes.append(None)
-        cmds.append(cmd)
+        tasks.append(newMoveTask(cmd, outname, [cmd[2]]))
 
     outname = os.path.join(thisDir, 'stats', 'tmpstats.branch.difflength.txt')
     if not os.path.exists(outname):
@@ -1955,13 +3066,7 @@ def transalignStepCmds_1(thisDir, thisParentDir, options):
         cmd.append(os.path.join(thisDir, 'aln.rev'))
         cmd.append('-log')
         cmd.append(outname + '.tmp')
-        pipes.append(None)
-        cmds.append(cmd)
-        cmd = [which('mv')]
-        cmd.append(outname + '.tmp')
-        cmd.append(outname)
-        pipes.append(None)
-        cmds.append(cmd)
+        tasks.append(newMoveTask(cmd, outname, [cmd[3]]))
     
     outname = os.path.join(thisDir, 'stats', 'tmpstats.cycle.difflength.txt')
     if not os.path.exists(outname):
@@ -1971,13 +3076,7 @@ def transalignStepCmds_1(thisDir, thisParentDir, options):
         cmd.append(os.path.join(thisDir, 'intra', 'intra.aln.rev'))
         cmd.append('-log')
         cmd.append(outname + '.tmp')
-        pipes.append(None)
-        cmds.append(cmd)
-        cmd = [which('mv')]
-        cmd.append(outname + '.tmp')
-        cmd.append(outname)
-        pipes.append(None)
-        cmds.append(cmd)
+        tasks.append(newMoveTask(cmd, outname, [cmd[3]]))
     
     # draw the branch chromosome map
     outname = os.path.join(thisDir, 'stats', 'img.branch.cmap.pdf')
@@ -1989,13 +3088,7 @@ def transalignStepCmds_1(thisDir, thisParentDir, options):
         cmd.append(outname + '.tmp')
         cmd.append('-blocksize')
         cmd.append(str(DRAW_REV_BLOCK_SIZE))
-        pipes.append(None)
-        cmds.append(cmd)
-        cmd = [which('mv')]
-        cmd.append(outname + '.tmp')
-        cmd.append(outname)
-        pipes.append(None)
-        cmds.append(cmd)
+        tasks.append(newMoveTask(cmd, outname, [cmd[2]]))
     
     # draw the branch dot plot
     outname = os.path.join(thisDir, 'stats', 'img.branch.lmap.png')
@@ -2007,13 +3100,7 @@ def transalignStepCmds_1(thisDir, thisParentDir, options):
         cmd.append(outname + '.tmp')
         cmd.append('-npp')
         cmd.append(str(DRAW_REV_NT_PER_PIX))
-        pipes.append(None)
-        cmds.append(cmd)
-        cmd = [which('mv')]
-        cmd.append(outname + '.tmp')
-        cmd.append(outname)
-        pipes.append(None)
-        cmds.append(cmd)
+        tasks.append(newMoveTask(cmd, outname, [cmd[2]]))
     
     outname = os.path.join(thisDir, 'stats', 'cds_aln.branch.rev')
     if not os.path.exists(outname):
@@ -2028,13 +3115,7 @@ def transalignStepCmds_1(thisDir, thisParentDir, options):
         cmd.append(os.path.join(thisDir, 'annots.gff'))
         cmd.append('-log')
         cmd.append(os.path.join(thisDir, 'logs', 'cds_aln.branch.log'))
-        pipes.append(None)
-        cmds.append(cmd)
-        cmd = [which('mv')]
-        cmd.append(outname + '.tmp')
-        cmd.append(outname)
-        pipes.append(None)
-        cmds.append(cmd)
+        tasks.append(newMoveTask(cmd, outname, [cmd[2], cmd[6], cmd[8]]))
     
     outname = os.path.join(thisDir, 'stats', 'codonSubs.cycle.txt')
     if not os.path.exists(outname):
@@ -2045,13 +3126,7 @@ def transalignStepCmds_1(thisDir, thisParentDir, options):
         cmd.append(outname + '.tmp')
         cmd.append('-log')
         cmd.append(os.path.join(thisDir, 'logs', 'getCodonSubs.cycle.log'))
-        pipes.append(None)
-        cmds.append(cmd)
-        cmd = [which('mv')]
-        cmd.append(outname + '.tmp')
-        cmd.append(outname)
-        pipes.append(None)
-        cmds.append(cmd)
+        tasks.append(newMoveTask(cmd, outname, [cmd[2]]))
         
     outname = os.path.join(thisDir, 'stats', 'codonSubs.branch.txt')
     if not os.path.exists(outname):
@@ -2062,23 +3137,56 @@ def transalignStepCmds_1(thisDir, thisParentDir, options):
         cmd.append(outname + '.tmp')
         cmd.append('-log')
         cmd.append(os.path.join(thisDir, 'logs', 'getCodonSubs.branch.log'))
-        pipes.append(None)
-        cmds.append(cmd)
-        cmd = [which('mv')]
-        cmd.append(outname + '.tmp')
-        cmd.append(outname)
-        pipes.append(None)
-        cmds.append(cmd)
+        tasks.append(newMoveTask(cmd, outname, [cmd[2]]))
     
-    return cmds, pipes
+    return tasks
+
+def newMoveTask(cmd, outname, inputs):
+    """ returns a CmdTask that runs cmd, which writes outname + '.tmp', and then
+    atomically moves the .tmp into place as outname.
+    """
+    from libSimControl import which
+    from libSimControlClasses import CmdTask
+    return CmdTask([cmd, ['mv', outname + '.tmp', outname]], inputs, [outname])
+
+def runCommandGraph(tasks, localTempDir, maxParallel = None):
+    """ runCommandGraph takes a list of CmdTask objects and runs them with at
+    most maxParallel tasks at once (None is unbounded). A task is started only
+    once every task that produces one of its inputs has finished, ready tasks are
+    started in the order given. The commands within a task are run serially.
+    If a task fails no further tasks are started and the error is raised once
+    the running tasks have finished.
+    """
+    from libSimControl import runCommands, runThreadPool
+    
+    producers = {}
+    for i, t in enumerate(tasks):
+        for o in t.outputs:
+            producers[o] = i
+    deps = []
+    for t in tasks:
+        deps.append(set([producers[f] for f in t.inputs if f in producers]))
+    # check for cycles so that the workers below can never deadlock
+    done = set()
+    remaining = range(0, len(tasks))
+    while remaining != []:
+        ready = [i for i in remaining if deps[i] <= done]
+        if ready == []:
+            raise RuntimeError('runCommandGraph: dependency cycle among tasks %s' % 
+                               str([tasks[i].outputs for i in remaining]))
+        done.update(ready)
+        remaining = [i for i in remaining if i not in done]
+    def run(i):
+        runCommands(tasks[i].cmds, localTempDir, inPipes = tasks[i].inPipes, 
+                    outPipes = tasks[i].outPipes)
+    runThreadPool(len(tasks), run, maxParallel = maxParallel, deps = deps)
 
 def runTransalignStepCmds_2(thisDir, thisParentDir, localTempDir, options):
     """ Produces a list of commands to run a stats step,
     called by StatsStep4
     """
-    from libSimControl import which, verifyDirExists, verifyFileExists
+    from libSimControl import which, verifyDirExists, verifyFileExists, runCommands
     import os
-    import subprocess
     for d in [thisDir, thisParentDir]:
         verifyDirExists(d)
     for f in [os.path.join(thisDir, 'seq.rev'), os.path.join(options.rootDir, 'seq.rev')]:
@@ -2111,7 +3219,7 @@ def runTransalignStepCmds_2(thisDir, thisParentDir, localTempDir, options):
     
     outname = os.path.join(thisDir, 'stats', 'diffs.cycle.txt')
     if not os.path.exists(outname):
-        cmd = [which('cat')]
+        cmd = ['cat']
         verifyFileExists(os.path.join(thisDir, 'stats', 'tmpstats.cycle.difflength.txt'))
         verifyFileExists(os.path.join(thisDir, 'stats', 'tmpstats.cycle.diffcompost.txt'))
         verifyFileExists(os.path.join(thisDir, 'stats', 'tmpstats.cycle.diffannots.txt'))
@@ -2125,7 +3233,7 @@ def runTransalignStepCmds_2(thisDir, thisParentDir, localTempDir, options):
     
     outname = os.path.join(thisDir, 'stats', 'diffs.branch.txt')
     if not os.path.exists(outname):
-        cmd = [which('cat')]
+        cmd = ['cat']
         verifyFileExists(os.path.join(thisDir, 'stats', 'tmpstats.branch.difflength.txt'))
         verifyFileExists(os.path.join(thisDir, 'stats', 'tmpstats.branch.diffcompost.txt'))
         verifyFileExists(os.path.join(thisDir, 'stats', 'tmpstats.branch.diffannots.txt'))
@@ -2137,24 +3245,11 @@ def runTransalignStepCmds_2(thisDir, thisParentDir, localTempDir, options):
         outPipes.append(outname + '.tmp')
         outnames.append(outname)
     
-    for i, c in enumerate(cmds, 0):
-        if inPipes[i] is None:
-            p = subprocess.Popen(c, cwd = localTempDir, stdout = subprocess.PIPE)
-            f = open(outPipes[i], 'w')
-            f.write(p.communicate()[0])
-            f.close()
-            handleReturnCode(p.returncode, c)
-        else:
-            p = subprocess.Popen(c, cwd = localTempDir, stdin = subprocess.PIPE, stdout = subprocess.PIPE)
-            f = open(outPipes[i], 'w')
-            f.write(p.communicate(open(inPipes[i]).read())[0])
-            f.close()
-            handleReturnCode(p.returncode, c)
+    runCommands(cmds, localTempDir, inPipes = inPipes, outPipes = outPipes)
+    mvCmds = []
     for i, out in enumerate(outnames, 0):
-        c = [which('mv'), outnames[i] + '.tmp', outnames[i]]
-        p = subprocess.Popen(c)
-        p.wait()
-        handleReturnCode(p.returncode, c)
+        mvCmds.append(['mv', outnames[i] + '.tmp', outnames[i]])
+    runCommands(mvCmds, localTempDir)
     
 def extractLeafsFromNewick(nt, leafDict):
     """Given a newick tree object, it returns a dict of
@@ -2252,7 +3347,7 @@ def buildMergeCommand(maf1, maf2, out, treelessRootCmd, name, options):
     cmd.append(maf2)
     cmd.append(out + '.tmp')
     cmds = [cmd]
-    cmds.append([which('mv'), out + '.tmp', out])
+    cmds.append(['mv', out + '.tmp', out])
     return cmds
 
 def burninRootName(options):
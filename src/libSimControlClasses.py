@@ -36,59 +36,102 @@ import sys
 class BadInputError(TypeError):
     pass
 
-class SimTree(Target):
+class SimTarget(Target):
+    """ SimTarget is the base class of the simulation targets. Its run() installs
+    the tool table resolved at the start of the simulation, see 
+    lsc.loadToolTable(), and then calls the target's runTarget().
     """
-    The SimTree class runs the entire simulation. It begins by either calling one Tree() or
-    two Tree() targets depending on the newick tree. It then waits for the simulation to complete.
+    def run(self):
+        lsc.loadToolTable(self.options)
+        self.runTarget()
+
+class SimTree(SimTarget):
+    """
+    The SimTree class runs the entire simulation. It begins by building the StepPlan
+    for the simulation and then calling one Tree() or two Tree() targets depending
+    on the newick tree. It then waits for the simulation to complete.
     """
     def __init__(self, options):
-        Target.__init__(self)
+        SimTarget.__init__(self)
         self.options = options
 
-    def run(self):
-        nt = newickTreeParser(self.options.inputNewick, 0.0)
-        if nt.distance == 0:
-            self.addChildTarget(Tree(lsc.tree2str(nt.left), self.options.parentDir,  
-                                     'left', self.options))
-            self.addChildTarget(Tree(lsc.tree2str(nt.right), self.options.parentDir, 
-                                     'right', self.options))
-        else:
-            self.addChildTarget(Tree(lsc.tree2str(nt), self.options.parentDir, 
-                                     'stem', self.options))
+    def runTarget(self):
+        plan = lsc.buildStepPlan(self.options)
+        lsc.writeStepPlan(plan, self.options.simDir)
+        for c in lsc.stepChildren(plan, 0):
+            self.addChildTarget(Tree(c, self.options))
 
-class Tree(Target):
+class StepPlan:
+    """ The StepPlan class is a flat, indexed table of every cycle in the
+    simulation. It is built once by SimTree and stored in the simulation
+    directory, targets carry only an index into the table. Index 0 is the root.
+    children is a list of (type, name) tuples where type is one of
+    left, right or stem. remainingSteps is the number of cycles on the longest
+    path from a cycle to a leaf, including the cycle.
+    """
+    def __init__(self):
+        self.names          = []
+        self.parents        = []
+        self.children       = []
+        self.stepLengths    = []
+        self.branchStrs     = []
+        self.isBranch       = []
+        self.isLeaf         = []
+        self.remainingSteps = []
+        self.index          = {}
+
+class CmdTask:
+    """ A CmdTask is a short list of commands that are run serially along with
+    the files that the commands read (inputs) and the files that they finally 
+    produce (outputs). inPipes and outPipes are as for lsc.runCommands(). 
+    lsc.runCommandGraph() uses inputs and outputs to decide which tasks
+    may be run in parallel.
+    """
+    def __init__(self, cmds, inputs, outputs, inPipes = [], outPipes = []):
+        self.cmds     = cmds
+        self.inputs   = inputs
+        self.outputs  = outputs
+        self.inPipes  = inPipes
+        self.outPipes = outPipes
+
+class Tree(SimTarget):
     """ The Tree class launches Cycle()'s as children depending on the 
-    current tree and issues a follow-on, TreeFollow().
+    current tree and issues a follow-on, TreeFollow(). With --overlapCycles
+    the TreeFollow() is instead issued by CycleStep4 and the Stats of a cycle
+    are started once both the cycle and the Stats of its parent are done.
     branchStr is used in TreeFollow to adjust the "random" seed.
     """
-    def __init__(self, thisNewickStr, parentDir, branchStr, options):
-        Target.__init__(self)
-        (self.thisNewickStr, self.thisStepLength)  = lsc.takeNewickStep(thisNewickStr, options)
-        self.parentDir = parentDir
-        self.thisBranchStr = branchStr # either 'left', 'right', 'stem'
+    def __init__(self, stepIndex, options):
+        SimTarget.__init__(self)
+        plan = lsc.getStepPlan(options.simDir)
+        self.stepIndex = stepIndex
+        self.parentDir = lsc.stepDir(plan, plan.parents[stepIndex], options.simDir)
+        self.thisBranchStr = plan.branchStrs[stepIndex] # either 'left', 'right', 'stem'
         self.options = options
         
-    def run(self):
+    def runTarget(self):
         logger.info('Tree object running, %s' % self.parentDir)
+        if self.options.overlapCycles:
+            # CycleStep4 issues the TreeFollow as soon as annots.gff is written
+            # and the Stats are started by lsc.statsHandoff(), in order.
+            self.addChildTarget(Cycle(self.stepIndex, self.options))
+            return
         if self.thisBranchStr in ['left', 'stem']:
             # self.addChildTarget(Transalign(self.parentDir, lsc.getParentDir(self.parentDir), 
             #                                self.options))
             self.addChildTarget(Stats(self.parentDir, lsc.getParentDir(self.parentDir), 
                                       self.options))
-        self.addChildTarget(Cycle(self.thisNewickStr, self.parentDir, 
-                                  self.thisStepLength, self.options))
-        self.setFollowOnTarget(TreeFollow(self.thisNewickStr, self.parentDir, 
-                                          self.thisBranchStr, self.options))
+        self.addChildTarget(Cycle(self.stepIndex, self.options))
+        self.setFollowOnTarget(TreeFollow(self.stepIndex, self.thisBranchStr, self.options))
 
-class TreeFollow(Target):
+class TreeFollow(SimTarget):
     """ TreeFollow launches three to four children: Stats and Transalign for the 
     predecessor Tree step and then one or two new Tree steps, depending on whether
     or not the processor was an internal branch point.
     """
-    def __init__(self, thisNewickStr, thisGrandParentDir, branchStr, options):
-        Target.__init__(self)
-        self.thisNewickStr = thisNewickStr
-        self.thisGrandParentDir = thisGrandParentDir
+    def __init__(self, stepIndex, branchStr, options):
+        SimTarget.__init__(self)
+        self.stepIndex = stepIndex
         self.options = options
         if self.options.seed != 'stochastic':
             if branchStr == 'left':
@@ -99,78 +142,77 @@ class TreeFollow(Target):
                 self.options.seed += 13
             self.options.seed = abs(self.options.seed)
 
-    def run(self):
-        logger.info('TreeFollow object running, %s' % self.thisGrandParentDir)
-        nt = newickTreeParser(self.thisNewickStr, 0.0)
-        name = lsc.nameTree(nt)
-        commonParentDir = os.path.abspath(os.path.join(self.options.simDir, name))
-        if nt.distance == 0:
-            if nt.internal:
-                # branch point
-                branches = { 'left' : lsc.tree2str(nt.left),
-                             'right': lsc.tree2str(nt.right) }
-                for b in branches:
-                    if not lsc.nodeIsLeaf(branches[b]):
-                        self.addChildTarget(Tree(branches[b], commonParentDir, b, self.options))
-                        childDir = lsc.treeStr2Dir(lsc.takeNewickStep(branches[b], self.options)[0], 
-                                                    self.options.simDir)
-            else:
-                # follow up to leaf cycles... Transalign and Stats only
-                self.setFollowOnTarget(LeafCleanUp(commonParentDir, 
-                                                   self.thisGrandParentDir, self.options))
+    def runTarget(self):
+        plan = lsc.getStepPlan(self.options.simDir)
+        commonParentDir = lsc.stepDir(plan, self.stepIndex, self.options.simDir)
+        logger.info('TreeFollow object running, %s' % commonParentDir)
+        if self.options.overlapCycles:
+            # the Stats of this cycle wait on the Stats of its parent as well
+            parentIndex = plan.parents[self.stepIndex]
+            parentDir = lsc.stepDir(plan, parentIndex, self.options.simDir)
+            if (parentIndex == 0 or 
+                lsc.statsHandoff(parentDir, commonParentDir, 'cycle')):
+                self.addChildTarget(Stats(commonParentDir, parentDir, self.options))
+            if plan.isLeaf[self.stepIndex]:
+                return
+        if plan.isLeaf[self.stepIndex]:
+            # follow up to leaf cycles... Transalign and Stats only
+            thisGrandParentDir = lsc.stepDir(plan, plan.parents[self.stepIndex], 
+                                             self.options.simDir)
+            self.setFollowOnTarget(LeafCleanUp(commonParentDir, 
+                                               thisGrandParentDir, self.options))
         else:
-            # stem with distance
-            self.addChildTarget(Tree(lsc.tree2str(nt), commonParentDir, 'stem', self.options))
-            childDir = lsc.treeStr2Dir(lsc.takeNewickStep(lsc.tree2str(nt), self.options)[0], 
-                                        self.options.simDir)
+            # branch point or stem with distance
+            for c in lsc.stepChildren(plan, self.stepIndex):
+                self.addChildTarget(Tree(c, self.options))
 
-class LeafCleanUp(Target):
+class LeafCleanUp(SimTarget):
     """ LeafCleanUp is called by the TreeFollow object. It only runs
     on leaf cycles and it runs the final Transalign and Stats steps for
     those cycles.
     """
     def __init__(self, thisDir, parentDir, options):
-        Target.__init__(self)
+        SimTarget.__init__(self)
         self.thisDir = thisDir
         self.parentDir = parentDir
         self.options = options
-    def run(self):
+    def runTarget(self):
         logger.info('LeafCleanUp object running, %s' % self.thisDir)
         # self.addChildTarget(Transalign(self.thisDir, self.parentDir, self.options))
         self.addChildTarget(Stats(self.thisDir, self.parentDir, self.options))
 
-class Cycle(Target):
+class Cycle(SimTarget):
     """ The Cycle class creates the necessary directory structure for the
     given Cycle and then launches CycleStep1 as a child.
     """
-    def __init__(self, thisNewickStr, thisParentDir, thisStepLength, options):
-        Target.__init__(self)
-        self.thisNewickStr = thisNewickStr
-        self.thisParentDir = thisParentDir
-        self.thisStepLength  = thisStepLength
+    def __init__(self, stepIndex, options, memory = sys.maxint):
+        SimTarget.__init__(self, memory = memory, cpu = lsc.targetCpu(options))
+        plan = lsc.getStepPlan(options.simDir)
+        self.stepIndex = stepIndex
+        self.thisParentDir = lsc.stepDir(plan, plan.parents[stepIndex], options.simDir)
+        self.thisStepLength  = plan.stepLengths[stepIndex]
         self.options = options
-        self.thisDir = lsc.treeStr2Dir(self.thisNewickStr, options.simDir)
+        self.thisDir = lsc.stepDir(plan, stepIndex, options.simDir)
         self.theChild  = os.path.basename(self.thisDir)
         self.theParent = os.path.basename(self.thisParentDir)
-    def run(self):
+    def runTarget(self):
         logger.info('Cycle object running, %s' % self.thisDir)
-        os.mkdir(self.thisDir)
+        if not os.path.exists(self.thisDir):
+            os.mkdir(self.thisDir)
         for d in ['inter', 'intra', 'logs', 'stats', 'xml']:
             if not os.path.exists(os.path.join(self.thisDir, d)):
                 os.mkdir(os.path.join(self.thisDir, d))
-        if not self.options.noMEs:
+        if not self.options.noMEs and not os.path.exists(os.path.join(self.thisDir, 'mobiles')):
             os.mkdir(os.path.join(self.thisDir, 'mobiles'))
-        lsc.createNewCycleXmls(self.thisDir, self.thisParentDir, self.thisStepLength, 
-                                self.thisNewickStr, self.options)
-        self.addChildTarget(CycleStep1(self.thisNewickStr, self.thisParentDir, 
-                                       self.thisStepLength, self.options))
+        lsc.createNewCycleXmls(self.stepIndex, self.options)
+        self.addChildTarget(CycleStep1(self.stepIndex, self.options))
 
 class CycleStep1(Cycle):
     """ CycleStep1 consists of an evolver inter step and then the mobiles step.
     """
-    def __init__(self, thisNewickStr, thisParentDir, thisStepLength, options):
-        Cycle.__init__(self, thisNewickStr, thisParentDir, thisStepLength, options)
-    def run(self):
+    def __init__(self, stepIndex, options):
+        Cycle.__init__(self, stepIndex, options)
+    def runTarget(self):
         logger.info('CycleStep1 object running, %s' % self.thisDir)
         lsc.verifyDirExists(self.thisDir)
         lsc.createTimestamp(os.path.join(self.thisDir, 'xml', 'cycle.step1.start.xml'))
@@ -180,87 +222,134 @@ class CycleStep1(Cycle):
                                 self.getLocalTempDir(), self.options)
 
         lsc.createTimestamp(os.path.join(self.thisDir, 'xml', 'cycle.step1.end.xml'))
-        self.setFollowOnTarget(CycleStep2(self.thisNewickStr, self.thisParentDir, 
-                                            self.thisStepLength, self.options))
+        self.setFollowOnTarget(CycleStep2(self.stepIndex, self.options))
 
 class CycleStep2(Cycle):
     """ CycleStep2 sets up the individual evolver intra steps which are run in
-    parallel, one per chromosome.
+    parallel, one per chromosome. The longest chromosomes are launched first and
+    each job's memory request is sized from the chromosome's length. Chromosomes
+    shorter than --chrBatchSize are packed together into jobs.
     """
-    def __init__(self, thisNewickStr, thisParentDir, thisStepLength, options):
-        Cycle.__init__(self, thisNewickStr, thisParentDir, thisStepLength, options)
-    def run(self):
+    def __init__(self, stepIndex, options):
+        Cycle.__init__(self, stepIndex, options)
+    def runTarget(self):
         logger.info('CycleStep2 object running, %s' % self.thisDir)
         lsc.verifyDirExists(self.thisDir)
+        if os.path.exists(os.path.join(self.thisDir, 'xml', 'cycle.step2.end.xml')):
+            # a restart of a cycle whose intra steps are all done
+            self.setFollowOnTarget(CycleStep3(self.stepIndex, self.options))
+            return
         lsc.createTimestamp(os.path.join(self.thisDir, 'xml', 'cycle.step2.start.xml'))
         lsc.verifyDirExists(os.path.join(self.thisDir, 'inter'))
         lsc.verifyFileExists(os.path.join(self.thisDir, 'inter', 'inter.chrnames.txt'))
+        lengths = lsc.getChromosomeLengths(os.path.join(self.thisDir, 'inter', 'inter.outseq.rev'))
+        chroms = []
         f = open(os.path.join(self.thisDir, 'inter', 'inter.chrnames.txt'), 'r')
         for chrom in f:
-            chrom = chrom.strip()
-            self.addChildTarget(CycleStep2Chromosome(self.thisNewickStr, self.thisParentDir,
-                                                       self.thisStepLength, chrom, self.options))
+            chroms.append(chrom.strip())
         f.close()
-        self.setFollowOnTarget(CycleStep2FollowOn(self.thisNewickStr, self.thisParentDir, 
-                                                  self.thisStepLength, self.options))
+        chroms.sort(key = lambda c: lengths.get(c, 0), reverse = True)
+        batch = []
+        batchLength = 0
+        for chrom in chroms:
+            length = lengths.get(chrom)
+            if (self.options.chrBatchSize is None or length is None or 
+                length >= self.options.chrBatchSize):
+                self.addChildTarget(CycleStep2Chromosome(self.stepIndex, [chrom], self.options, 
+                                                         length))
+                continue
+            # small chromosomes are packed into jobs of up to chrBatchSize bp
+            if batch != [] and batchLength + length > self.options.chrBatchSize:
+                self.addChildTarget(CycleStep2Chromosome(self.stepIndex, batch, self.options, 
+                                                         batchLength))
+                batch = []
+                batchLength = 0
+            batch.append(chrom)
+            batchLength += length
+        if batch != []:
+            self.addChildTarget(CycleStep2Chromosome(self.stepIndex, batch, self.options, 
+                                                     batchLength))
+        self.setFollowOnTarget(CycleStep2FollowOn(self.stepIndex, self.options))
 
 
 class CycleStep2FollowOn(Cycle):
     """ CycleStep2 sets up the individual evolver intra steps which are run in
     parallel, one per chromosome.
     """
-    def __init__(self, thisNewickStr, thisParentDir, thisStepLength, options):
-        Cycle.__init__(self, thisNewickStr, thisParentDir, thisStepLength, options)
-    def run(self):
+    def __init__(self, stepIndex, options):
+        Cycle.__init__(self, stepIndex, options)
+    def runTarget(self):
         logger.info('CycleStep2 object complete, preparing to launch CycleStep3, %s' % self.thisDir)
         lsc.createTimestamp(os.path.join(self.thisDir, 'xml', 'cycle.step2.end.xml'))
-        self.setFollowOnTarget(CycleStep3(self.thisNewickStr, self.thisParentDir, 
-                                          self.thisStepLength, self.options))
+        self.setFollowOnTarget(CycleStep3(self.stepIndex, self.options))
 
 class CycleStep2Chromosome(Cycle):
     """ CycleStep2Chromosome is called by CycleStep2. This corresponds to the 
-    evolver intra (within chromosome) step.
+    evolver intra (within chromosome) step. thisChrs is a list of chromosomes,
+    batches of small chromosomes are run in a local pool of --jobCpus workers.
     """
-    def __init__(self, thisNewickStr, thisParentDir, thisStepLength, thisChr, options):
-        Cycle.__init__(self, thisNewickStr, thisParentDir, thisStepLength, options)
-        self.thisChr = thisChr
-    def run(self):
+    def __init__(self, stepIndex, thisChrs, options, chrLength = None):
+        Cycle.__init__(self, stepIndex, options, memory = lsc.chrMemory(chrLength, options))
+        self.thisChrs = thisChrs
+    def runTarget(self):
+        lsc.verifyDirExists(self.thisDir)
         chrNameDict, revChrNameDict = lsc.extractChrNamesDict(self.thisDir)
+        if len(self.thisChrs) == 1:
+            self.runChromosome(self.thisChrs[0], chrNameDict, self.getLocalTempDir())
+            return
+        args = []
+        for c in self.thisChrs:
+            # each chromosome gets its own working directory
+            localTempDir = os.path.join(self.getLocalTempDir(), chrNameDict[c])
+            os.mkdir(localTempDir)
+            # the pool already uses the job's cpus, so each trf runs alone
+            args.append((c, chrNameDict, localTempDir, 1))
+        lsc.runFunctionsP(self.runChromosome, args, maxParallel = self.options.jobCpus or 1)
+
+    def runChromosome(self, thisChr, chrNameDict, localTempDir, trfParallel = None):
         logger.info('CycleStep2Chromosome object running, %s %s %s' 
-                    % (self.thisDir, self.thisChr, chrNameDict[self.thisChr]))
-        lsc.verifyDirExists(self.thisDir)
+                    % (self.thisDir, thisChr, chrNameDict[thisChr]))
+        if os.path.exists(os.path.join(self.thisDir, 'xml', 'cycle.step2.%s.end.xml' 
+                                       % chrNameDict[thisChr])):
+            # a restart, the chromosome's intra outputs are already in place and
+            # running evolver_evo again would overwrite them
+            logger.info('CycleStep2Chromosome skipping finished chromosome, %s %s' 
+                        % (self.thisDir, chrNameDict[thisChr]))
+            return
         lsc.createTimestamp(os.path.join(self.thisDir, 'xml', 'cycle.step2.%s.start.xml' 
-                                         % chrNameDict[self.thisChr]), 
-                            extra = {'name': self.thisChr})
+                                         % chrNameDict[thisChr]), 
+                            extra = {'name': thisChr})
 
         # evolver intra on one chromosome
         cmds = lsc.evolverIntraStepCmd(self.thisDir, self.theChild, self.thisStepLength, 
-                                       self.thisChr, self.options.seed, 
-                                       self.options.paramsDir, self.getLocalTempDir(), self.options)
-        lsc.runCommands(cmds, self.getLocalTempDir())
+                                       thisChr, self.options.seed, 
+                                       self.options.paramsDir, localTempDir, self.options)
+        lsc.runCommands(cmds, localTempDir)
 
         # evolver conversion from .rev to fasta in localTempDir
-        cmds = lsc.evolverIntraStepToFastaCmd(self.thisDir, self.thisStepLength, self.thisChr, 
-                                              self.options.paramsDir, self.getLocalTempDir())
-        lsc.runCommands(cmds, self.getLocalTempDir())
+        cmds = lsc.evolverIntraStepToFastaCmd(self.thisDir, self.thisStepLength, thisChr, 
+                                              self.options.paramsDir, localTempDir)
+        lsc.runCommands(cmds, localTempDir)
             
         # trf wrapper
-        lsc.callEvolverIntraStepTRFCmd(self.thisDir, self.thisChr, self.getLocalTempDir())
+        lsc.callEvolverIntraStepTRFCmd(self.thisDir, thisChr, localTempDir, self.options, 
+                                       trfParallel)
         
         # move the resulting trf files out of localTempDir
-        cmds = lsc.evolverIntraStepMoveTRFCmd(self.thisDir, self.thisChr, self.getLocalTempDir())
-        lsc.runCommands(cmds, self.getLocalTempDir(), mode = 'p')
+        cmds = lsc.evolverIntraStepMoveTRFCmd(self.thisDir, thisChr, localTempDir)
+        lsc.runCommands(cmds, localTempDir, mode = 'p', 
+                        maxParallel = self.options.jobCpus)
         
         lsc.createTimestamp(os.path.join(self.thisDir, 'xml', 
-                                         'cycle.step2.%s.end.xml' % chrNameDict[self.thisChr]),
-                            extra = {'name': self.thisChr})
+                                         'cycle.step2.%s.end.xml' % chrNameDict[thisChr]),
+                            extra = {'name': thisChr})
 
 class CycleStep3(Cycle):
     """ CycleStep3 
     """
-    def __init__(self, thisNewickStr, thisParentDir, thisStepLength, options):
-        Cycle.__init__(self, thisNewickStr, thisParentDir, thisStepLength, options)
-    def run(self):
+    def __init__(self, stepIndex, options):
+        Cycle.__init__(self, stepIndex, options)
+    def runTarget(self):
         logger.info('CycleStep3 object running, %s' % self.thisDir)
         lsc.verifyDirExists(self.thisDir)
         lsc.createTimestamp(os.path.join(self.thisDir, 'xml', 'cycle.step3.start.xml'))
@@ -269,6 +358,8 @@ class CycleStep3(Cycle):
         regex = r'^(chr\S+)\.outseq\.fa.*\.dat'
         pat = re.compile(regex)
         files = glob.glob(os.path.join(self.thisDir, 'intra', '*.dat'))
+        # largest, and so longest running, conversions are started first
+        files.sort(key = os.path.getsize, reverse = True)
         cmds = []
         outPipes = []
         followCmds = []
@@ -285,28 +376,30 @@ class CycleStep3(Cycle):
                 cmds.append(cmd)
                 outPipes.append(outname + '.tmp')
                 # atomic files
-                followCmds.append([lsc.which('mv'), outname + '.tmp', outname])
+                followCmds.append(['mv', outname + '.tmp', outname])
                 followPipes.append(None)
-        lsc.runCommands(cmds, self.getLocalTempDir(), outPipes = outPipes, mode = 'p')
-        lsc.runCommands(followCmds, self.getLocalTempDir(), outPipes = followPipes, mode = 'p')
+        lsc.runCommands(cmds, self.getLocalTempDir(), outPipes = outPipes, mode = 'p', 
+                        maxParallel = self.options.jobCpus)
+        lsc.runCommands(followCmds, self.getLocalTempDir(), outPipes = followPipes, mode = 'p', 
+                        maxParallel = self.options.jobCpus)
         
         catCmd, evoCmd, cvtCmd, followCmds = lsc.evolverIntraMergeCmds(self.thisDir, self.theChild)
         
         lsc.runCommands([catCmd, evoCmd, cvtCmd], self.getLocalTempDir(),
                          outPipes = [os.path.join(self.thisDir, 'intra', 'evannots.gff.tmp'), None, None], 
-                         mode = 'p')
+                         mode = 'p', maxParallel = self.options.jobCpus)
         lsc.runCommands(followCmds, self.getLocalTempDir())
         
         lsc.createTimestamp(os.path.join(self.thisDir, 'xml', 'cycle.step3.end.xml'))
-        self.setFollowOnTarget(CycleStep4(self.thisNewickStr, self.thisParentDir,
-                                            self.thisStepLength, self.options))
+        self.setFollowOnTarget(CycleStep4(self.stepIndex, self.options))
 
 class CycleStep4(Cycle):
-    """ CycleStep4 
+    """ CycleStep4 runs gene deactivation, producing the cycle's annots.gff. With
+    --overlapCycles it then issues the TreeFollow() for the cycle.
     """
-    def __init__(self, thisNewickStr, thisParentDir, thisStepLength, options):
-        Cycle.__init__(self, thisNewickStr, thisParentDir, thisStepLength, options)
-    def run(self):
+    def __init__(self, stepIndex, options):
+        Cycle.__init__(self, stepIndex, options)
+    def runTarget(self):
         logger.info('CycleStep4 object running, %s' % self.thisDir)
         lsc.verifyDirExists(self.thisDir)
         lsc.createTimestamp(os.path.join(self.thisDir, 'xml', 'cycle.step4.start.xml'))
@@ -317,33 +410,36 @@ class CycleStep4(Cycle):
             if not self.options.noGeneDeactivation:
                 # by default gene deactivation is turned on.
                 cmd = lsc.evolverGeneDeactivationStep(self.thisDir, self.thisParentDir)
+                f = open(outname + '.tmp', 'w')
                 p = subprocess.Popen(cmd, cwd = self.getLocalTempDir(), 
-                                     stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
-                out = p.communicate()[0]
-                f=open(outname + '.tmp', 'w')
-                f.write(out)
+                                     stdout = f, stderr = subprocess.STDOUT)
+                p.wait()
                 f.close()
                 os.rename(outname + '.tmp', outname)
             else:
                 # this could cause a proliferation of gene creation.
-                cmd = [lsc.which('cp')]
-                cmd.append(os.path.join(thisDir, 'intra', 'evannots.gff'))
-                cmd.append(os.path.join(thisDir, 'annots.gff'))
+                cmd = ['cp']
+                cmd.append(os.path.join(self.thisDir, 'intra', 'evannots.gff'))
+                cmd.append(os.path.join(self.thisDir, 'annots.gff'))
                 cmds = [cmd]
-                cmds.append([lsc.which('touch'), outname])
+                cmds.append(['touch', outname])
                 lsc.runCommands(cmds, self.getLocalTempDir())
         lsc.createTimestamp(os.path.join(self.thisDir, 'xml', 'cycle.step4.end.xml'))
+        if self.options.overlapCycles:
+            plan = lsc.getStepPlan(self.options.simDir)
+            self.setFollowOnTarget(TreeFollow(self.stepIndex, plan.branchStrs[self.stepIndex], 
+                                              self.options))
 
-class Stats(Target):
+class Stats(SimTarget):
     """ The Stats object is a convenience class that launches
     StatsStep1 as a child.
     """
     def __init__(self, thisDir, thisParentDir, options):
-        Target.__init__(self)
+        SimTarget.__init__(self, cpu = lsc.targetCpu(options))
         self.thisDir = thisDir
         self.thisParentDir = thisParentDir
         self.options = options
-    def run(self):
+    def runTarget(self):
         if self.thisParentDir is None:
             # happens when thisParentDir is the root
             return
@@ -356,16 +452,17 @@ class StatsStep1(Stats):
     """
     def __init__(self, thisDir, thisParentDir, options):
         Stats.__init__(self, thisDir, thisParentDir, options)
-    def run(self):
+    def runTarget(self):
         logger.info('StatsStep1 object running, %s' % self.thisDir)
         lsc.verifyDirExists(self.thisDir)
         lsc.createTimestamp(os.path.join(self.thisDir, 'xml', 'stats.step1.start.xml'))
         
         cmds, followCmds, outPipes = lsc.statsStep1CmdsP(self.thisDir, self.thisParentDir)
-        lsc.runCommands(cmds, self.getLocalTempDir(), outPipes = outPipes, mode = 'p')
+        lsc.runCommands(cmds, self.getLocalTempDir(), outPipes = outPipes, mode = 'p', 
+                        maxParallel = self.options.jobCpus)
         lsc.runCommands(followCmds, self.getLocalTempDir())
-        cmds, outPipes = lsc.statsStep1CmdsS(self.thisDir, self.thisParentDir)
-        lsc.runCommands(cmds, self.getLocalTempDir(), outPipes = outPipes)
+        lsc.expandAnnotations(self.thisDir)
+        lsc.cycleAnnotDiff(self.thisDir, self.thisParentDir)
         
         lsc.createTimestamp(os.path.join(self.thisDir, 'xml', 'stats.step1.end.xml'))
         self.setFollowOnTarget(StatsStep2(self.thisDir, self.thisParentDir, self.options))
@@ -375,11 +472,12 @@ class StatsStep2(Stats):
     """
     def __init__(self, thisDir, thisParentDir, options):
         Stats.__init__(self, thisDir, thisParentDir, options)
-    def run(self):
+    def runTarget(self):
         logger.info('StatsStep2 object running, %s' % self.thisDir)
         lsc.verifyDirExists(self.thisDir)
         lsc.createTimestamp(os.path.join(self.thisDir, 'xml', 'stats.step2.start.xml'))
 
+        lsc.cycleStats(self.thisDir)
         cmds, outPipes = lsc.statsStep2Cmds(self.thisDir, self.thisParentDir, self.options)
         lsc.runCommands(cmds, self.getLocalTempDir(), outPipes = outPipes)
 
@@ -391,13 +489,14 @@ class StatsStep3(Stats):
     """
     def __init__(self, thisDir, thisParentDir, options):
         Stats.__init__(self, thisDir, thisParentDir, options)
-    def run(self):
+    def runTarget(self):
         logger.info('StatsStep3 object running, %s' % self.thisDir)
         lsc.verifyDirExists(self.thisDir)
         lsc.createTimestamp(os.path.join(self.thisDir, 'xml', 'stats.step3.start.xml'))
 
         cmds, pipes = lsc.statsStep3Cmds(self.thisDir, self.thisParentDir, self.options)
         lsc.runCommands(cmds, self.getLocalTempDir(), outPipes = pipes)
+        lsc.branchAnnotDiff(self.thisDir, self.options)
 
         lsc.createTimestamp(os.path.join(self.thisDir, 'xml', 'stats.step3.end.xml'))
         self.setFollowOnTarget(StatsStep4(self.thisDir, self.thisParentDir, self.options))
@@ -407,28 +506,27 @@ class StatsStep4(Stats):
     """
     def __init__(self, thisDir, thisParentDir, options):
         Stats.__init__(self, thisDir, thisParentDir, options)
-    def run(self):
+    def runTarget(self):
         logger.info('StatsStep4 object running, %s' % self.thisDir)
         lsc.verifyDirExists(self.thisDir)
         lsc.createTimestamp(os.path.join(self.thisDir, 'xml', 'stats.step4.start.xml'))
         
-        cmds, pipes = lsc.statsStep4Cmds(self.thisDir, self.thisParentDir, self.options)
-        lsc.runCommands(cmds, self.getLocalTempDir(), outPipes = pipes)
+        lsc.cumulativeStats(self.thisDir, self.thisParentDir)
 
         lsc.createTimestamp(os.path.join(self.thisDir, 'xml', 'stats.step4.end.xml'))
         if lsc.isLeaf(self.thisDir):
             lsc.lastOneOutTurnOffTheLightsSimulation(self.options.simDir, self.options)
 
-class Transalign(Target):
+class Transalign(SimTarget):
     """ The Transalign class is a convenience class that
     launches the TransalignStep.
     """
     def __init__(self, thisDir, thisParentDir, options):
-        Target.__init__(self)
+        SimTarget.__init__(self, cpu = lsc.targetCpu(options))
         self.thisDir = thisDir
         self.thisParentDir = thisParentDir
         self.options = options
-    def run(self):
+    def runTarget(self):
         logger.info('Transalign object running, thisDir: %s thisParentDir: %s' 
                     % (self.thisDir, self.thisParentDir))
         if self.thisParentDir is None:
@@ -443,14 +541,14 @@ class TransalignStep(Transalign):
     """
     def __init__(self, thisDir, thisParentDir, options):
         Transalign.__init__(self, thisDir, thisParentDir, options)
-    def run(self):
+    def runTarget(self):
         logger.info('TransalignStep object running, thisDir: %s thisParentDir: %s' 
                     % (self.thisDir, self.thisParentDir))
         lsc.verifyDirExists(self.thisDir)
         lsc.createTimestamp(os.path.join(self.thisDir, 'xml', 'transalign.start.xml'))
         
-        cmds, pipes = lsc.transalignStepCmds_1(self.thisDir, self.thisParentDir, self.options)
-        lsc.runCommands(cmds, self.getLocalTempDir(), outPipes = pipes)
+        tasks = lsc.transalignStepCmds_1(self.thisDir, self.thisParentDir, self.options)
+        lsc.runCommandGraph(tasks, self.getLocalTempDir(), maxParallel = self.options.jobCpus)
         
         lsc.runTransalignStepCmds_2(self.thisDir, self.thisParentDir, 
                                      self.getLocalTempDir(), self.options)
@@ -459,6 +557,13 @@ class TransalignStep(Transalign):
         lsc.lastOneOutTurnOffTheLightsCycle(self.thisDir)
         if lsc.isLeaf(self.thisDir):
             lsc.lastOneOutTurnOffTheLightsSimulation(self.options.simDir, self.options)
+        if self.options.overlapCycles:
+            # this cycle's Stats are done, the Stats of its children may start
+            plan = lsc.getStepPlan(self.options.simDir)
+            for c in lsc.stepChildren(plan, plan.index[os.path.basename(self.thisDir)]):
+                childDir = lsc.stepDir(plan, c, self.options.simDir)
+                if lsc.statsHandoff(self.thisDir, childDir, 'stats'):
+                    self.addChildTarget(Stats(childDir, self.thisDir, self.options))
 
 class Node:
     """Nodes have one parent and two children,
@@ -537,7 +642,7 @@ class Extract(Target):
             cmd.append('-tomaf')
             cmd.append(outname + '.tmp')
             cmds = [cmd]
-            cmds.append([lsc.which('mv'), outname + '.tmp', outname])
+            cmds.append(['mv', outname + '.tmp', outname])
             lsc.runCommands(cmds, self.getLocalTempDir())
 
 class MergeManager(Target):
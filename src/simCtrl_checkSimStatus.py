@@ -360,7 +360,7 @@ def updateTimingInfo(s, status, options):
     return updated
 
 def updateChromLengthDict(name, status, options):
-    """ calls evolver_cvt to get the length in bp for the chromosomes 
+    """ gets the length in bp for the chromosomes 
     in the 'name' step.
     should only be called once per simulation step, right when the step
     is recorded as 'complete'.
@@ -369,33 +369,15 @@ def updateChromLengthDict(name, status, options):
         status.variables['chromosomeLengthsDict'] = True
         status.chromosomeLengthsDict = {}
     filename = os.path.join(options.simDir, name, 'seq.rev')
-    cmd = [lsc.which('evolver_cvt')]
-    cmd.append('-dumpchrids')
-    cmd.append(filename)
-    out = subprocess.Popen(cmd, stdout = subprocess.PIPE).communicate()[0]
-    isChroms = False
-    out = out.split('\n')
-    for line in out:
-        data = line.split()
-        if data == []:
-            continue
-        if not isChroms:
-            if len(data) != 4:
-                continue
-            else:
-                if data[0].startswith('='):
-                    isChroms = True
-                    continue
-        if isChroms:
-            l = int(data[2])
-            c = data[3]
-            if c not in status.chromosomeLengthsDict:
-                status.chromosomeLengthsDict[c] = {}
-            if name not in status.chromosomeLengthsDict[c]:
-                status.chromosomeLengthsDict[c][name] = l
-            else:
-                raise RuntimeError('sim step %s has identically named chromosomes "%s"' 
-                                   % (name, c))
+    lengths = lsc.getChromosomeLengths(filename)
+    for c, l in lengths.items():
+        if c not in status.chromosomeLengthsDict:
+            status.chromosomeLengthsDict[c] = {}
+        if name not in status.chromosomeLengthsDict[c]:
+            status.chromosomeLengthsDict[c][name] = l
+        else:
+            raise RuntimeError('sim step %s has identically named chromosomes "%s"' 
+                               % (name, c))
 
 def timeoutParse(filename, timeout = 0.5, retry = 0.1):
     """ timeoutParse() takes an xml filename and attemps to parse the xml
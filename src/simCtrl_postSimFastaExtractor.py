@@ -124,7 +124,7 @@ def main():
         outPipes.append(None)
         cmds.append(cmd)
         
-        cmd = [lsc.which('mv')]
+        cmd = ['mv']
         cmd.append(os.path.join(d, 'seq.fa.tmp'))
         cmd.append(os.path.join(d, 'seq.fa'))
         inPipes.append(None)
@@ -137,7 +137,7 @@ def main():
         outPipes.append(os.path.join(d, 'seq.name.fa.tmp'))
         cmds.append(cmd)
         
-        cmd = [lsc.which('mv')]
+        cmd = ['mv']
         cmd.append(os.path.join(d, 'seq.name.fa.tmp'))
         cmd.append(os.path.join(d, 'seq.name.fa'))
         inPipes.append(None)
@@ -35,16 +35,12 @@ runSim launches a new simulation.
 from evolverSimControl.lib.libSimControlClasses import SimTree
 import evolverSimControl.lib.libSimControl as lsc
 from jobTree.scriptTree.stack import Stack
+import multiprocessing
 from optparse import OptionParser
 import os
 from sonLib.bioio import newickTreeParser
 import sys
 
-# this is the first script to run in a simulation, so it will check for the
-# existance of everything the entire simulation will end up calling, not
-# just the scripts or external files used by runSim.py.
-lsc.verifyPrograms(lsc.requiredPrograms)
-
 def initOptions(parser):
     parser.add_option('--rootDir', dest = 'rootInputDir',
                       help = 'Input root directory.')
@@ -76,6 +72,64 @@ def initOptions(parser):
                       dest = 'noGeneDeactivation', default = False, 
                       help = ('Turns off the gene deactivation step. '
                             'default=%default'))
+    parser.add_option('--overlapCycles', action = 'store_true', 
+                      dest = 'overlapCycles', default = False, 
+                      help = ('Starts the next cycle as soon as the annotations of the '
+                              'current cycle are written, rather than also waiting on the '
+                              'stats of the previous cycle. Stats still run in order '
+                              'along each branch. default=%default'))
+    parser.add_option('--chrMemoryPerBase', dest = 'chrMemoryPerBase', action = 'store',
+                      type = 'float', default = None,
+                      help = ('Bytes of memory requested per bp of chromosome for each '
+                              'per chromosome intra step job. Fit this and --chrMemoryBase '
+                              'from earlier simulations. default=%default (jobTree default)'))
+    parser.add_option('--chrMemoryBase', dest = 'chrMemoryBase', action = 'store',
+                      type = 'float', default = 2**28,
+                      help = ('Bytes of memory requested by each per chromosome intra step job '
+                              'in addition to --chrMemoryPerBase. default=%default'))
+    parser.add_option('--chrBatchSize', dest = 'chrBatchSize', action = 'store',
+                      type = 'int', default = None,
+                      help = ('Chromosomes shorter than this many bp are packed together into '
+                              'intra step jobs of up to this many bp, run --jobCpus at a time. '
+                              'default=%default (one job per chromosome)'))
+    parser.add_option('--trfWindowSize', dest = 'trfWindowSize', action = 'store',
+                      type = 'int', default = None,
+                      help = ('Cut each chromosome into overlapping windows of this many bp '
+                              'and run trf on the windows in parallel, --jobCpus at a time. '
+                              'default=%default (one trf run per chromosome)'))
+    parser.add_option('--trfIncremental', dest = 'trfIncremental', action = 'store_true',
+                      default = False,
+                      help = ('Carry the parent\'s trf hits over the regions of each chromosome '
+                              'left unchanged by the cycle and only run trf on the rest. Falls '
+                              'back to a full scan when most of a chromosome has changed. '
+                              'default=%default'))
+    parser.add_option('--trfIncrementalPadding', dest = 'trfIncrementalPadding', 
+                      action = 'store', type = 'int', default = 1000,
+                      help = ('With --trfIncremental, bp of unchanged sequence required on '
+                              'either side of a carried hit, and rescanned around each '
+                              'changed region. default=%default'))
+    parser.add_option('--trfIncrementalValidate', dest = 'trfIncrementalValidate', 
+                      action = 'store_true', default = False,
+                      help = ('Implies --trfIncremental, also runs a full trf scan, writes the '
+                              'differences to logs/trf.chrSn.validate.log and keeps the '
+                              'full scan. default=%default'))
+    parser.add_option('--executor', dest = 'executor', default = 'jobTree',
+                      type = 'choice', choices = ['jobTree', 'local'],
+                      help = ('Either jobTree, or local to run the simulation on this machine '
+                              'without jobTree. A local simulation is restarted by rerunning '
+                              'the same command. default=%default'))
+    parser.add_option('--cores', dest = 'cores', action = 'store',
+                      type = 'int', default = None,
+                      help = ('Number of worker processes for --executor local. '
+                              'default=%default (all cores)'))
+    parser.add_option('--tool', dest = 'tools', action = 'append', default = [],
+                      help = ('NAME=PATH, use the executable PATH for the program NAME '
+                              'rather than the one found in the PATH. May be repeated.'))
+    parser.add_option('--jobCpus', dest = 'jobCpus', action = 'store',
+                      type = 'int', default = None,
+                      help = ('Number of cpus each cycle and stats job declares to jobTree, '
+                              'also the maximum number of commands a job will run in '
+                              'parallel. default=%default (unbounded)'))
 
 def checkOptions(options, parser):
     if options.inputNewick is None:
@@ -95,10 +149,16 @@ def checkOptions(options, parser):
     # Sim Tree Options
     if options.outDir is None:
         parser.error('specify --outDir.\n')
+    options.restart = False
     if os.path.exists(options.outDir):
-       parser.error('%s already exists! If your simulation crashed, '
-                    'relaunch it with "jobTreeRun --jobTree %s/" \n' % 
-                    (os.path.join(options.outDir), options.jobTree))
+       if (options.executor == 'local' and 
+           os.path.exists(os.path.join(options.outDir, 'simulationInfo.xml'))):
+          # completed outputs are skipped by the targets
+          options.restart = True
+       else:
+          parser.error('%s already exists! If your simulation crashed, '
+                       'relaunch it with "jobTreeRun --jobTree %s/" \n' % 
+                       (os.path.join(options.outDir), options.jobTree))
     options.outDir = os.path.abspath(options.outDir)
     if not os.path.exists(options.outDir):
         os.mkdir(options.outDir)
@@ -116,10 +176,44 @@ def checkOptions(options, parser):
     options.paramsDir = os.path.abspath(options.paramsDir)
     if options.stepLength <= 0:
         parser.error('specify positive stepLength.\n')
+    if options.jobCpus is not None and options.jobCpus < 1:
+        parser.error('specify positive jobCpus.\n')
+    if options.chrMemoryPerBase is not None and options.chrMemoryPerBase < 0:
+        parser.error('specify non-negative chrMemoryPerBase.\n')
+    if options.chrBatchSize is not None and options.chrBatchSize < 1:
+        parser.error('specify positive chrBatchSize.\n')
+    if options.trfWindowSize is not None and options.trfWindowSize < 1:
+        parser.error('specify positive trfWindowSize.\n')
+    if options.trfIncrementalPadding < 0:
+        parser.error('specify non-negative trfIncrementalPadding.\n')
+    if options.trfIncrementalValidate:
+        options.trfIncremental = True
+    if options.cores is None:
+        options.cores = multiprocessing.cpu_count()
+    if options.cores < 1:
+        parser.error('specify positive cores.\n')
     if options.seed != 'stochastic':
         options.seed = int(options.seed)
         # otherwise we let the evolver tools choose their own seeds at random.
 
+def resolveTools(options, parser):
+    """ this is the first script to run in a simulation, so it will check for the
+    existance of everything the entire simulation will end up calling, not
+    just the scripts or external files used by runSim.py. The resolved paths,
+    including any --tool overrides, are stored in options.toolTable for use 
+    by all of the targets.
+    """
+    for t in options.tools:
+        if '=' not in t:
+            parser.error('--tool "%s" should be of the form NAME=PATH.\n' % t)
+        name, path = t.split('=', 1)
+        path = os.path.abspath(path)
+        if not (os.path.exists(path) and os.access(path, os.X_OK)):
+            parser.error('--tool %s is not an executable.\n' % path)
+        lsc.setTool(name, path)
+    lsc.verifyPrograms(lsc.requiredPrograms)
+    options.toolTable = dict(lsc.toolTable)
+
 def newickContainsReservedWord(nt, options):
     """
     newickContainsReservedWord() checks the newick to make sure that
@@ -166,6 +260,9 @@ def populateRootDir(options):
     """ The first order of business in a simulation is to create the basic directory structure
     for the root genome and the parameters.
     """
+    if options.restart:
+        setSimPaths(options)
+        return
     # mkdir is used here for simplicity in timing the creation of the diretory and 
     # subsequent two cp jobs for parameters.
     lsc.runCommands([['mkdir', '-p', os.path.join(options.outDir, 'parameters')]], options.outDir)
@@ -179,14 +276,22 @@ def populateRootDir(options):
         jobs.append(['cp', os.path.join(options.paramsDir,'mes.cfg'),
                      os.path.join(options.outDir, 'parameters')])
     lsc.runCommands(jobs, options.outDir, mode = 'p')
+    setSimPaths(options)
+    lsc.createRootXmls(sys.argv, options)
+
+def setSimPaths(options):
+    """ points the options at the simulation's copies of the parameters and root.
+    """
     options.paramsInputDir = options.paramsDir
     options.paramsDir = os.path.abspath(os.path.join(options.outDir, 'parameters'))
     options.parentDir = os.path.abspath(os.path.join(options.outDir, options.rootName))
     options.simDir, tail = os.path.split(options.parentDir)
     options.rootDir = os.path.abspath(os.path.join(options.simDir, options.rootName))
-    lsc.createRootXmls(sys.argv, options)
     
 def launchSimTree(options):
+    if options.executor == 'local':
+        lsc.runLocalExecutor(SimTree(options), options.cores, options)
+        return
     jobResult = Stack(SimTree(options)).startJobTree(options)
     if jobResult:
         raise RuntimeError('The jobTree contained %d failed jobs!\n' % jobResult)
@@ -200,6 +305,7 @@ def main():
     initOptions(parser)
     Stack.addJobTreeOptions(parser)
     options, args = parser.parse_args()
+    resolveTools(options, parser)
     checkOptions(options, parser)
 
     checkForFiles(options)